@@ -4,10 +4,54 @@ import numpy as np
 from datetime import datetime
 import plotly.express as px
 import plotly.graph_objects as go
-from io import BytesIO
-import os
-import re
-import requests
+import plotly.io as pio
+import sys
+import time
+
+from motor_pagos import (
+    COLUMNAS_TRANSACCIONES,
+    FILAS_POR_PAGINA,
+    FORMATOS_EXPORTACION,
+    INTERVALO_ACTUALIZACION,
+    ActualizadorPeriodico,
+    FuenteGoogleSheets,
+    LedgerPagos,
+    MemoLRU,
+    etapa_medida,
+    main as ejecutar_motor,
+)
+
+# Figuras recordadas (JSON) entre reruns y sesiones; las menos usadas se descartan primero
+TAMANO_CACHE_FIGURAS = 64
+
+# Tasas que el simulador ajusta en toda la vista y tipos de pago que puede imponer a un doctor
+TASAS_SIMULADOR = {
+    'comision_referidor': "Comisión referidor (%)",
+    'cargo_ars': "Cargo ARS (%)",
+    'retencion': "Retención (%)",
+}
+TIPOS_PAGO_SIMULADOR = {"Según la hoja": None, "Porcentaje": 'porcentaje', "Tarifario": 'tarifario'}
+
+# Formato de la tabla de transacciones; se aplica solo a las filas de la página visible
+FORMATOS_TRANSACCIONES = {
+    'pago_por_seguro': '${:,.2f}',
+    'pago_privado': '${:,.2f}',
+    'pago_total_paciente': '${:,.2f}',
+    'laboratorio': '${:,.2f}',
+    'gastos': '${:,.2f}',
+    'monto_a_pagar_por_tarifario': '${:,.2f}',
+    'cargo_por_ars': '${:,.2f}',
+    'descuento_lab': '${:,.2f}',
+    'descuento_gastos': '${:,.2f}',
+    'retencion_10': '${:,.2f}',
+    'costes': '${:,.2f}',
+    'pago_doctor': '${:,.2f}',
+    'pago_referidor': '${:,.2f}',
+    'ingreso_clinica': '${:,.2f}',
+    'retencion': '${:,.2f}',
+    'monto_final_pago': '${:,.2f}',
+    'rentabilidad': '{:.2f}%'
+}
 
 # Configuración de la página
 st.set_page_config(
@@ -184,736 +228,48 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-class DashboardPagos:
-    def __init__(self):
-        self.df = None
-        self.doctores = []
-        self.datos_cargados = False
-        self.google_sheet_url = "https://docs.google.com/spreadsheets/d/1bCijCPK4hCX4v0jJ4KW7RtO1Vu7CDWDrn769OkBHpLU/edit?usp=sharing"
-        self.columna_referidor = None
 
-    def cargar_datos_google_sheets(self):
-        """Cargar datos directamente desde Google Sheets sin autenticación"""
-        try:
-            # Convertir el URL de edición a URL de exportación CSV
-            sheet_id = "1bCijCPK4hCX4v0jJ4KW7RtO1Vu7CDWDrn769OkBHpLU"
-            csv_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv"
-            
-            # Descargar los datos
-            response = requests.get(csv_url)
-            response.raise_for_status()
-            
-            # Leer el CSV
-            self.df = pd.read_csv(BytesIO(response.content))
 
-            # Estandarizar nombres de columnas
-            self.df.columns = self.df.columns.str.strip().str.lower().str.replace(' ', '_')
+class DashboardPagos(LedgerPagos):
+    """Dashboard Streamlit sobre el motor de pagos"""
 
-            # Convertir columnas numéricas
-            columnas_numericas = [
-                'pago_por_seguro', 'pago_privado', 'laboratorio', 'gastos',
-                'monto_a_pagar_por_tarifario', '10%_retencion', 'monto_total_a_pagar'
-            ]
-            
-            for col in columnas_numericas:
-                if col in self.df.columns:
-                    try:
-                        self.df[col] = self.df[col].astype(str)
-                        self.df[col] = self.df[col].str.replace('$', '', regex=False)
-                        self.df[col] = self.df[col].str.replace(',', '', regex=False)
-                        self.df[col] = self.df[col].str.strip()
-                        self.df[col] = pd.to_numeric(self.df[col], errors='coerce').fillna(0)
-                    except Exception as e:
-                        st.error(f"Error procesando columna {col}: {str(e)}")
-                        self.df[col] = 0
-
-            # Convertir fecha si existe la columna
-            if 'fecha' in self.df.columns:
-                self.df['fecha'] = pd.to_datetime(self.df['fecha'], errors='coerce')
-
-            # Lista de doctores
-            if 'doctor_a_pagar' in self.df.columns:
-                self.doctores = sorted(self.df['doctor_a_pagar'].dropna().unique())
-
-            self.datos_cargados = True
-            return True
+    def notificar_error(self, mensaje):
+        """Mostrar en la página los errores del motor"""
+        st.error(mensaje)
 
-        except Exception as e:
-            st.error(f"Error al cargar desde Google Sheets: {str(e)}")
-            st.error("Asegúrate de que el Google Sheet esté configurado para acceso público")
+    @etapa_medida()
+    def cargar_datos_cacheados(self):
+        """Tomar el último dataset publicado por el actualizador (nunca espera a un refresco en curso)"""
+        try:
+            datos = obtener_actualizador().ledger.vigente
+        except Exception:
             self.datos_cargados = False
             return False
 
-    def detectar_columna_referidor(self):
-        """Detectar automáticamente la columna que contiene el nombre del doctor referidor"""
-        if self.df is None:
-            return None
-            
-        posibles_nombres = ['doctor_referidor', 'referidor', 'doctor_referido', 
-                           'medico_referidor', 'dr_referidor', 'referido_por', 'referidor_doctor']
-        
-        for col in self.df.columns:
-            col_lower = col.lower()
-            for posible in posibles_nombres:
-                if posible in col_lower:
-                    return col
-        return None
-
-    def procesar_pagos(self):
-        """Procesar pagos según reglas establecidas"""
-        if self.df is None:
-            return
-
-        self.df['pago_total_paciente'] = self.df['pago_por_seguro'].fillna(0) + self.df['pago_privado'].fillna(0)
-
-        # Inicializar columnas
-        columnas_resultado = [
-            'pago_doctor', 'pago_referidor', 'retencion', 'retencion_10',
-            'descuento_lab', 'descuento_gastos', 'cargo_por_ars',
-            'costes', 'ingreso_clinica', 'monto_final_pago', 'rentabilidad'
-        ]
-        for col in columnas_resultado:
-            self.df[col] = 0.0
-
-        for idx, row in self.df.iterrows():
-            try:
-                pago_total = float(row.get('pago_total_paciente', 0) or 0)
-                pago_doctor = 0.0
-                pago_referidor = 0.0
-                retencion = 0.0
-                cargo_ars = 0.0
-
-                # Cargo ARS
-                pago_seguro_val = float(row.get('pago_por_seguro', 0) or 0)
-                if pago_seguro_val > 0:
-                    cargo_ars = pago_total * 0.10
-
-                # Pago a referidor - CORREGIDO: 10% del pago total del paciente
-                p_ref = str(row.get('paciente_refido', '')).strip().lower()
-                p_ref = p_ref.replace('sí', 'sí')
-                es_referido = bool(re.match(r'^(si|sí|s[ií]|yes|true|1)$', p_ref))
-                
-                if es_referido:
-                    # CORRECCIÓN: Calcular 10% del pago total del paciente
-                    pago_referidor = pago_total * 0.10  # 10% de comisión
-
-                # Tipo de pago
-                cobra_por_porcentaje = False
-                if 'cobra_por_porcentaje' in self.df.columns and pd.notna(row.get('cobra_por_porcentaje')):
-                    cobra_por_porcentaje = str(row.get('cobra_por_porcentaje')).strip().lower() in ['si', 'sí', 'yes', 'true', '1']
-
-                if cobra_por_porcentaje:
-                    porcentaje = 0.5
-                    if '%_de_pago' in self.df.columns and pd.notna(row.get('%_de_pago')):
-                        try:
-                            porcentaje = float(str(row['%_de_pago']).replace('%', '').strip()) / 100
-                        except:
-                            porcentaje = 0.5
-
-                    # CORRECCIÓN: Primero restar gastos del ingreso total, luego aplicar porcentaje
-                    laboratorio = float(row.get('laboratorio', 0) or 0)
-                    gastos = float(row.get('gastos', 0) or 0)
-                    descuentos = laboratorio + gastos
-                    
-                    # Calcular base para el porcentaje (ingreso total menos gastos)
-                    base_para_porcentaje = max(0, pago_total - descuentos - cargo_ars)
-                    
-                    # Aplicar porcentaje al doctor
-                    pago_doctor = base_para_porcentaje * porcentaje
-                    
-                    # Aplicar retención del 10% al pago del doctor
-                    retencion = pago_doctor * 0.10
-                    pago_doctor = pago_doctor - retencion
-                    
-                    descuento_lab = laboratorio
-                    descuento_gastos = gastos
-
-                else:
-                    pago_tarifario = float(row.get('monto_a_pagar_por_tarifario', 0) or 0)
-                    pago_base = max(0, pago_tarifario - cargo_ars)
-                    retencion = pago_base * 0.10
-                    pago_doctor = pago_base - retencion
-                    descuento_lab = 0.0
-                    descuento_gastos = 0.0
-
-                # Cálculos finales
-                costes = retencion + descuento_lab + descuento_gastos + cargo_ars
-                ingreso_clinica = pago_total - (pago_doctor + costes + pago_referidor)
-                rentabilidad_pct = (ingreso_clinica / pago_total * 100) if pago_total > 0 else 0
-
-                # Actualizar fila
-                self.df.at[idx, 'pago_doctor'] = pago_doctor
-                self.df.at[idx, 'pago_referidor'] = pago_referidor
-                self.df.at[idx, 'retencion'] = retencion
-                self.df.at[idx, 'retencion_10'] = retencion
-                self.df.at[idx, 'descuento_lab'] = descuento_lab
-                self.df.at[idx, 'descuento_gastos'] = descuento_gastos
-                self.df.at[idx, 'cargo_por_ars'] = cargo_ars
-                self.df.at[idx, 'costes'] = costes
-                self.df.at[idx, 'ingreso_clinica'] = ingreso_clinica
-                self.df.at[idx, 'monto_final_pago'] = pago_doctor
-                self.df.at[idx, 'rentabilidad'] = rentabilidad_pct
-
-            except Exception as e:
-                st.error(f"Error procesando fila {idx}: {str(e)}")
-                continue
-
-    def calcular_metricas_totales(self):
-        """Calcular métricas totales para tarjetas (rentabilidad total como % ponderado)"""
-        if self.df is None:
-            return {}
-
-        try:
-            pago_total_paciente = self.df['pago_total_paciente'].sum() if 'pago_total_paciente' in self.df.columns else 0
-            pago_doctor = self.df['pago_doctor'].sum() if 'pago_doctor' in self.df.columns else 0
-            pago_referidor = self.df['pago_referidor'].sum() if 'pago_referidor' in self.df.columns else 0
-            retencion = self.df['retencion'].sum() if 'retencion' in self.df.columns else 0
-            laboratorio = self.df['laboratorio'].sum() if 'laboratorio' in self.df.columns and pd.api.types.is_numeric_dtype(self.df['laboratorio']) else 0
-            gastos = self.df['gastos'].sum() if 'gastos' in self.df.columns and pd.api.types.is_numeric_dtype(self.df['gastos']) else 0
-            cargo_ars = self.df['cargo_por_ars'].sum() if 'cargo_por_ars' in self.df.columns else 0
-            ingreso_clinica_total = self.df['ingreso_clinica'].sum() if 'ingreso_clinica' in self.df.columns else 0
-            costes_total = self.df['costes'].sum() if 'costes' in self.df.columns else 0
-
-            # Rentabilidad total (% ponderado)
-            rentabilidad_total_pct = (ingreso_clinica_total / pago_total_paciente * 100) if pago_total_paciente > 0 else 0
-
-            metricas = {
-                'total_ingresos': pago_total_paciente,
-                'total_pagos_doctores': pago_doctor,
-                'total_pagos_referidores': pago_referidor,
-                'total_retenciones': retencion,
-                'total_laboratorio': laboratorio,
-                'total_gastos': gastos,
-                'total_cargo_ars': cargo_ars,
-                'total_costes': costes_total,
-                'total_ingreso_clinica': ingreso_clinica_total,
-                'total_rentabilidad': rentabilidad_total_pct,  # %
-                'total_procedimientos': len(self.df),
-                'doctores_unicos': len(self.doctores) if hasattr(self, 'doctores') else 0
-            }
-            return metricas
-        except Exception as e:
-            st.error(f"Error calculando métricas: {str(e)}")
-            return {}
-
-    def obtener_pagos_por_doctor(self):
-        """Resumen de pagos por doctor"""
-        if self.df is None or 'doctor_a_pagar' not in self.df.columns:
-            return pd.DataFrame()
-
-        try:
-            pagos_doctor = self.df.groupby('doctor_a_pagar').agg({
-                'pago_doctor': 'sum',
-                'retencion': 'sum',
-                'rentabilidad': 'mean',  # promedio % rentabilidad por doctor
-                'ingreso_clinica': 'sum',
-                'paciente': 'count'
-            }).reset_index()
-
-            pagos_doctor.columns = ['Doctor', 'Total a Pagar', 'Total Retenido', 'Rentabilidad % Promedio', 'Ingreso Clínica', 'N° Procedimientos']
-            pagos_doctor['Promedio por Procedimiento'] = pagos_doctor['Total a Pagar'] / pagos_doctor['N° Procedimientos'].replace(0, 1)
-
-            return pagos_doctor.sort_values('Total a Pagar', ascending=False)
-        except Exception as e:
-            st.error(f"Error obteniendo pagos por doctor: {str(e)}")
-            return pd.DataFrame()
-
-    def obtener_pagos_por_referidor(self):
-        """Resumen de pagos por doctor referidor"""
-        if self.df is None or 'doctor_referidor' not in self.df.columns or 'paciente_refido' not in self.df.columns:
-            return pd.DataFrame()
-
-        try:
-            # CORREGIDO: Filtrar pacientes referidos correctamente
-            df_referidos = self.df[
-                self.df['paciente_refido'].astype(str).str.lower().str.contains('si|sí|yes|true|1', na=False) &
-                (self.df['pago_referidor'] > 0)
-            ]
-            
-            if len(df_referidos) == 0:
-                return pd.DataFrame()
-
-            pagos_referidor = df_referidos.groupby('doctor_referidor').agg({
-                'pago_referidor': 'sum',
-                'pago_total_paciente': 'sum',
-                'paciente': 'count'
-            }).reset_index()
-
-            pagos_referidor.columns = ['Doctor Referidor', 'Total a Pagar', 'Monto Total Referidos', 'N° Pacientes Referidos']
-            pagos_referidor['Porcentaje Pagado'] = (pagos_referidor['Total a Pagar'] / pagos_referidor['Monto Total Referidos'] * 100).round(2)
-
-            return pagos_referidor.sort_values('Total a Pagar', ascending=False)
-        except Exception as e:
-            st.error(f"Error obteniendo pagos por referidor: {str(e)}")
-            return pd.DataFrame()
-
-    def filtrar_por_fecha(self, fecha_inicio, fecha_fin):
-        """Filtrar por rango de fechas"""
-        if self.df is None or 'fecha' not in self.df.columns:
-            return self.df
-        try:
-            mask = (self.df['fecha'] >= fecha_inicio) & (self.df['fecha'] <= fecha_fin)
-            return self.df.loc[mask]
-        except Exception as e:
-            st.error(f"Error filtrando por fecha: {str(e)}")
-            return self.df
-
-    def generar_reporte_impresion(self, doctor_seleccionado, fecha_inicio, fecha_fin):
-        """Generar reporte optimizado para impresión en hoja 8 1/2 x 11"""
-        if self.df is None or 'doctor_a_pagar' not in self.df.columns:
-            return ""
-        
-        try:
-            # Filtrar datos
-            df_filtrado = self.filtrar_por_fecha(fecha_inicio, fecha_fin)
-            if doctor_seleccionado != "Todos":
-                df_filtrado = df_filtrado[df_filtrado['doctor_a_pagar'] == doctor_seleccionado]
-            
-            if df_filtrado.empty:
-                return ""
-            
-            # Agrupar por paciente y procedimiento
-            reporte_agrupado = df_filtrado.groupby(['paciente', 'procedimiento']).agg({
-                'pago_total_paciente': 'sum',
-                'laboratorio': 'sum',
-                'gastos': 'sum',
-                'retencion_10': 'sum',
-                'monto_final_pago': 'sum'
-            }).reset_index()
-            
-            # Totales generales
-            total_general = df_filtrado.agg({
-                'pago_total_paciente': 'sum',
-                'laboratorio': 'sum',
-                'gastos': 'sum',
-                'retencion_10': 'sum',
-                'monto_final_pago': 'sum'
-            })
-            
-            # Crear HTML para impresión
-            html_content = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="UTF-8">
-                <title>Reporte de Pagos - {doctor_seleccionado}</title>
-                <style>
-                    body {{
-                        font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-                        margin: 0;
-                        padding: 20px;
-                        color: #333;
-                        line-height: 1.4;
-                    }}
-                    .print-container {{
-                        max-width: 800px;
-                        margin: 0 auto;
-                    }}
-                    .header {{
-                        text-align: center;
-                        margin-bottom: 30px;
-                        border-bottom: 3px solid #007aff;
-                        padding-bottom: 20px;
-                    }}
-                    .header h1 {{
-                        color: #1d1d1f;
-                        margin: 0 0 10px 0;
-                        font-size: 28px;
-                    }}
-                    .header-info {{
-                        display: flex;
-                        justify-content: space-between;
-                        margin-top: 15px;
-                        font-size: 14px;
-                        color: #666;
-                    }}
-                    .doctor-info {{
-                        background: #f5f7fa;
-                        padding: 20px;
-                        border-radius: 12px;
-                        margin-bottom: 25px;
-                    }}
-                    .summary-grid {{
-                        display: grid;
-                        grid-template-columns: repeat(4, 1fr);
-                        gap: 15px;
-                        margin-bottom: 25px;
-                    }}
-                    .summary-card {{
-                        background: white;
-                        padding: 15px;
-                        border-radius: 12px;
-                        box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-                        text-align: center;
-                    }}
-                    .summary-card h3 {{
-                        margin: 0;
-                        font-size: 14px;
-                        color: #666;
-                        font-weight: 500;
-                    }}
-                    .summary-card .value {{
-                        font-size: 20px;
-                        font-weight: 600;
-                        color: #007aff;
-                        margin: 8px 0 0 0;
-                    }}
-                    .table {{
-                        width: 100%;
-                        border-collapse: collapse;
-                        margin: 20px 0;
-                        font-size: 12px;
-                    }}
-                    .table th {{
-                        background: #007aff;
-                        color: white;
-                        padding: 12px;
-                        text-align: left;
-                        font-weight: 500;
-                    }}
-                    .table td {{
-                        padding: 10px;
-                        border-bottom: 1px solid #e5e5e7;
-                    }}
-                    .table tr.total-row {{
-                        background: #f5f7fa;
-                        font-weight: 600;
-                    }}
-                    .table tr.total-row td {{
-                        border-top: 2px solid #007aff;
-                        font-size: 13px;
-                    }}
-                    .footer {{
-                        text-align: center;
-                        margin-top: 40px;
-                        color: #666;
-                        font-size: 12px;
-                        border-top: 1px solid #e5e5e7;
-                        padding-top: 20px;
-                    }}
-                    @media print {{
-                        body {{ padding: 15px; }}
-                        .summary-grid {{ page-break-inside: avoid; }}
-                        .table {{ page-break-inside: avoid; }}
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="print-container">
-                    <div class="header">
-                        <h1>🏥 Reporte de Pagos a Doctores</h1>
-                        <div class="header-info">
-                            <div>Doctor: <strong>{doctor_seleccionado}</strong></div>
-                            <div>Período: <strong>{fecha_inicio} a {fecha_fin}</strong></div>
-                            <div>Generado: <strong>{datetime.now().strftime('%Y-%m-%d %H:%M')}</strong></div>
-                        </div>
-                    </div>
-                    
-                    <div class="summary-grid">
-                        <div class="summary-card">
-                            <h3>Total Procedimientos</h3>
-                            <div class="value">{len(df_filtrado)}</div>
-                        </div>
-                        <div class="summary-card">
-                            <h3>Total a Pagar</h3>
-                            <div class="value">${total_general['monto_final_pago']:,.2f}</div>
-                        </div>
-                        <div class="summary-card">
-                            <h3>Total Retenido</h3>
-                            <div class="value">${total_general['retencion_10']:,.2f}</div>
-                        </div>
-                        <div class="summary-card">
-                            <h3>Total Gastos</h3>
-                            <div class="value">${total_general['laboratorio'] + total_general['gastos']:,.2f}</div>
-                        </div>
-                    </div>
-                    
-                    <h2>Detalle por Paciente y Procedimiento</h2>
-                    <table class="table">
-                        <thead>
-                            <tr>
-                                <th>Paciente</th>
-                                <th>Procedimiento</th>
-                                <th>Ingreso Total</th>
-                                <th>Gastos</th>
-                                <th>Retención</th>
-                                <th>Total a Pagar</th>
-                            </tr>
-                        </thead>
-                        <tbody>
-            """
-            
-            # Agregar filas de datos
-            for _, row in reporte_agrupado.iterrows():
-                html_content += f"""
-                            <tr>
-                                <td>{row['paciente']}</td>
-                                <td>{row['procedimiento']}</td>
-                                <td>${row['pago_total_paciente']:,.2f}</td>
-                                <td>${row['laboratorio'] + row['gastos']:,.2f}</td>
-                                <td>${row['retencion_10']:,.2f}</td>
-                                <td>${row['monto_final_pago']:,.2f}</td>
-                            </tr>
-                """
-            
-            # Agregar totales
-            html_content += f"""
-                            <tr class="total-row">
-                                <td colspan="2"><strong>TOTAL GENERAL</strong></td>
-                                <td><strong>${total_general['pago_total_paciente']:,.2f}</strong></td>
-                                <td><strong>${total_general['laboratorio'] + total_general['gastos']:,.2f}</strong></td>
-                                <td><strong>${total_general['retencion_10']:,.2f}</strong></td>
-                                <td><strong>${total_general['monto_final_pago']:,.2f}</strong></td>
-                            </tr>
-                        </tbody>
-                    </table>
-                    
-                    <div class="footer">
-                        <p>Reporte generado automáticamente por Sistema de Pagos Clínica Padilla</p>
-                        <p>© 2024 Clínica Padilla - Todos los derechos reservados</p>
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
-            
-            return html_content
-            
-        except Exception as e:
-            st.error(f"Error generando reporte de impresión: {str(e)}")
-            return ""
-
-    def generar_reporte_para_doctores(self, doctor_seleccionado, fecha_inicio, fecha_fin):
-        """Generar reporte para doctores optimizado para impresión"""
-        if self.df is None or 'doctor_a_pagar' not in self.df.columns:
-            return ""
-        
-        try:
-            # Filtrar datos
-            df_filtrado = self.filtrar_por_fecha(fecha_inicio, fecha_fin)
-            if doctor_seleccionado != "Todos":
-                df_filtrado = df_filtrado[df_filtrado['doctor_a_pagar'] == doctor_seleccionado]
-            
-            if df_filtrado.empty:
-                return ""
-            
-            # Agrupar por paciente y procedimiento
-            reporte_agrupado = df_filtrado.groupby(['paciente', 'procedimiento']).agg({
-                'laboratorio': 'sum',
-                'gastos': 'sum',
-                'retencion_10': 'sum',
-                'monto_final_pago': 'sum'
-            }).reset_index()
-            
-            # Totales generales
-            total_general = df_filtrado.agg({
-                'laboratorio': 'sum',
-                'gastos': 'sum',
-                'retencion_10': 'sum',
-                'monto_final_pago': 'sum'
-            })
-            
-            # Crear HTML para impresión
-            html_content = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="UTF-8">
-                <title>Reporte para Doctores - {doctor_seleccionado}</title>
-                <style>
-                    body {{
-                        font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-                        margin: 0;
-                        padding: 20px;
-                        color: #333;
-                        line-height: 1.4;
-                    }}
-                    .print-container {{
-                        max-width: 800px;
-                        margin: 0 auto;
-                    }}
-                    .header {{
-                        text-align: center;
-                        margin-bottom: 30px;
-                        border-bottom: 3px solid #007aff;
-                        padding-bottom: 20px;
-                    }}
-                    .header h1 {{
-                        color: #1d1d1f;
-                        margin: 0 0 10px 0;
-                        font-size: 28px;
-                    }}
-                    .header-info {{
-                        display: flex;
-                        justify-content: space-between;
-                        margin-top: 15px;
-                        font-size: 14px;
-                        color: #666;
-                    }}
-                    .summary-grid {{
-                        display: grid;
-                        grid-template-columns: repeat(4, 1fr);
-                        gap: 15px;
-                        margin-bottom: 25px;
-                    }}
-                    .summary-card {{
-                        background: white;
-                        padding: 15px;
-                        border-radius: 12px;
-                        box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-                        text-align: center;
-                    }}
-                    .summary-card h3 {{
-                        margin: 0;
-                        font-size: 14px;
-                        color: #666;
-                        font-weight: 500;
-                    }}
-                    .summary-card .value {{
-                        font-size: 20px;
-                        font-weight: 600;
-                        color: #007aff;
-                        margin: 8px 0 0 0;
-                    }}
-                    .table {{
-                        width: 100%;
-                        border-collapse: collapse;
-                        margin: 20px 0;
-                        font-size: 12px;
-                    }}
-                    .table th {{
-                        background: #007aff;
-                        color: white;
-                        padding: 12px;
-                        text-align: left;
-                        font-weight: 500;
-                    }}
-                    .table td {{
-                        padding: 10px;
-                        border-bottom: 1px solid #e5e5e7;
-                    }}
-                    .table tr.total-row {{
-                        background: #f5f7fa;
-                        font-weight: 600;
-                    }}
-                    .table tr.total-row td {{
-                        border-top: 2px solid #007aff;
-                        font-size: 13px;
-                    }}
-                    .footer {{
-                        text-align: center;
-                        margin-top: 40px;
-                        color: #666;
-                        font-size: 12px;
-                        border-top: 1px solid #e5e5e7;
-                        padding-top: 20px;
-                    }}
-                    @media print {{
-                        body {{ padding: 15px; }}
-                        .summary-grid {{ page-break-inside: avoid; }}
-                        .table {{ page-break-inside: avoid; }}
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="print-container">
-                    <div class="header">
-                        <h1>👨‍⚕️ Reporte para Doctores</h1>
-                        <div class="header-info">
-                            <div>Doctor: <strong>{doctor_seleccionado}</strong></div>
-                            <div>Período: <strong>{fecha_inicio} a {fecha_fin}</strong></div>
-                            <div>Generado: <strong>{datetime.now().strftime('%Y-%m-%d %H:%M')}</strong></div>
-                        </div>
-                    </div>
-                    
-                    <div class="summary-grid">
-                        <div class="summary-card">
-                            <h3>Total Procedimientos</h3>
-                            <div class="value">{len(df_filtrado)}</div>
-                        </div>
-                        <div class="summary-card">
-                            <h3>Total a Pagar</h3>
-                            <div class="value">${total_general['monto_final_pago']:,.2f}</div>
-                        </div>
-                        <div class="summary-card">
-                            <h3>Total Retenido</h3>
-                            <div class="value">${total_general['retencion_10']:,.2f}</div>
-                        </div>
-                        <div class="summary-card">
-                            <h3>Total Gastos</h3>
-                            <div class="value">${total_general['laboratorio'] + total_general['gastos']:,.2f}</div>
-                        </div>
-                    </div>
-                    
-                    <h2>Detalle por Paciente y Procedimiento</h2>
-                    <table class="table">
-                        <thead>
-                            <tr>
-                                <th>Paciente</th>
-                                <th>Procedimiento</th>
-                                <th>Gastos</th>
-                                <th>Retención</th>
-                                <th>Total a Pagar</th>
-                            </tr>
-                        </thead>
-                        <tbody>
-            """
-            
-            # Agregar filas de datos
-            for _, row in reporte_agrupado.iterrows():
-                html_content += f"""
-                            <tr>
-                                <td>{row['paciente']}</td>
-                                <td>{row['procedimiento']}</td>
-                                <td>${row['laboratorio'] + row['gastos']:,.2f}</td>
-                                <td>${row['retencion_10']:,.2f}</td>
-                                <td>${row['monto_final_pago']:,.2f}</td>
-                            </tr>
-                """
-            
-            # Agregar totales
-            html_content += f"""
-                            <tr class="total-row">
-                                <td colspan="2"><strong>TOTAL GENERAL</strong></td>
-                                <td><strong>${total_general['laboratorio'] + total_general['gastos']:,.2f}</strong></td>
-                                <td><strong>${total_general['retencion_10']:,.2f}</strong></td>
-                                <td><strong>${total_general['monto_final_pago']:,.2f}</strong></td>
-                            </tr>
-                        </tbody>
-                    </table>
-                    
-                    <div class="footer">
-                        <p>Reporte generado automáticamente por Sistema de Pagos Clínica Padilla</p>
-                        <p>© 2024 Clínica Padilla - Todos los derechos reservados</p>
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
-            
-            return html_content
-            
-        except Exception as e:
-            st.error(f"Error generando reporte para doctores: {str(e)}")
-            return ""
+        self.vigente = datos
+        self.df, self.doctores, self.cubo, self.indice, self.version_resultados = datos[:5]
+        self.reglas = datos.reglas
+        self.datos_cargados = True
+        return True
 
+    @etapa_medida()
     def mostrar_dashboard(self):
         """Render del dashboard"""
         st.markdown('<h1 class="main-header">🏥 Dashboard de Pagos a Doctores</h1>', unsafe_allow_html=True)
 
         # Cargar datos al iniciar
         if not self.datos_cargados:
-            with st.spinner('Cargando datos desde Google Sheets...'):
-                if not self.cargar_datos_google_sheets():
-                    st.error("No se pudieron cargar los datos desde Google Sheets.")
-                    st.info("""
-                    **Solución de problemas:**
-                    1. Asegúrate de que el Google Sheet esté configurado para acceso público
-                    2. Ve a 'Compartir' > 'Configuración de acceso general' > 'Cualquier persona con el enlace'
-                    3. Selecciona 'Lector' como nivel de acceso
-                    """)
+            with st.spinner(f'Cargando datos desde {self.fuente.descripcion}...'):
+                if not self.cargar_datos_cacheados():
+                    st.error(f"No se pudieron cargar los datos desde {self.fuente.descripcion}.")
+                    if isinstance(self.fuente, FuenteGoogleSheets):
+                        st.info("""
+                        **Solución de problemas:**
+                        1. Asegúrate de que el Google Sheet esté configurado para acceso público
+                        2. Ve a 'Compartir' > 'Configuración de acceso general' > 'Cualquier persona con el enlace'
+                        3. Selecciona 'Lector' como nivel de acceso
+                        """)
                     return
-                self.procesar_pagos()
 
         # Sidebar
         with st.sidebar:
@@ -930,24 +286,24 @@ class DashboardPagos:
                 fecha_max = self.df['fecha'].max().date() if 'fecha' in self.df.columns and not self.df.empty else datetime.now().date()
                 fecha_fin = st.date_input("Fecha fin", value=fecha_max)
 
+            actualizador = obtener_actualizador()
             if st.button("🔄 Recargar Datos", use_container_width=True):
-                with st.spinner('Recargando datos desde Google Sheets...'):
-                    if self.cargar_datos_google_sheets():
-                        self.procesar_pagos()
-                        st.success("Datos recargados correctamente")
-                    else:
-                        st.error("Error al recargar los datos")
-
-        # Aplicar filtros
-        df_filtrado = self.filtrar_por_fecha(
+                # El refresco corre en el hilo del actualizador; esta sesión sigue con los datos actuales
+                actualizador.actualizar_ahora()
+                st.success("Actualización solicitada; los datos nuevos aparecerán al terminar")
+            st.caption(f"🕒 Datos publicados: {self.vigente.publicado:%Y-%m-%d %H:%M:%S}")
+            if actualizador.ultimo_error:
+                st.warning(f"El último refresco falló: {actualizador.ultimo_error}")
+            vigilar_publicaciones(self.vigente.publicado)
+
+            mostrar_rendimiento = st.checkbox("⏱️ Panel de rendimiento", key="panel_rendimiento")
+
+        # Métricas principales (de la vista filtrada por doctor y fechas)
+        metricas = self.calcular_metricas_totales(
+            doctor_seleccionado,
             pd.to_datetime(fecha_inicio),
             pd.to_datetime(fecha_fin)
         )
-        if doctor_seleccionado != "Todos" and 'doctor_a_pagar' in df_filtrado.columns:
-            df_filtrado = df_filtrado[df_filtrado['doctor_a_pagar'] == doctor_seleccionado]
-
-        # Métricas principales
-        metricas = self.calcular_metricas_totales()
         
         col1, col2, col3, col4 = st.columns(4)
         
@@ -1018,369 +374,655 @@ class DashboardPagos:
             </div>
             """, unsafe_allow_html=True)
 
-        # Pestañas para diferentes vistas
-        tab1, tab2, tab3, tab4, tab5 = st.tabs(["📋 Resumen", "👨‍⚕️ Doctores", "📈 Gráficos", "🔍 Transacciones", "🖨️ Reportes"])
+        # Pestañas perezosas: solo se ejecuta la abierta; cada una es un fragmento que se reejecuta por su cuenta
+        tab1, tab2, tab3, tab4, tab5, tab6 = crear_pestanas(
+            ["📋 Resumen", "👨‍⚕️ Doctores", "📈 Gráficos", "🔍 Transacciones", "🖨️ Reportes", "🧪 Simulador"],
+            key="pestanas_dashboard"
+        )
+
+        if pestana_abierta(tab1):
+            with tab1:
+                self.mostrar_resumen(metricas, doctor_seleccionado, fecha_inicio, fecha_fin)
+        if pestana_abierta(tab2):
+            with tab2:
+                self.mostrar_doctores()
+        if pestana_abierta(tab3):
+            with tab3:
+                self.mostrar_graficos()
+        if pestana_abierta(tab4):
+            with tab4:
+                self.mostrar_transacciones(doctor_seleccionado, fecha_inicio, fecha_fin)
+        if pestana_abierta(tab5):
+            with tab5:
+                self.mostrar_reportes(fecha_inicio, fecha_fin)
+        if pestana_abierta(tab6):
+            with tab6:
+                self.mostrar_simulador(doctor_seleccionado, fecha_inicio, fecha_fin)
+
+        if mostrar_rendimiento:
+            self.mostrar_panel_rendimiento()
+
+    @st.fragment
+    @etapa_medida('pestana_simulador')
+    def mostrar_simulador(self, doctor_seleccionado, fecha_inicio, fecha_fin):
+        """Pestaña Simulador: tarjetas de la vista filtrada con tasas hipotéticas y su diferencia con las actuales"""
+        st.markdown('<div class="section-header">🧪 Simulador de Tasas</div>', unsafe_allow_html=True)
+        st.caption("Los campos vacíos conservan las tasas de las reglas de pago y los datos de la hoja")
+
+        ajustes = {}
+        for columna, (tasa, etiqueta) in zip(st.columns(len(TASAS_SIMULADOR)), TASAS_SIMULADOR.items()):
+            with columna:
+                valor = st.number_input(
+                    etiqueta, min_value=0.0, max_value=100.0, value=None, step=0.5,
+                    placeholder="Según reglas", key=f"simulador_{tasa}"
+                )
+            if valor is not None:
+                ajustes[tasa] = valor / 100
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            doctor = st.selectbox("Doctor a ajustar", options=["Todos"] + self.doctores, key="simulador_doctor")
+        with col2:
+            tipo_pago = st.selectbox("Tipo de pago", options=list(TIPOS_PAGO_SIMULADOR), key="simulador_tipo_pago")
+        with col3:
+            porcentaje = st.number_input(
+                "Porcentaje del doctor (%)", min_value=0.0, max_value=100.0, value=None, step=1.0,
+                placeholder="Según la hoja", key="simulador_porcentaje"
+            )
+
+        inicio = time.perf_counter()
+        base, simuladas = self.simular_escenario(
+            doctor_seleccionado, pd.to_datetime(fecha_inicio), pd.to_datetime(fecha_fin),
+            ajustes, doctor, TIPOS_PAGO_SIMULADOR[tipo_pago], None if porcentaje is None else porcentaje / 100
+        )
+        milisegundos = (time.perf_counter() - inicio) * 1000
+        if not simuladas:
+            st.info("No hay datos para simular con los filtros seleccionados")
+            return
+
+        # (título, métrica, color de la diferencia): en los pagos y costes un aumento es desfavorable
+        tarjetas = [
+            ("Pagos a Doctores", 'total_pagos_doctores', "inverse"),
+            ("Pagos a Referidores", 'total_pagos_referidores', "inverse"),
+            ("Ingreso Clínica", 'total_ingreso_clinica', "normal"),
+            ("Rentabilidad", 'total_rentabilidad', "normal"),
+            ("Retenciones", 'total_retenciones', "off"),
+            ("Cargo ARS", 'total_cargo_ars', "inverse"),
+            ("Costes", 'total_costes', "inverse"),
+            ("Ingresos Totales", 'total_ingresos', "off"),
+        ]
+        for fila in (tarjetas[:4], tarjetas[4:]):
+            for columna, (titulo, clave, color) in zip(st.columns(4), fila):
+                diferencia = simuladas[clave] - base[clave]
+                if clave == 'total_rentabilidad':
+                    valor, delta = f"{simuladas[clave]:.2f}%", f"{diferencia:+.2f} pp"
+                else:
+                    valor, delta = f"${simuladas[clave]:,.2f}", f"{diferencia:+,.2f}"
+                with columna:
+                    # Sin diferencia visible no se muestra flecha
+                    st.metric(titulo, valor, delta if np.isfinite(diferencia) and round(diferencia, 2) else None, delta_color=color)
+
+        st.caption(f"{simuladas['total_procedimientos']:,} transacciones recalculadas en {milisegundos:.0f} ms")
+
+    @st.fragment
+    @etapa_medida('pestana_resumen')
+    def mostrar_resumen(self, metricas, doctor_seleccionado, fecha_inicio, fecha_fin):
+        """Pestaña Resumen: distribución de gastos de la vista filtrada y evolución diaria"""
+        st.markdown('<div class="section-header">📊 Resumen General</div>', unsafe_allow_html=True)
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.write("**Distribución de Gastos**")
+            self.mostrar_figura(
+                'gastos', lambda: self.figura_gastos(metricas),
+                doctor_seleccionado, fecha_inicio, fecha_fin
+            )
+        
+        with col2:
+            st.write("**Evolución de Ingresos vs Gastos**")
+            if 'fecha' in self.df.columns:
+                try:
+                    self.mostrar_figura('evolucion', self.figura_evolucion)
+                except Exception as e:
+                    st.error(f"Error creando gráfico de evolución: {str(e)}")
+
+    @st.fragment
+    @etapa_medida('pestana_doctores')
+    def mostrar_doctores(self):
+        """Pestaña Doctores: pagos por doctor y por referidor"""
+        st.markdown('<div class="section-header">👨‍⚕️ Pagos por Doctor</div>', unsafe_allow_html=True)
+        
+        pagos_doctor = self.obtener_pagos_por_doctor()
+        
+        if not pagos_doctor.empty:
+            self.mostrar_figura('pagos_doctor', lambda: self.figura_pagos_doctor(pagos_doctor))
+            
+            st.dataframe(
+                pagos_doctor.style.format({
+                    'Total a Pagar': '${:,.2f}',
+                    'Total Retenido': '${:,.2f}',
+                    'Ingreso Clínica': '${:,.2f}',
+                    'Rentabilidad % Promedio': '{:.2f}%',
+                    'Promedio por Procedimiento': '${:,.2f}'
+                }),
+                use_container_width=True,
+                height=400
+            )
+        else:
+            st.info("No hay datos de pagos por doctor")
+        
+        st.markdown('<div class="section-header">🔄 Pagos a Referidores</div>', unsafe_allow_html=True)
+        pagos_referidor = self.obtener_pagos_por_referidor()
+        
+        if not pagos_referidor.empty:
+            st.dataframe(
+                pagos_referidor.style.format({
+                    'Total a Pagar': '${:,.2f}',
+                    'Monto Total Referidos': '${:,.2f}',
+                    'Porcentaje Pagado': '{:.2f}%'
+                }),
+                use_container_width=True
+            )
+            # Comisión tomada de las reglas de pago con que se calculó el ledger publicado
+            comisiones = [f"{valor * 100:g}%" for valor in self.reglas.valores_tasa('comision_referidor')]
+            if len(comisiones) == 1:
+                st.info(f"💡 Los pagos a referidores se calculan como el {comisiones[0]} del monto total pagado por el paciente")
+            else:
+                st.info(
+                    f"💡 Los pagos a referidores se calculan con la comisión de las reglas de pago (entre {comisiones[0]} "
+                    f"y {comisiones[-1]}, según doctor, procedimiento, aseguradora o fecha) sobre el monto total pagado por el paciente"
+                )
+        else:
+            st.info("No hay datos de pagos a referidores")
+
+    @st.fragment
+    @etapa_medida('pestana_graficos')
+    def mostrar_graficos(self):
+        """Pestaña Gráficos: rentabilidad por procedimiento y tipo de pago"""
+        st.markdown('<div class="section-header">📈 Análisis Gráfico</div>', unsafe_allow_html=True)
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            if 'procedimiento' in self.df.columns:
+                try:
+                    self.mostrar_figura('rentabilidad', self.figura_rentabilidad)
+                except Exception as e:
+                    st.error(f"Error creando gráfico de rentabilidad: {str(e)}")
+        
+        with col2:
+            if 'cobra_por_porcentaje' in self.df.columns:
+                try:
+                    self.mostrar_figura('tipo_pago', self.figura_tipo_pago)
+                except Exception as e:
+                    st.error(f"Error creando gráfico de tipos de pago: {str(e)}")
+
+    @st.fragment
+    @etapa_medida('pestana_transacciones')
+    def mostrar_transacciones(self, doctor_seleccionado, fecha_inicio, fecha_fin):
+        """Pestaña Transacciones: tabla paginada de la vista filtrada y exportación"""
+        st.markdown('<div class="section-header">🔍 Detalle de Transacciones</div>', unsafe_allow_html=True)
+
+        # Búsqueda, orden y paginación se resuelven en el servidor; solo se formatea la página visible
+        col1, col2, col3, col4 = st.columns([3, 2, 1, 1])
+        with col1:
+            busqueda = st.text_input(
+                "Buscar paciente, procedimiento o doctor",
+                key="busqueda_transacciones",
+                on_change=volver_a_primera_pagina
+            )
+        with col2:
+            columna_orden = st.selectbox(
+                "Ordenar por",
+                options=[col for col in COLUMNAS_TRANSACCIONES if col in self.df.columns],
+                key="orden_transacciones",
+                on_change=volver_a_primera_pagina
+            )
+        with col3:
+            orden = st.selectbox(
+                "Orden",
+                options=["Ascendente", "Descendente"],
+                key="sentido_transacciones",
+                on_change=volver_a_primera_pagina
+            )
+        with col4:
+            filas_por_pagina = st.selectbox(
+                "Filas por página",
+                options=FILAS_POR_PAGINA,
+                index=1,
+                key="filas_por_pagina_transacciones",
+                on_change=volver_a_primera_pagina
+            )
+
+        pagina_actual = st.session_state.get('pagina_transacciones', 1)
+        pagina_df, total_filas = self.paginar_transacciones(
+            pd.to_datetime(fecha_inicio), pd.to_datetime(fecha_fin), doctor_seleccionado,
+            pagina_actual, filas_por_pagina, busqueda, columna_orden, orden == "Ascendente"
+        )
+        paginas = max(1, -(-total_filas // filas_por_pagina))
+        if pagina_actual > paginas:
+            # El filtro redujo las filas: volver a la última página existente
+            st.session_state['pagina_transacciones'] = pagina_actual = paginas
+            pagina_df, total_filas = self.paginar_transacciones(
+                pd.to_datetime(fecha_inicio), pd.to_datetime(fecha_fin), doctor_seleccionado,
+                pagina_actual, filas_por_pagina, busqueda, columna_orden, orden == "Ascendente"
+            )
+
+        st.dataframe(
+            pagina_df.style.format({col: formato for col, formato in FORMATOS_TRANSACCIONES.items() if col in pagina_df.columns}),
+            use_container_width=True,
+            height=400
+        )
+
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            st.number_input("Página", min_value=1, max_value=paginas, step=1, key="pagina_transacciones")
+        with col2:
+            primera = (pagina_actual - 1) * filas_por_pagina
+            st.caption(
+                f"Filas {min(primera + 1, total_filas):,}–{primera + len(pagina_df):,} de {total_filas:,} "
+                f"· página {pagina_actual} de {paginas}"
+            )
+
+        # La exportación se genera solo al hacer clic (en otro hilo), no en cada interacción
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            formato_exportacion = st.selectbox(
+                "Formato",
+                options=list(FORMATOS_EXPORTACION),
+                format_func=lambda formato: FORMATOS_EXPORTACION[formato]['descripcion'],
+                key="formato_exportacion"
+            )
+        with col2:
+            exportacion = FORMATOS_EXPORTACION[formato_exportacion]
+            rango_exportacion = (pd.to_datetime(fecha_inicio), pd.to_datetime(fecha_fin), doctor_seleccionado)
+            st.download_button(
+                label=f"📥 Descargar {exportacion['descripcion']}",
+                data=lambda: self.exportar_vista(*rango_exportacion, formato_exportacion),
+                file_name=f"pagos_doctores.{exportacion['extension']}",
+                mime=exportacion['mime'],
+                use_container_width=True
+            )
 
-        with tab1:
-            st.markdown('<div class="section-header">📊 Resumen General</div>', unsafe_allow_html=True)
+    @st.fragment
+    @etapa_medida('pestana_reportes')
+    def mostrar_reportes(self, fecha_inicio, fecha_fin):
+        """Pestaña Reportes: reporte de pagos y reporte para doctores"""
+        st.markdown('<div class="section-header">📊 Reportes de Pagos</div>', unsafe_allow_html=True)
+        
+        # Crear pestañas para los diferentes tipos de reportes
+        reporte_tab1, reporte_tab2 = crear_pestanas(
+            ["📋 Reporte de Pagos a Doctores", "👨‍⚕️ Reporte para Doctores"], key="pestanas_reportes"
+        )
+
+        if pestana_abierta(reporte_tab1):
+            with reporte_tab1:
+                self.mostrar_reporte_pagos(fecha_inicio, fecha_fin)
+        if pestana_abierta(reporte_tab2):
+            with reporte_tab2:
+                self.mostrar_reporte_doctores(fecha_inicio, fecha_fin)
+
+    def mostrar_reporte_pagos(self, fecha_inicio, fecha_fin):
+        """Reporte de pagos a doctores para imprimir, con sus filtros y descargas"""
+        # Filtros específicos para el reporte de pagos
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            doctor_reporte = st.selectbox(
+                "Seleccionar Doctor para Reporte",
+                options=["Todos"] + self.doctores,
+                key="doctor_reporte"
+            )
+        
+        with col2:
+            fecha_inicio_reporte = st.date_input(
+                "Fecha inicio reporte",
+                value=fecha_inicio,
+                key="fecha_inicio_reporte"
+            )
+        
+        with col3:
+            fecha_fin_reporte = st.date_input(
+                "Fecha fin reporte", 
+                value=fecha_fin,
+                key="fecha_fin_reporte"
+            )
+        
+        # El reporte se genera solo al pedirlo y queda en caché por doctor, período y versión de datos
+        seleccion = (doctor_reporte, pd.to_datetime(fecha_inicio_reporte), pd.to_datetime(fecha_fin_reporte))
+        if st.button("⚙️ Generar reporte", key="generar_reporte_pagos"):
+            st.session_state['reporte_pagos'] = seleccion
+        html_reporte = self.obtener_reporte('impresion', *seleccion) if st.session_state.get('reporte_pagos') == seleccion else None
+        
+        if html_reporte is None:
+            st.caption("Elija el doctor y el período y pulse «⚙️ Generar reporte»")
+        elif html_reporte:
+            # Vista previa del reporte
+            st.markdown("### 📋 Vista Previa del Reporte de Pagos")
+            st.components.v1.html(html_reporte.decode('utf-8'), height=800, scrolling=True)
             
+            # Botones de descarga: el contenido se lee de la caché solo al hacer clic
             col1, col2 = st.columns(2)
             
             with col1:
-                st.write("**Distribución de Gastos**")
-                gastos = {
-                    'Pagos Doctores': metricas.get('total_pagos_doctores', 0),
-                    'Pagos Referidores': metricas.get('total_pagos_referidores', 0),
-                    'Gastos Laboratorio': metricas.get('total_laboratorio', 0),
-                    'Retenciones': metricas.get('total_retenciones', 0),
-                    'Cargo ARS': metricas.get('total_cargo_ars', 0)
-                }
-                fig_gastos = px.pie(
-                    values=list(gastos.values()),
-                    names=list(gastos.keys()),
-                    title="Distribución de Gastos",
-                    color_discrete_sequence=px.colors.qualitative.Set3
+                st.download_button(
+                    label="📄 Descargar Reporte (HTML)",
+                    data=lambda: self.obtener_reporte('impresion', *seleccion),
+                    file_name=f"reporte_pagos_{doctor_reporte}_{fecha_inicio_reporte}_a_{fecha_fin_reporte}.html",
+                    mime="text/html",
+                    use_container_width=True
                 )
-                fig_gastos.update_traces(textposition='inside', textinfo='percent+label')
-                st.plotly_chart(fig_gastos, use_container_width=True)
             
             with col2:
-                st.write("**Evolución de Ingresos vs Gastos**")
-                if 'fecha' in self.df.columns:
-                    try:
-                        diarios = self.df.groupby('fecha').agg({
-                            'pago_total_paciente': 'sum',
-                            'pago_doctor': 'sum',
-                            'pago_referidor': 'sum'
-                        }).reset_index()
-
-                        fig_evolucion = go.Figure()
-                        fig_evolucion.add_trace(go.Scatter(
-                            x=diarios['fecha'], 
-                            y=diarios['pago_total_paciente'], 
-                            mode='lines', 
-                            name='Ingresos',
-                            line=dict(color='#007aff', width=3)
-                        ))
-                        fig_evolucion.add_trace(go.Scatter(
-                            x=diarios['fecha'], 
-                            y=diarios['pago_doctor'], 
-                            mode='lines', 
-                            name='Pagos Doctores',
-                            line=dict(color='#ff9500', width=3)
-                        ))
-                        fig_evolucion.add_trace(go.Scatter(
-                            x=diarios['fecha'], 
-                            y=diarios['pago_referidor'], 
-                            mode='lines', 
-                            name='Pagos Referidores',
-                            line=dict(color='#34c759', width=3)
-                        ))
-
-                        fig_evolucion.update_layout(
-                            title="Evolución Diaria de Ingresos y Gastos",
-                            plot_bgcolor='rgba(0,0,0,0)',
-                            paper_bgcolor='rgba(0,0,0,0)',
-                            font=dict(color='#1d1d1f')
-                        )
-                        st.plotly_chart(fig_evolucion, use_container_width=True)
-                    except Exception as e:
-                        st.error(f"Error creando gráfico de evolución: {str(e)}")
-
-        with tab2:
-            st.markdown('<div class="section-header">👨‍⚕️ Pagos por Doctor</div>', unsafe_allow_html=True)
-            
-            pagos_doctor = self.obtener_pagos_por_doctor()
-            
-            if not pagos_doctor.empty:
-                fig_barras = px.bar(
-                    pagos_doctor.head(10),
-                    x='Doctor',
-                    y='Total a Pagar',
-                    title="Top 10 Doctores por Monto a Pagar",
-                    color='Total a Pagar',
-                    color_continuous_scale='Blues'
-                )
-                fig_barras.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)'
-                )
-                st.plotly_chart(fig_barras, use_container_width=True)
-                
-                st.dataframe(
-                    pagos_doctor.style.format({
-                        'Total a Pagar': '${:,.2f}',
-                        'Total Retenido': '${:,.2f}',
-                        'Ingreso Clínica': '${:,.2f}',
-                        'Rentabilidad % Promedio': '{:.2f}%',
-                        'Promedio por Procedimiento': '${:,.2f}'
-                    }),
-                    use_container_width=True,
-                    height=400
+                st.download_button(
+                    label="🖨️ Descargar PDF (carta)",
+                    data=lambda: self.obtener_reporte('impresion', *seleccion, formato='pdf'),
+                    file_name=f"reporte_pagos_{doctor_reporte}_{fecha_inicio_reporte}_a_{fecha_fin_reporte}.pdf",
+                    mime="application/pdf",
+                    use_container_width=True
                 )
-            else:
-                st.info("No hay datos de pagos por doctor")
             
-            st.markdown('<div class="section-header">🔄 Pagos a Referidores</div>', unsafe_allow_html=True)
-            pagos_referidor = self.obtener_pagos_por_referidor()
+            st.info("""
+            **💡 Para imprimir:**
+            1. Descarga el PDF: ya viene en hoja 8 1/2 x 11, con encabezado en cada página
+            2. Ábrelo e imprímelo sin cambiar el tamaño de página
+            """)
             
-            if not pagos_referidor.empty:
-                st.dataframe(
-                    pagos_referidor.style.format({
-                        'Total a Pagar': '${:,.2f}',
-                        'Monto Total Referidos': '${:,.2f}',
-                        'Porcentaje Pagado': '{:.2f}%'
-                    }),
-                    use_container_width=True
-                )
-                # CORREGIDO: Mensaje informativo actualizado
-                st.info("💡 Los pagos a referidores se calculan como el 10% del monto total pagado por el paciente")
-            else:
-                st.info("No hay datos de pagos a referidores")
+        else:
+            st.info("No hay datos para generar el reporte con los filtros seleccionados")
 
-        with tab3:
-            st.markdown('<div class="section-header">📈 Análisis Gráfico</div>', unsafe_allow_html=True)
+    def mostrar_reporte_doctores(self, fecha_inicio, fecha_fin):
+        """Reporte para doctores, con sus filtros, descargas y el lote del período en ZIP o PDF"""
+        # Filtros específicos para el reporte para doctores
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            doctor_reporte_doctores = st.selectbox(
+                "Seleccionar Doctor",
+                options=["Todos"] + self.doctores,
+                key="doctor_reporte_doctores"
+            )
+        
+        with col2:
+            fecha_inicio_reporte_doctores = st.date_input(
+                "Fecha inicio",
+                value=fecha_inicio,
+                key="fecha_inicio_reporte_doctores"
+            )
+        
+        with col3:
+            fecha_fin_reporte_doctores = st.date_input(
+                "Fecha fin", 
+                value=fecha_fin,
+                key="fecha_fin_reporte_doctores"
+            )
+        
+        # El reporte se genera solo al pedirlo y queda en caché por doctor, período y versión de datos
+        seleccion = (doctor_reporte_doctores, pd.to_datetime(fecha_inicio_reporte_doctores), pd.to_datetime(fecha_fin_reporte_doctores))
+        if st.button("⚙️ Generar reporte", key="generar_reporte_doctores"):
+            st.session_state['reporte_doctores'] = seleccion
+        html_reporte_doctores = self.obtener_reporte('doctores', *seleccion) if st.session_state.get('reporte_doctores') == seleccion else None
+        
+        if html_reporte_doctores is None:
+            st.caption("Elija el doctor y el período y pulse «⚙️ Generar reporte»")
+        elif html_reporte_doctores:
+            # Vista previa del reporte
+            st.markdown("### 👨‍⚕️ Vista Previa del Reporte para Doctores")
+            st.components.v1.html(html_reporte_doctores.decode('utf-8'), height=800, scrolling=True)
             
+            # Botones de descarga: el contenido se lee de la caché solo al hacer clic
             col1, col2 = st.columns(2)
             
             with col1:
-                if 'procedimiento' in self.df.columns:
-                    try:
-                        rentabilidad_procedimiento = self.df.groupby('procedimiento').agg({
-                            'rentabilidad': 'mean',
-                            'paciente': 'count'
-                        }).reset_index()
-
-                        rentabilidad_procedimiento = rentabilidad_procedimiento[rentabilidad_procedimiento['paciente'] >= 3]
-
-                        if len(rentabilidad_procedimiento) > 0:
-                            fig_rentabilidad = px.bar(
-                                rentabilidad_procedimiento.sort_values('rentabilidad', ascending=False).head(10),
-                                x='procedimiento',
-                                y='rentabilidad',
-                                title="Top 10 Procedimientos más Rentables",
-                                color='rentabilidad',
-                                color_continuous_scale='Greens'
-                            )
-                            fig_rentabilidad.update_layout(
-                                plot_bgcolor='rgba(0,0,0,0)',
-                                paper_bgcolor='rgba(0,0,0,0)'
-                            )
-                            st.plotly_chart(fig_rentabilidad, use_container_width=True)
-                    except Exception as e:
-                        st.error(f"Error creando gráfico de rentabilidad: {str(e)}")
+                st.download_button(
+                    label="📄 Descargar Reporte (HTML)",
+                    data=lambda: self.obtener_reporte('doctores', *seleccion),
+                    file_name=f"reporte_doctores_{doctor_reporte_doctores}_{fecha_inicio_reporte_doctores}_a_{fecha_fin_reporte_doctores}.html",
+                    mime="text/html",
+                    use_container_width=True
+                )
             
             with col2:
-                if 'cobra_por_porcentaje' in self.df.columns:
-                    try:
-                        tipo_pago_counts = self.df['cobra_por_porcentaje'].value_counts()
-                        fig_tipo_pago = px.pie(
-                            values=tipo_pago_counts.values,
-                            names=tipo_pago_counts.index,
-                            title="Distribución de Tipo de Pago",
-                            color_discrete_sequence=px.colors.qualitative.Set3
-                        )
-                        fig_tipo_pago.update_traces(textposition='inside', textinfo='percent+label')
-                        fig_tipo_pago.update_layout(
-                            plot_bgcolor='rgba(0,0,0,0)',
-                            paper_bgcolor='rgba(0,0,0,0)'
-                        )
-                        st.plotly_chart(fig_tipo_pago, use_container_width=True)
-                    except Exception as e:
-                        st.error(f"Error creando gráfico de tipos de pago: {str(e)}")
-
-        with tab4:
-            st.markdown('<div class="section-header">🔍 Detalle de Transacciones</div>', unsafe_allow_html=True)
-
-            columnas_mostrar = [
-                'fecha', 'paciente', 'procedimiento', 'paciente_asegurado',
-                'pago_por_seguro', 'pago_privado', 'pago_total_paciente',
-                'paciente_refido', 'laboratorio', 'gastos',
-                'doctor_a_pagar', 'cobra_por_porcentaje', '%_de_pago',
-                'monto_a_pagar_por_tarifario', 'cargo_por_ars',
-                'descuento_lab', 'descuento_gastos', 'retencion_10',
-                'costes', 'pago_doctor', 'pago_referidor',
-                'ingreso_clinica', 'retencion', 'monto_final_pago', 'rentabilidad'
-            ]
-
-            columnas_disponibles = [col for col in columnas_mostrar if col in df_filtrado.columns]
+                st.download_button(
+                    label="🖨️ Descargar PDF (carta)",
+                    data=lambda: self.obtener_reporte('doctores', *seleccion, formato='pdf'),
+                    file_name=f"reporte_doctores_{doctor_reporte_doctores}_{fecha_inicio_reporte_doctores}_a_{fecha_fin_reporte_doctores}.pdf",
+                    mime="application/pdf",
+                    use_container_width=True
+                )
+            
+            st.info("""
+            **💡 Características del Reporte para Doctores:**
+            • Muestra solo información relevante para el doctor
+            • Incluye: Paciente, Procedimiento, Gastos, Retención, Total a Pagar
+            • PDF tamaño carta listo para imprimir, con encabezados repetidos en cada página
+            • Diseño profesional y fácil de leer
+            """)
+            
+        else:
+            st.info("No hay datos para generar el reporte para doctores con los filtros seleccionados")
 
-            st.dataframe(
-                df_filtrado[columnas_disponibles].style.format({
-                    'pago_por_seguro': '${:,.2f}',
-                    'pago_privado': '${:,.2f}',
-                    'pago_total_paciente': '${:,.2f}',
-                    'laboratorio': '${:,.2f}',
-                    'gastos': '${:,.2f}',
-                    'monto_a_pagar_por_tarifario': '${:,.2f}',
-                    'cargo_por_ars': '${:,.2f}',
-                    'descuento_lab': '${:,.2f}',
-                    'descuento_gastos': '${:,.2f}',
-                    'retencion_10': '${:,.2f}',
-                    'costes': '${:,.2f}',
-                    'pago_doctor': '${:,.2f}',
-                    'pago_referidor': '${:,.2f}',
-                    'ingreso_clinica': '${:,.2f}',
-                    'retencion': '${:,.2f}',
-                    'monto_final_pago': '${:,.2f}',
-                    'rentabilidad': '{:.2f}%'
-                }),
-                use_container_width=True,
-                height=400
+        # Nómina del período: un reporte por doctor en un solo ZIP
+        st.markdown("### 📦 Reportes de Todos los Doctores")
+        rango_lote = (str(fecha_inicio_reporte_doctores), str(fecha_fin_reporte_doctores))
+        if st.button("📦 Generar reportes de todos los doctores (ZIP)", key="generar_lote_doctores"):
+            with st.spinner("Generando reportes de todos los doctores..."):
+                contenido_zip, cantidad = self.generar_lote_reportes_doctores(
+                    pd.to_datetime(fecha_inicio_reporte_doctores),
+                    pd.to_datetime(fecha_fin_reporte_doctores)
+                )
+            if contenido_zip:
+                st.session_state['lote_doctores'] = (rango_lote, contenido_zip, cantidad)
+            else:
+                st.session_state.pop('lote_doctores', None)
+                st.info("No hay datos para generar reportes en el período seleccionado")
+
+        lote = st.session_state.get('lote_doctores')
+        if lote and lote[0] == rango_lote:
+            st.download_button(
+                label=f"⬇️ Descargar {lote[2]} reportes (ZIP)",
+                data=lote[1],
+                file_name=f"reportes_doctores_{rango_lote[0]}_a_{rango_lote[1]}.zip",
+                mime="application/zip",
+                use_container_width=True
             )
 
-            csv = df_filtrado[columnas_disponibles].to_csv(index=False)
+        # Todos los estados del período en un PDF carta; se genera al hacer clic y solo si el período tiene filas
+        df_lote = self.filtrar_por_fecha(pd.to_datetime(rango_lote[0]), pd.to_datetime(rango_lote[1]))
+        if df_lote is not None and not df_lote.empty:
             st.download_button(
-                label="📥 Descargar datos (CSV)",
-                data=csv,
-                file_name="pagos_doctores.csv",
-                mime="text/csv",
+                label="🖨️ Descargar estados de todos los doctores (PDF carta)",
+                data=lambda: self.obtener_reporte(
+                    'doctores', "Todos", pd.to_datetime(rango_lote[0]), pd.to_datetime(rango_lote[1]), formato='pdf'
+                ),
+                file_name=f"reportes_doctores_{rango_lote[0]}_a_{rango_lote[1]}.pdf",
+                mime="application/pdf",
                 use_container_width=True
             )
+        else:
+            st.info("No hay datos en el período seleccionado para el PDF de todos los doctores")
+
+    def mostrar_figura(self, nombre, construir, *filtros):
+        """Mostrar una figura Plotly guardada como JSON por versión de datos y filtros; se construye solo si falta"""
+        if self.version_resultados is None:
+            figura = construir()
+        else:
+            def serializar():
+                figura = construir()
+                return None if figura is None else figura.to_json()
+
+            clave = (self.fuente.identificador, self.version_resultados, nombre) + tuple(filtros)
+            figura_json = obtener_cache_figuras().obtener(clave, serializar)
+            figura = None if figura_json is None else pio.from_json(figura_json)
+        if figura is not None:
+            st.plotly_chart(figura, use_container_width=True)
+
+    def figura_gastos(self, metricas):
+        """Torta de distribución de gastos de la vista filtrada"""
+        gastos = {
+            'Pagos Doctores': metricas.get('total_pagos_doctores', 0),
+            'Pagos Referidores': metricas.get('total_pagos_referidores', 0),
+            'Gastos Laboratorio': metricas.get('total_laboratorio', 0),
+            'Retenciones': metricas.get('total_retenciones', 0),
+            'Cargo ARS': metricas.get('total_cargo_ars', 0)
+        }
+        fig_gastos = px.pie(
+            values=list(gastos.values()),
+            names=list(gastos.keys()),
+            title="Distribución de Gastos",
+            color_discrete_sequence=px.colors.qualitative.Set3
+        )
+        fig_gastos.update_traces(textposition='inside', textinfo='percent+label')
+        return fig_gastos
+
+    def figura_evolucion(self):
+        """Líneas diarias de ingresos, pagos a doctores y pagos a referidores"""
+        diarios = self.obtener_evolucion_diaria()
+
+        fig_evolucion = go.Figure()
+        fig_evolucion.add_trace(go.Scatter(
+            x=diarios['fecha'], 
+            y=diarios['pago_total_paciente'], 
+            mode='lines', 
+            name='Ingresos',
+            line=dict(color='#007aff', width=3)
+        ))
+        fig_evolucion.add_trace(go.Scatter(
+            x=diarios['fecha'], 
+            y=diarios['pago_doctor'], 
+            mode='lines', 
+            name='Pagos Doctores',
+            line=dict(color='#ff9500', width=3)
+        ))
+        fig_evolucion.add_trace(go.Scatter(
+            x=diarios['fecha'], 
+            y=diarios['pago_referidor'], 
+            mode='lines', 
+            name='Pagos Referidores',
+            line=dict(color='#34c759', width=3)
+        ))
+
+        fig_evolucion.update_layout(
+            title="Evolución Diaria de Ingresos y Gastos",
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            font=dict(color='#1d1d1f')
+        )
+        return fig_evolucion
+
+    def figura_pagos_doctor(self, pagos_doctor):
+        """Barras de los 10 doctores con mayor monto a pagar"""
+        fig_barras = px.bar(
+            pagos_doctor.head(10),
+            x='Doctor',
+            y='Total a Pagar',
+            title="Top 10 Doctores por Monto a Pagar",
+            color='Total a Pagar',
+            color_continuous_scale='Blues'
+        )
+        fig_barras.update_layout(
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)'
+        )
+        return fig_barras
+
+    def figura_rentabilidad(self):
+        """Barras de los 10 procedimientos más rentables (con al menos 3 pacientes), o None"""
+        rentabilidad_procedimiento = self.obtener_rentabilidad_por_procedimiento()
+
+        rentabilidad_procedimiento = rentabilidad_procedimiento[rentabilidad_procedimiento['paciente'] >= 3]
+
+        if len(rentabilidad_procedimiento) == 0:
+            return None
+        fig_rentabilidad = px.bar(
+            rentabilidad_procedimiento.sort_values('rentabilidad', ascending=False).head(10),
+            x='procedimiento',
+            y='rentabilidad',
+            title="Top 10 Procedimientos más Rentables",
+            color='rentabilidad',
+            color_continuous_scale='Greens'
+        )
+        fig_rentabilidad.update_layout(
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)'
+        )
+        return fig_rentabilidad
+
+    def figura_tipo_pago(self):
+        """Torta de procedimientos cobrados por porcentaje frente a tarifario"""
+        tipo_pago_counts = self.df['cobra_por_porcentaje'].value_counts()
+        fig_tipo_pago = px.pie(
+            values=tipo_pago_counts.values,
+            names=tipo_pago_counts.index,
+            title="Distribución de Tipo de Pago",
+            color_discrete_sequence=px.colors.qualitative.Set3
+        )
+        fig_tipo_pago.update_traces(textposition='inside', textinfo='percent+label')
+        fig_tipo_pago.update_layout(
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)'
+        )
+        return fig_tipo_pago
+
+    def mostrar_panel_rendimiento(self):
+        """Tiempo, filas y memoria de las etapas de esta ejecución y de la última carga compartida"""
+        columnas = ['etapa', 'padre', 'segundos', 'filas', 'memoria_mb']
+        with st.sidebar.expander("⏱️ Rendimiento", expanded=True):
+            st.caption("Esta ejecución")
+            st.dataframe(self.medidor.tabla().reindex(columns=columnas), hide_index=True)
+            st.caption("Carga y procesamiento compartidos (más recientes al final)")
+            st.dataframe(obtener_actualizador().ledger.medidor.tabla().reindex(columns=columnas).tail(20), hide_index=True)
+
+
+@st.cache_resource(show_spinner=False)
+def obtener_actualizador():
+    """Ledger compartido por todas las sesiones y el hilo que lo mantiene al día"""
+    ledger = LedgerPagos()
+    actualizador = ActualizadorPeriodico(ledger)
+    if ledger.restaurar_snapshot():
+        # Arranque en frío: se publica el snapshot y la fuente se consulta enseguida en segundo plano
+        actualizador.actualizar_ahora()
+    elif not actualizador.actualizar():
+        # Una excepción evita que el fallo quede guardado en la caché
+        raise RuntimeError(actualizador.ultimo_error)
+    return actualizador.iniciar()
+
+
+def crear_pestanas(nombres, key):
+    """Pestañas con ejecución perezosa (solo corre la abierta) si la versión de Streamlit lo permite"""
+    try:
+        return st.tabs(nombres, key=key, on_change="rerun")
+    except TypeError:  # Streamlit sin estado de pestañas: se ejecutan todas, como antes
+        return st.tabs(nombres)
+
+
+def pestana_abierta(pestana):
+    """False solo si Streamlit sabe que la pestaña no es la seleccionada"""
+    return getattr(pestana, 'open', None) is not False
+
+
+@st.cache_resource
+def obtener_cache_figuras():
+    """Figuras Plotly serializadas, compartidas por todas las sesiones del proceso"""
+    return MemoLRU(TAMANO_CACHE_FIGURAS)
+
+
+def volver_a_primera_pagina():
+    """Nueva búsqueda u orden en la tabla de transacciones: mostrar desde la primera página"""
+    st.session_state['pagina_transacciones'] = 1
+
+
+@st.fragment(run_every=INTERVALO_ACTUALIZACION or None)
+def vigilar_publicaciones(publicado):
+    """Volver a ejecutar la página cuando el actualizador publica un dataset más reciente"""
+    vigente = obtener_actualizador().ledger.vigente
+    if vigente is not None and vigente.publicado != publicado:
+        st.rerun(scope="app")
 
-        with tab5:
-            st.markdown('<div class="section-header">📊 Reportes de Pagos</div>', unsafe_allow_html=True)
-            
-            # Crear pestañas para los diferentes tipos de reportes
-            reporte_tab1, reporte_tab2 = st.tabs(["📋 Reporte de Pagos a Doctores", "👨‍⚕️ Reporte para Doctores"])
-            
-            with reporte_tab1:
-                # Filtros específicos para el reporte de pagos
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    doctor_reporte = st.selectbox(
-                        "Seleccionar Doctor para Reporte",
-                        options=["Todos"] + self.doctores,
-                        key="doctor_reporte"
-                    )
-                
-                with col2:
-                    fecha_inicio_reporte = st.date_input(
-                        "Fecha inicio reporte",
-                        value=fecha_inicio,
-                        key="fecha_inicio_reporte"
-                    )
-                
-                with col3:
-                    fecha_fin_reporte = st.date_input(
-                        "Fecha fin reporte", 
-                        value=fecha_fin,
-                        key="fecha_fin_reporte"
-                    )
-                
-                # Generar reporte para impresión
-                html_reporte = self.generar_reporte_impresion(
-                    doctor_reporte,
-                    pd.to_datetime(fecha_inicio_reporte),
-                    pd.to_datetime(fecha_fin_reporte)
-                )
-                
-                if html_reporte:
-                    # Vista previa del reporte
-                    st.markdown("### 📋 Vista Previa del Reporte de Pagos")
-                    st.components.v1.html(html_reporte, height=800, scrolling=True)
-                    
-                    # Botones de descarga
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        st.download_button(
-                            label="📄 Descargar Reporte (HTML)",
-                            data=html_reporte,
-                            file_name=f"reporte_pagos_{doctor_reporte}_{fecha_inicio_reporte}_a_{fecha_fin_reporte}.html",
-                            mime="text/html",
-                            use_container_width=True
-                        )
-                    
-                    with col2:
-                        st.download_button(
-                            label="🖨️ Descargar para Imprimir",
-                            data=html_reporte,
-                            file_name=f"reporte_pagos_{doctor_reporte}_{fecha_inicio_reporte}_a_{fecha_fin_reporte}.html",
-                            mime="text/html",
-                            use_container_width=True
-                        )
-                    
-                    st.info("""
-                    **💡 Para imprimir:**
-                    1. Descarga el reporte en HTML
-                    2. Abre el archivo descargado
-                    3. Usa la opción de imprimir de tu navegador (Ctrl+P)
-                    4. Ajusta la configuración de impresión a hoja 8 1/2 x 11
-                    """)
-                    
-                else:
-                    st.info("No hay datos para generar el reporte con los filtros seleccionados")
-            
-            with reporte_tab2:
-                # Filtros específicos para el reporte para doctores
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    doctor_reporte_doctores = st.selectbox(
-                        "Seleccionar Doctor",
-                        options=["Todos"] + self.doctores,
-                        key="doctor_reporte_doctores"
-                    )
-                
-                with col2:
-                    fecha_inicio_reporte_doctores = st.date_input(
-                        "Fecha inicio",
-                        value=fecha_inicio,
-                        key="fecha_inicio_reporte_doctores"
-                    )
-                
-                with col3:
-                    fecha_fin_reporte_doctores = st.date_input(
-                        "Fecha fin", 
-                        value=fecha_fin,
-                        key="fecha_fin_reporte_doctores"
-                    )
-                
-                # Generar reporte para doctores
-                html_reporte_doctores = self.generar_reporte_para_doctores(
-                    doctor_reporte_doctores,
-                    pd.to_datetime(fecha_inicio_reporte_doctores),
-                    pd.to_datetime(fecha_fin_reporte_doctores)
-                )
-                
-                if html_reporte_doctores:
-                    # Vista previa del reporte
-                    st.markdown("### 👨‍⚕️ Vista Previa del Reporte para Doctores")
-                    st.components.v1.html(html_reporte_doctores, height=800, scrolling=True)
-                    
-                    # Botones de descarga
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        st.download_button(
-                            label="📄 Descargar Reporte (HTML)",
-                            data=html_reporte_doctores,
-                            file_name=f"reporte_doctores_{doctor_reporte_doctores}_{fecha_inicio_reporte_doctores}_a_{fecha_fin_reporte_doctores}.html",
-                            mime="text/html",
-                            use_container_width=True
-                        )
-                    
-                    with col2:
-                        st.download_button(
-                            label="🖨️ Descargar para Imprimir",
-                            data=html_reporte_doctores,
-                            file_name=f"reporte_doctores_{doctor_reporte_doctores}_{fecha_inicio_reporte_doctores}_a_{fecha_fin_reporte_doctores}.html",
-                            mime="text/html",
-                            use_container_width=True
-                        )
-                    
-                    st.info("""
-                    **💡 Características del Reporte para Doctores:**
-                    • Muestra solo información relevante para el doctor
-                    • Incluye: Paciente, Procedimiento, Gastos, Retención, Total a Pagar
-                    • Formato optimizado para impresión
-                    • Diseño profesional y fácil de leer
-                    """)
-                    
-                else:
-                    st.info("No hay datos para generar el reporte para doctores con los filtros seleccionados")
 
 # Ejecutar la aplicación
 if __name__ == "__main__":
+    if not st.runtime.exists() and len(sys.argv) > 1:
+        # Fuera de Streamlit con argumentos: mismos comandos que motor_pagos.py
+        sys.exit(ejecutar_motor(sys.argv[1:]))
     dashboard = DashboardPagos()
     dashboard.mostrar_dashboard()
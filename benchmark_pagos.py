@@ -0,0 +1,246 @@
+"""Benchmark del motor de pagos: ledger sintético y tiempo / memoria pico por etapa"""
+import pandas as pd
+import numpy as np
+from datetime import datetime
+from io import BytesIO
+import argparse
+import gc
+import hashlib
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from motor_pagos import (
+    FuenteDatos,
+    LedgerPagos,
+    leer_csv,
+)
+
+# Tamaños por defecto del ledger sintético (filas)
+TAMANOS_BENCHMARK = [10_000, 100_000, 1_000_000]
+
+# Procedimientos con rango de precio (RD$) y probabilidad de llevar laboratorio
+PROCEDIMIENTOS_SINTETICOS = {
+    'Consulta': (1_500, 3_000, 0.0),
+    'Limpieza': (2_500, 4_500, 0.0),
+    'Resina': (3_000, 6_000, 0.1),
+    'Extracción': (2_000, 5_000, 0.0),
+    'Endodoncia': (12_000, 25_000, 0.2),
+    'Corona': (18_000, 35_000, 0.9),
+    'Puente': (35_000, 70_000, 0.9),
+    'Implante': (45_000, 90_000, 0.8),
+    'Carilla': (15_000, 30_000, 0.9),
+    'Ortodoncia (mensualidad)': (3_000, 6_000, 0.0),
+    'Blanqueamiento': (8_000, 15_000, 0.0),
+    'Prótesis removible': (20_000, 40_000, 1.0),
+}
+
+NOMBRES_SINTETICOS = ['Ana', 'Luis', 'María', 'José', 'Carmen', 'Pedro', 'Rosa', 'Juan', 'Laura', 'Miguel']
+APELLIDOS_SINTETICOS = ['Padilla', 'Pérez', 'Gómez', 'Rodríguez', 'Santos', 'Díaz', 'Martínez', 'Reyes']
+
+# Etapas medidas, en el orden del pipeline
+ETAPAS_BENCHMARK = [
+    'cargar_datos',
+    'procesar_pagos',
+    'obtener_pagos_por_doctor',
+    'filtrar_por_fecha',
+    'generar_reporte_impresion',
+    'generar_reporte_para_doctores',
+]
+
+
+def generar_ledger_sintetico(filas, semilla=0, doctores=40):
+    """Ledger con las columnas y formatos de la hoja (montos "$1,234.00", fechas m/d/Y)"""
+    rng = np.random.default_rng(semilla)
+
+    combinaciones = [f"Dr. {nombre} {apellido}" for apellido in APELLIDOS_SINTETICOS for nombre in NOMBRES_SINTETICOS]
+    nombres_doctores = np.array([
+        combinaciones[i % len(combinaciones)] + (f" {i // len(combinaciones) + 1}" if i >= len(combinaciones) else "")
+        for i in range(doctores)
+    ], dtype=object)
+    # Cada doctor cobra por porcentaje (con su %) o por tarifario
+    cobra_porcentaje = rng.random(doctores) < 0.6
+    porcentaje_doctor = rng.choice(np.array(['40%', '45%', '50%', '60%'], dtype=object), doctores)
+
+    doctor = rng.integers(0, doctores, filas)
+    procedimientos = np.array(list(PROCEDIMIENTOS_SINTETICOS), dtype=object)
+    minimos, maximos, prob_lab = (np.array(v, dtype=np.float64) for v in zip(*PROCEDIMIENTOS_SINTETICOS.values()))
+    procedimiento = rng.integers(0, len(procedimientos), filas)
+    precio = np.round(minimos[procedimiento] + rng.random(filas) * (maximos[procedimiento] - minimos[procedimiento]), -1)
+
+    # Mezcla seguro / privado: con seguro la ARS cubre entre 50% y 90% y el resto es diferencia privada
+    asegurado = rng.random(filas) < 0.55
+    cobertura = np.where(asegurado, rng.uniform(0.5, 0.9, filas), 0.0)
+    pago_seguro = np.round(precio * cobertura, 2)
+    pago_privado = np.round(precio - pago_seguro, 2)
+
+    laboratorio = np.where(rng.random(filas) < prob_lab[procedimiento], np.round(precio * rng.uniform(0.1, 0.3, filas), -1), 0.0)
+    gastos = np.where(rng.random(filas) < 0.3, rng.integers(1, 20, filas) * 100.0, 0.0)
+    tarifario = np.round(precio * rng.uniform(0.3, 0.5, filas), -1)
+
+    # Referidos: ~20% de los pacientes, con las variantes de escritura de la hoja
+    referido = rng.random(filas) < 0.2
+    texto_si = rng.choice(np.array(['Sí', 'Si', 'si', 'SI'], dtype=object), filas)
+    texto_no = rng.choice(np.array(['No', 'no', ''], dtype=object), filas)
+    referidor = np.where(referido, nombres_doctores[rng.integers(0, doctores, filas)], '')
+
+    inicio = np.datetime64('2024-01-01')
+    fechas = inicio + rng.integers(0, 365, filas).astype('timedelta64[D]')
+
+    def montos(valores):
+        return [f"${valor:,.2f}" for valor in valores.tolist()]
+
+    return pd.DataFrame({
+        'Fecha': pd.to_datetime(fechas).strftime('%m/%d/%Y'),
+        'Paciente': [f"Paciente {i}" for i in rng.integers(0, max(filas // 3, 1), filas).tolist()],
+        'Procedimiento': procedimientos[procedimiento],
+        'Pago por Seguro': montos(pago_seguro),
+        'Pago Privado': montos(pago_privado),
+        'Paciente Refido': np.where(referido, texto_si, texto_no),
+        'Doctor Referidor': referidor,
+        'Laboratorio': montos(laboratorio),
+        'Gastos': montos(gastos),
+        'Doctor a Pagar': nombres_doctores[doctor],
+        'Cobra por Porcentaje': np.where(cobra_porcentaje[doctor], 'Sí', 'No'),
+        '% de Pago': np.where(cobra_porcentaje[doctor], porcentaje_doctor[doctor], ''),
+        'Monto a Pagar por Tarifario': montos(tarifario),
+    })
+
+
+def ledger_sintetico_csv(filas, semilla=0):
+    """Exportación CSV del ledger sintético, como la descarga de Google Sheets"""
+    return generar_ledger_sintetico(filas, semilla).to_csv(index=False).encode('utf-8')
+
+
+class FuenteMemoria(FuenteDatos):
+    """CSV ya descargado en memoria: mide la carga sin red"""
+
+    descripcion = "CSV en memoria"
+
+    def __init__(self, contenido):
+        self.contenido = contenido
+        self.version = hashlib.sha256(contenido).hexdigest()
+
+    @property
+    def identificador(self):
+        return f"memoria:{self.version}"
+
+    def leer(self, condicional=True):
+        return leer_csv(BytesIO(self.contenido)), self.version
+
+
+def medir(funcion, preparar=None, repeticiones=3):
+    """Mejor tiempo de varias repeticiones y memoria pico (tracemalloc) de una ejecución aparte"""
+    tiempos = []
+    for _ in range(repeticiones):
+        if preparar is not None:
+            preparar()
+        gc.collect()
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+
+    # La memoria se mide en otra pasada: tracemalloc ralentiza el código Python
+    if preparar is not None:
+        preparar()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        funcion()
+        pico = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'segundos': min(tiempos), 'pico_mb': pico / 2**20}
+
+
+def ejecutar_benchmark(filas, semilla=0, repeticiones=3):
+    """Medir cada etapa del pipeline sobre un ledger sintético de `filas` filas"""
+    contenido = ledger_sintetico_csv(filas, semilla)
+    ledger = LedgerPagos(FuenteMemoria(contenido))
+    resultados = {}
+
+    resultados['cargar_datos'] = medir(ledger.cargar_datos, repeticiones=repeticiones)
+
+    def reiniciar_pagos():
+        # Forzar el cálculo completo en cada repetición
+        ledger.resultados_previos = None
+
+    resultados['procesar_pagos'] = medir(ledger.procesar_pagos, reiniciar_pagos, repeticiones)
+    resultados['obtener_pagos_por_doctor'] = medir(ledger.obtener_pagos_por_doctor, repeticiones=repeticiones)
+
+    # Un mes del doctor con más filas: el caso típico de un reporte de nómina
+    doctor = ledger.df['doctor_a_pagar'].value_counts().index[0]
+    fecha_inicio, fecha_fin = pd.Timestamp('2024-03-01'), pd.Timestamp('2024-03-31')
+    ledger.obtener_indice()
+    resultados['filtrar_por_fecha'] = medir(
+        lambda: ledger.filtrar_por_fecha(fecha_inicio, fecha_fin, doctor), repeticiones=repeticiones
+    )
+    resultados['generar_reporte_impresion'] = medir(
+        lambda: ledger.generar_reporte_impresion(doctor, fecha_inicio, fecha_fin), repeticiones=repeticiones
+    )
+    resultados['generar_reporte_para_doctores'] = medir(
+        lambda: ledger.generar_reporte_para_doctores(doctor, fecha_inicio, fecha_fin), repeticiones=repeticiones
+    )
+    return resultados
+
+
+def comparar_con_base(resultados, base, tolerancia):
+    """Etapas más lentas que la base por encima de la tolerancia: [(filas, etapa, segundos base, segundos)]"""
+    regresiones = []
+    for filas, etapas in resultados['resultados'].items():
+        for etapa, medida in etapas.items():
+            anterior = base.get('resultados', {}).get(filas, {}).get(etapa)
+            if anterior and medida['segundos'] > anterior['segundos'] * tolerancia:
+                regresiones.append((filas, etapa, anterior['segundos'], medida['segundos']))
+    return regresiones
+
+
+def main(argumentos=None):
+    """Línea de comandos: python benchmark_pagos.py [--filas 10000 100000] [--guardar base.json] [--comparar base.json]"""
+    parser = argparse.ArgumentParser(
+        prog='benchmark_pagos.py',
+        description='Tiempo y memoria pico por etapa del motor de pagos sobre ledgers sintéticos'
+    )
+    parser.add_argument('--filas', type=int, nargs='+', default=TAMANOS_BENCHMARK, help='Tamaños del ledger')
+    parser.add_argument('--repeticiones', type=int, default=3, help='Repeticiones por etapa (se toma la mejor)')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--guardar', help='Guardar los resultados como base en este archivo JSON')
+    parser.add_argument('--comparar', help='Archivo JSON base contra el que detectar regresiones')
+    parser.add_argument('--tolerancia', type=float, default=1.25, help='Factor de tiempo tolerado sobre la base')
+    args = parser.parse_args(argumentos)
+
+    resultados = {
+        'creado': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'resultados': {},
+    }
+    print(f"{'filas':>10}  {'etapa':<30} {'segundos':>10} {'pico MB':>9}")
+    for filas in args.filas:
+        etapas = ejecutar_benchmark(filas, args.semilla, args.repeticiones)
+        resultados['resultados'][str(filas)] = etapas
+        for etapa in ETAPAS_BENCHMARK:
+            print(f"{filas:>10,}  {etapa:<30} {etapas[etapa]['segundos']:>10.4f} {etapas[etapa]['pico_mb']:>9.1f}")
+
+    if args.guardar:
+        with open(args.guardar, 'w', encoding='utf-8') as archivo:
+            json.dump(resultados, archivo, indent=2)
+        print(f"Base guardada en {args.guardar}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as archivo:
+            base = json.load(archivo)
+        regresiones = comparar_con_base(resultados, base, args.tolerancia)
+        for filas, etapa, anterior, actual in regresiones:
+            print(f"REGRESIÓN {int(filas):,} filas {etapa}: {anterior:.4f} s -> {actual:.4f} s")
+        if regresiones:
+            return 1
+        print(f"Sin regresiones respecto a {args.comparar} (tolerancia x{args.tolerancia})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2256 @@
+"""Motor de pagos a doctores: carga del ledger, cálculo de pagos, agregados y reportes, sin Streamlit"""
+import pandas as pd
+import numpy as np
+from datetime import datetime
+from io import BytesIO
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import argparse
+import contextvars
+import functools
+import gzip
+import hashlib
+import html
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zipfile
+import requests
+from openpyxl import Workbook
+from pdf_pagos import DocumentoPDF, agregar_estado
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.feather as feather
+except ImportError:  # Sin pyarrow no hay snapshot en disco ni fuente Parquet
+    pa = None
+
+logger = logging.getLogger(__name__)
+# Un registro JSON por etapa medida, en DEBUG (ver medir_etapa); DASHBOARD_LOG_RENDIMIENTO=1 los emite
+logger_rendimiento = logging.getLogger(f"{__name__}.rendimiento")
+if os.environ.get('DASHBOARD_LOG_RENDIMIENTO', '').strip().lower() in ('1', 'true', 'si', 'sí'):
+    logger_rendimiento.setLevel(logging.DEBUG)
+
+# Google Sheet por defecto (exportación CSV pública)
+SHEET_ID = "1bCijCPK4hCX4v0jJ4KW7RtO1Vu7CDWDrn769OkBHpLU"
+
+# Descarga HTTP: timeouts (segundos) y reintentos con backoff exponencial
+HTTP_TIMEOUT_CONEXION = float(os.environ.get('DASHBOARD_HTTP_TIMEOUT_CONEXION', 5))
+HTTP_TIMEOUT_LECTURA = float(os.environ.get('DASHBOARD_HTTP_TIMEOUT_LECTURA', 30))
+HTTP_REINTENTOS = int(os.environ.get('DASHBOARD_HTTP_REINTENTOS', 3))
+HTTP_BACKOFF = float(os.environ.get('DASHBOARD_HTTP_BACKOFF', 0.5))
+
+# Cada cuántos segundos el actualizador consulta la fuente (0 desactiva el refresco automático)
+INTERVALO_ACTUALIZACION = float(os.environ.get(
+    'DASHBOARD_INTERVALO_ACTUALIZACION', os.environ.get('DASHBOARD_CACHE_TTL', 300)
+))
+
+# Snapshot Feather (Arrow IPC sin comprimir, apto para memory-map) del ledger procesado; vacío lo desactiva
+SNAPSHOT_RUTA = os.environ.get(
+    'DASHBOARD_SNAPSHOT',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'ledger_procesado.arrow')
+)
+# Subir al cambiar el formato del snapshot o las reglas del motor de pagos
+SNAPSHOT_FORMATO = 3
+
+# Tabla de reglas de pago (CSV o JSON) por doctor, procedimiento y aseguradora; vacío usa las tasas por defecto
+REGLAS_PAGO_RUTA = os.environ.get('DASHBOARD_REGLAS_PAGO', '')
+
+
+# Formato de fecha de la hoja; si algún valor no lo cumple se infiere como antes
+FORMATO_FECHA = os.environ.get('DASHBOARD_FORMATO_FECHA', '%m/%d/%Y')
+
+# Esquema declarado del ledger (nombres ya normalizados). Los montos llegan como texto ("$1,234.00")
+ESQUEMA_LEDGER = {
+    'fecha': 'datetime64[ns]',
+    'pago_por_seguro': 'float64',
+    'pago_privado': 'float64',
+    'laboratorio': 'float64',
+    'gastos': 'float64',
+    'monto_a_pagar_por_tarifario': 'float64',
+    '10%_retencion': 'float64',
+    'monto_total_a_pagar': 'float64',
+    'doctor_a_pagar': 'category',
+    'doctor_referidor': 'category',
+    'procedimiento': 'category',
+    'paciente': 'category',
+    'aseguradora': 'category',
+}
+
+# Columnas de doctores que comparten un mismo diccionario de categorías
+COLUMNAS_DOCTOR = ['doctor_a_pagar', 'doctor_referidor']
+
+
+# Registros de rendimiento que conserva cada ledger
+REGISTROS_RENDIMIENTO = 200
+
+try:
+    _TAMANO_PAGINA = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):  # Sin sysconf (Windows) no se mide la memoria
+    _TAMANO_PAGINA = None
+
+# Medidor y etapa en curso del hilo/contexto actual; las etapas anidadas se registran en el mismo medidor
+_medidor_actual = contextvars.ContextVar('medidor_actual', default=None)
+_etapa_actual = contextvars.ContextVar('etapa_actual', default=None)
+_registro_actual = contextvars.ContextVar('registro_actual', default=None)
+
+
+def memoria_residente():
+    """Memoria residente del proceso en bytes; None si el sistema no la expone"""
+    if _TAMANO_PAGINA is None:
+        return None
+    try:
+        with open('/proc/self/statm') as archivo:
+            return int(archivo.read().split()[1]) * _TAMANO_PAGINA
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MedidorEtapas:
+    """Últimos registros de tiempo, filas y memoria por etapa"""
+
+    def __init__(self, maximo=REGISTROS_RENDIMIENTO):
+        self.registros = deque(maxlen=maximo)
+        self._candado = threading.Lock()
+
+    def registrar(self, registro):
+        with self._candado:
+            self.registros.append(registro)
+
+    def tabla(self):
+        """Registros como DataFrame, en orden de finalización"""
+        with self._candado:
+            return pd.DataFrame(list(self.registros))
+
+
+@contextmanager
+def medir_etapa(nombre, filas=None, medidor=None):
+    """Medir tiempo de pared, filas procesadas y variación de memoria de una etapa.
+
+    Sin medidor explícito se usa el de la etapa que la contiene; el registro se emite en el log en nivel DEBUG.
+    """
+    medidor = medidor if medidor is not None else _medidor_actual.get()
+    registro = {'etapa': nombre, 'padre': _etapa_actual.get(), 'filas': filas}
+    token_medidor = _medidor_actual.set(medidor)
+    token_etapa = _etapa_actual.set(nombre)
+    token_registro = _registro_actual.set(registro)
+    memoria_inicio = memoria_residente()
+    inicio = time.perf_counter()
+    try:
+        yield registro
+    finally:
+        registro['segundos'] = round(time.perf_counter() - inicio, 6)
+        memoria_fin = memoria_residente()
+        registro['memoria_mb'] = (
+            round((memoria_fin - memoria_inicio) / 2**20, 3) if memoria_inicio is not None and memoria_fin is not None else None
+        )
+        registro['hora'] = datetime.now().isoformat(timespec='milliseconds')
+        _registro_actual.reset(token_registro)
+        _etapa_actual.reset(token_etapa)
+        _medidor_actual.reset(token_medidor)
+        if medidor is not None:
+            medidor.registrar(registro)
+        if logger_rendimiento.isEnabledFor(logging.DEBUG):
+            logger_rendimiento.debug(json.dumps(registro, default=str))
+
+
+def registrar_filas(filas):
+    """Fijar las filas que procesó la etapa en curso; sin etapa en curso no hace nada"""
+    registro = _registro_actual.get()
+    if registro is not None:
+        registro['filas'] = filas
+
+
+def etapa_medida(nombre=None):
+    """Decorador de métodos del ledger: mide la llamada en self.medidor; si el método no fijó sus filas, usa las del ledger"""
+    def decorador(metodo):
+        @functools.wraps(metodo)
+        def envoltura(self, *args, **kwargs):
+            with medir_etapa(nombre or metodo.__name__, medidor=self.medidor) as registro:
+                resultado = metodo(self, *args, **kwargs)
+                if registro['filas'] is None:
+                    registro['filas'] = len(self.df) if self.df is not None else 0
+                return resultado
+        return envoltura
+    return decorador
+
+
+def leer_csv(origen):
+    """Leer un CSV con el lector multihilo de pyarrow; con el de pandas si no está disponible o falla"""
+    if pa is not None:
+        try:
+            return pd.read_csv(origen, engine='pyarrow')
+        except Exception:
+            # p. ej. saltos de línea dentro de una celda, que el lector de pyarrow no admite
+            if hasattr(origen, 'seek'):
+                origen.seek(0)
+    return pd.read_csv(origen)
+
+
+def parsear_montos(serie):
+    """Convertir montos con '$' y separador de miles a float64 (vacíos o no numéricos → 0)"""
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return serie.astype('float64').fillna(0)
+
+    limpio = serie.astype(str).str.replace('$', '', regex=False).str.replace(',', '', regex=False).str.strip()
+    montos = None
+    if pa is not None:
+        try:
+            # Conversión directa en Arrow cuando todos los valores son numéricos
+            montos = pc.cast(pa.array(limpio, from_pandas=True), pa.float64())
+            montos = pd.Series(montos.to_numpy(zero_copy_only=False), index=serie.index, name=serie.name)
+        except (TypeError, ValueError):
+            montos = None
+    if montos is None:
+        montos = pd.to_numeric(limpio, errors='coerce')
+    return montos.astype('float64').fillna(0)
+
+
+def parsear_fechas(serie, formato=FORMATO_FECHA):
+    """Convertir fechas con formato explícito; si deja valores sin convertir, inferir el formato"""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    fechas = pd.to_datetime(serie, format=formato, errors='coerce')
+    if fechas.isna().sum() > serie.isna().sum():
+        fechas = pd.to_datetime(serie, errors='coerce')
+    return fechas.astype('datetime64[ns]')
+
+
+def normalizar_ledger(df, notificar_error=logger.error):
+    """Estandarizar nombres de columnas y aplicar el esquema declarado; común a todas las fuentes"""
+    # Estandarizar nombres de columnas
+    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
+
+    for col, tipo in ESQUEMA_LEDGER.items():
+        if col not in df.columns:
+            continue
+        try:
+            if tipo == 'float64':
+                df[col] = parsear_montos(df[col])
+            elif tipo == 'category':
+                df[col] = df[col].astype('category')
+            else:
+                df[col] = parsear_fechas(df[col])
+        except Exception as e:
+            notificar_error(f"Error procesando columna {col}: {str(e)}")
+            if tipo == 'float64':
+                df[col] = 0.0
+
+    # Diccionario compartido: un doctor tiene el mismo código como tratante y como referidor
+    columnas_doctor = [
+        col for col in COLUMNAS_DOCTOR
+        if col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype)
+    ]
+    if len(columnas_doctor) > 1:
+        categorias = df[columnas_doctor[0]].cat.categories
+        for col in columnas_doctor[1:]:
+            categorias = categorias.union(df[col].cat.categories)
+        for col in columnas_doctor:
+            df[col] = df[col].cat.set_categories(categorias)
+
+    # Ledger ordenado por fecha (estable, sin fecha al final) para filtrar rangos por búsqueda binaria
+    if 'fecha' in df.columns and pd.api.types.is_datetime64_any_dtype(df['fecha']):
+        df = df.sort_values('fecha', kind='stable', na_position='last', ignore_index=True)
+
+    return df
+
+
+def categorias_presentes(serie):
+    """Valores distintos y ordenados de una columna; en categóricas se leen del diccionario, sin ordenar filas"""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        codigos = serie.cat.codes.to_numpy()
+        usados = np.bincount(codigos[codigos >= 0], minlength=len(serie.cat.categories)) > 0
+        return list(serie.cat.categories[usados])
+    return sorted(serie.dropna().unique())
+
+
+# Columnas que alimentan el motor de pagos; si no cambian, tampoco cambia el resultado de la fila
+COLUMNAS_ENTRADA_PAGOS = [
+    'pago_por_seguro', 'pago_privado', 'paciente_refido', 'cobra_por_porcentaje',
+    '%_de_pago', 'laboratorio', 'gastos', 'monto_a_pagar_por_tarifario'
+]
+
+
+def esquema_entrada_pagos(df):
+    """Columnas de entrada presentes (incluidas las tasas por fila) y sus tipos; si cambia, los resultados anteriores no sirven"""
+    return tuple((col, str(df[col].dtype)) for col in df.columns)
+
+
+def detectar_filas_modificadas(anteriores, actuales):
+    """Máscara de filas nuevas o con alguna entrada distinta a la de la carga anterior (misma posición)"""
+    n_comun = min(len(anteriores), len(actuales))
+    modificadas = np.ones(len(actuales), dtype=bool)
+    iguales = np.ones(n_comun, dtype=bool)
+
+    for col in anteriores.columns:
+        previo = anteriores[col].iloc[:n_comun]
+        actual = actuales[col].iloc[:n_comun]
+        if previo.dtype.kind == 'f':
+            # Comparación exacta: NaN igual a NaN y 0.0 distinto de -0.0
+            x, y = previo.to_numpy(), actual.to_numpy()
+            iguales &= ((x == y) & (np.signbit(x) == np.signbit(y))) | (np.isnan(x) & np.isnan(y))
+        else:
+            ambos_nulos = previo.isna().to_numpy() & actual.isna().to_numpy()
+            mismo_valor = (previo.reset_index(drop=True) == actual.reset_index(drop=True)).to_numpy(dtype=bool, na_value=False)
+            iguales &= mismo_valor | ambos_nulos
+
+    modificadas[:n_comun] = ~iguales
+    return modificadas
+
+
+def _es_paciente_referido(valor):
+    """Regla de referido: acepta si/sí/yes/true/1 (con o sin tilde combinada)"""
+    texto = str(valor).strip().lower()
+    texto = texto.replace('sí', 'sí')
+    return bool(re.match(r'^(si|sí|s[ií]|yes|true|1)$', texto))
+
+
+def _cobra_por_porcentaje(valor):
+    """Regla de tipo de pago: True si el doctor cobra por porcentaje"""
+    if pd.isna(valor):
+        return False
+    return str(valor).strip().lower() in ['si', 'sí', 'yes', 'true', '1']
+
+
+def _parsear_porcentaje(valor):
+    """Convertir '%_de_pago' a fracción; NaN si está vacío o no es numérico (aplica el porcentaje por defecto)"""
+    if pd.isna(valor):
+        return np.nan
+    try:
+        return float(str(valor).replace('%', '').strip()) / 100
+    except ValueError:
+        return np.nan
+
+
+def _evaluar_por_valor_unico(serie, funcion, dtype):
+    """Evaluar una regla una sola vez por valor distinto de la columna y expandirla a todas las filas"""
+    codigos, unicos = pd.factorize(serie, use_na_sentinel=False)
+    valores = np.array([funcion(valor) for valor in unicos], dtype=dtype)
+    return valores[codigos]
+
+
+def _columna_numerica(df, columna):
+    """Columna como arreglo float (ceros si no existe)"""
+    if columna not in df.columns:
+        return np.zeros(len(df))
+    return df[columna].to_numpy(dtype=float, na_value=np.nan)
+
+
+# Columnas que escribe calcular_pagos, en orden
+COLUMNAS_RESULTADO = [
+    'pago_total_paciente', 'pago_doctor', 'pago_referidor', 'retencion', 'retencion_10',
+    'descuento_lab', 'descuento_gastos', 'cargo_por_ars',
+    'costes', 'ingreso_clinica', 'monto_final_pago', 'rentabilidad'
+]
+
+
+# Tasas que puede fijar una regla de pago (fracciones) y su valor si ninguna regla las fija.
+# 'porcentaje' reemplaza el '%_de_pago' de la hoja; en NaN se usa el de la hoja (o 'porcentaje_defecto')
+TASAS_POR_DEFECTO = {
+    'cargo_ars': 0.10,
+    'comision_referidor': 0.10,
+    'retencion': 0.10,
+    'porcentaje_defecto': 0.50,
+    'porcentaje': np.nan,
+}
+
+# Dimensiones de una regla y la columna del ledger con que se comparan; vacía en la regla = cualquier valor
+DIMENSIONES_REGLAS = {
+    'doctor': 'doctor_a_pagar',
+    'procedimiento': 'procedimiento',
+    'aseguradora': 'aseguradora',
+}
+VIGENCIA_REGLAS = ['vigente_desde', 'vigente_hasta']
+
+
+def _clave_regla(valor):
+    """Valor de dimensión comparable entre reglas y ledger (sin espacios extremos ni mayúsculas)"""
+    return str(valor).strip().casefold()
+
+
+def _parsear_tasa(valor):
+    """Tasa de una regla en porcentaje, como '%_de_pago' ('10' o '10%'), a fracción; NaN si la celda está vacía"""
+    if pd.isna(valor) or not str(valor).strip():
+        return np.nan
+    try:
+        return float(str(valor).replace('%', '').strip()) / 100
+    except ValueError:
+        raise ValueError(f"Tasa no numérica: {valor!r}") from None
+
+
+class ReglasPago:
+    """Tabla declarativa de tasas por doctor, procedimiento y aseguradora, con vigencia por fechas.
+
+    Cada regla solo reemplaza las tasas que fija. Entre reglas que aplican a una fila gana la más
+    específica (más dimensiones fijadas), luego la de vigencia más reciente y luego la última del archivo.
+    """
+
+    def __init__(self, reglas=None, ruta=None, version=None):
+        tabla = pd.DataFrame(reglas if reglas is not None else [], dtype=object).reset_index(drop=True)
+        tabla.columns = [str(col).strip().lower().replace(' ', '_') for col in tabla.columns]
+        conocidas = [*DIMENSIONES_REGLAS, *VIGENCIA_REGLAS, *TASAS_POR_DEFECTO]
+        desconocidas = [col for col in tabla.columns if col not in conocidas]
+        if desconocidas:
+            raise ValueError(f"Columnas desconocidas: {', '.join(desconocidas)}. Válidas: {', '.join(conocidas)}")
+        tabla = tabla.reindex(columns=conocidas)
+
+        for fila, regla in enumerate(tabla.itertuples(index=False), start=1):
+            try:
+                for dimension in DIMENSIONES_REGLAS:
+                    valor = getattr(regla, dimension)
+                    tabla.at[fila - 1, dimension] = None if pd.isna(valor) or not str(valor).strip() else _clave_regla(valor)
+                for tasa in TASAS_POR_DEFECTO:
+                    tabla.at[fila - 1, tasa] = _parsear_tasa(getattr(regla, tasa))
+            except ValueError as e:
+                raise ValueError(f"Regla {fila}: {e}") from None
+        for tasa in TASAS_POR_DEFECTO:
+            tabla[tasa] = tabla[tasa].astype('float64')
+        for col in VIGENCIA_REGLAS:
+            try:
+                tabla[col] = pd.to_datetime(tabla[col].replace('', None)).astype('datetime64[ns]')
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Fecha inválida en {col}: {e}") from None
+        invertidas = np.flatnonzero(tabla['vigente_desde'] > tabla['vigente_hasta'])
+        if len(invertidas):
+            raise ValueError(f"Regla {invertidas[0] + 1}: vigente_desde es posterior a vigente_hasta")
+
+        # Orden de aplicación, de menor a mayor prioridad: las posteriores reemplazan a las anteriores
+        prioridad = pd.DataFrame({
+            'especificidad': tabla[list(DIMENSIONES_REGLAS)].notna().sum(axis=1),
+            'desde': tabla['vigente_desde'].fillna(pd.Timestamp.min),
+        })
+        orden = prioridad.sort_values(['especificidad', 'desde'], kind='stable').index
+        self.tabla = tabla.loc[orden].reset_index(drop=True)
+        self.ruta = ruta
+        self.version = version
+        # Identifica el contenido de las reglas en el snapshot y en las claves de memo
+        self.huella = hashlib.sha256(
+            self.tabla.to_json(orient='split', date_format='iso').encode('utf-8')
+        ).hexdigest()[:16]
+
+    def __len__(self):
+        return len(self.tabla)
+
+    def valores_tasa(self, tasa):
+        """Valores distintos que puede tomar una tasa: la base (regla general sin vigencia o valor por defecto) y los de las demás reglas"""
+        reglas = self.tabla[self.tabla[tasa].notna()]
+        general = reglas[[*DIMENSIONES_REGLAS, *VIGENCIA_REGLAS]].isna().all(axis=1)
+        base = reglas.loc[general, tasa].iloc[-1] if general.any() else TASAS_POR_DEFECTO[tasa]
+        return sorted({float(base), *map(float, reglas.loc[~general, tasa])})
+
+    @staticmethod
+    def version_archivo(ruta):
+        """Fecha de modificación y tamaño del archivo de reglas"""
+        estado = os.stat(ruta)
+        return f"{estado.st_mtime_ns}-{estado.st_size}"
+
+    @classmethod
+    def desde_archivo(cls, ruta=REGLAS_PAGO_RUTA):
+        """Leer la tabla de reglas de un CSV o de un JSON (lista de reglas); sin ruta, solo las tasas por defecto"""
+        if not ruta:
+            return cls()
+        try:
+            version = cls.version_archivo(ruta)
+            if ruta.lower().endswith('.json'):
+                with open(ruta, encoding='utf-8') as archivo:
+                    reglas = json.load(archivo)
+                if not isinstance(reglas, list):
+                    raise ValueError("se esperaba una lista de reglas")
+            else:
+                reglas = pd.read_csv(ruta, dtype=str, keep_default_na=False, skipinitialspace=True)
+            return cls(reglas, ruta, version)
+        except (OSError, ValueError) as e:
+            raise ValueError(f"Reglas de pago inválidas en {ruta}: {e}") from e
+
+    def archivo_modificado(self):
+        """True si el archivo del que se leyeron las reglas cambió (o ya no se puede leer)"""
+        if not self.ruta:
+            return False
+        try:
+            return self.version_archivo(self.ruta) != self.version
+        except OSError:
+            return True
+
+    def compilar(self, df):
+        """Tasas por fila del ledger ({tasa: arreglo float64}), tomadas de una tabla combinación × período.
+
+        Las dimensiones de cada fila se combinan en un código y la fecha se ubica en un período entre
+        los límites de vigencia; las reglas se aplican sobre esa tabla pequeña, nunca fila por fila.
+        """
+        n = len(df)
+        reglas = self.tabla
+        dimensiones = [dimension for dimension in DIMENSIONES_REGLAS if reglas[dimension].notna().any()]
+
+        # Código por fila de cada dimensión usada: posición del valor en las reglas (+1; 0 = ninguna regla lo nombra)
+        valores_regla = {}
+        combinacion = np.zeros(n, dtype=np.int64)
+        for dimension in dimensiones:
+            valores = {valor: i for i, valor in enumerate(dict.fromkeys(reglas[dimension].dropna()), start=1)}
+            valores_regla[dimension] = valores
+            columna = DIMENSIONES_REGLAS[dimension]
+            if columna in df.columns:
+                codigos, unicos = pd.factorize(df[columna])
+                # El código -1 (vacío) toma el último elemento: 0
+                traduccion = np.array([valores.get(_clave_regla(valor), 0) for valor in unicos] + [0], dtype=np.int64)
+                codigo = traduccion[codigos]
+            else:
+                codigo = np.zeros(n, dtype=np.int64)
+            combinacion = combinacion * (len(valores) + 1) + codigo
+
+        if dimensiones:
+            fila_combinacion, combinaciones = pd.factorize(combinacion)
+        else:
+            fila_combinacion, combinaciones = np.zeros(n, dtype=np.intp), np.zeros(1, dtype=np.int64)
+        codigos_combinacion = {}
+        resto = combinaciones
+        for dimension in reversed(dimensiones):
+            base = len(valores_regla[dimension]) + 1
+            codigos_combinacion[dimension] = resto % base
+            resto = resto // base
+
+        # Períodos entre límites de vigencia; las filas sin fecha caen en el último (reglas sin fin de vigencia)
+        desde = reglas['vigente_desde'].to_numpy(dtype='datetime64[ns]')
+        hasta = (reglas['vigente_hasta'] + pd.Timedelta(days=1)).to_numpy(dtype='datetime64[ns]')
+        limites = np.unique(np.concatenate([desde[~np.isnat(desde)], hasta[~np.isnat(hasta)]]))
+        if not len(limites):
+            periodo = np.zeros(n, dtype=np.intp)
+        elif 'fecha' in df.columns:
+            periodo = np.searchsorted(limites, df['fecha'].to_numpy(dtype='datetime64[ns]'), side='right')
+        else:
+            periodo = np.full(n, len(limites), dtype=np.intp)
+        inicio = np.where(np.isnat(desde), 0, np.searchsorted(limites, desde, side='right'))
+        fin = np.where(np.isnat(hasta), len(limites) + 1, np.searchsorted(limites, hasta, side='right'))
+
+        tablas = {
+            tasa: np.full((len(combinaciones), len(limites) + 1), valor, dtype=np.float64)
+            for tasa, valor in TASAS_POR_DEFECTO.items()
+        }
+        for i, regla in enumerate(reglas.itertuples(index=False)):
+            aplica = np.ones(len(combinaciones), dtype=bool)
+            for dimension in dimensiones:
+                valor = getattr(regla, dimension)
+                if valor is not None:
+                    aplica &= codigos_combinacion[dimension] == valores_regla[dimension][valor]
+            for tasa in TASAS_POR_DEFECTO:
+                valor = getattr(regla, tasa)
+                if not np.isnan(valor):
+                    tablas[tasa][aplica, inicio[i]:fin[i]] = valor
+
+        # Un único indexado por fila para cada tasa
+        posicion = fila_combinacion * (len(limites) + 1) + periodo
+        return {tasa: tabla.ravel()[posicion] for tasa, tabla in tablas.items()}
+
+
+def mascara_por_porcentaje(df):
+    """Filas cuyo doctor cobra por porcentaje (según 'cobra_por_porcentaje'); el resto cobra por tarifario"""
+    if 'cobra_por_porcentaje' not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+    return _evaluar_por_valor_unico(df['cobra_por_porcentaje'], _cobra_por_porcentaje, bool)
+
+
+def calcular_pagos(df, tasas=None, por_porcentaje=None):
+    """Motor de pagos vectorizado: calcula todas las columnas derivadas sin iterar filas.
+
+    `tasas` son las de ReglasPago.compilar (arreglos por fila) o escalares; por defecto TASAS_POR_DEFECTO.
+    `por_porcentaje` reemplaza la máscara de tipo de pago de la hoja (simulaciones).
+    """
+    if tasas is None:
+        tasas = TASAS_POR_DEFECTO
+    pago_total_paciente = df['pago_por_seguro'].fillna(0) + df['pago_privado'].fillna(0)
+    pago_total = pago_total_paciente.to_numpy(dtype=float)
+
+    # Máscaras por fila
+    if 'paciente_refido' in df.columns:
+        es_referido = _evaluar_por_valor_unico(df['paciente_refido'], _es_paciente_referido, bool)
+    else:
+        es_referido = np.zeros(len(df), dtype=bool)
+
+    if por_porcentaje is None:
+        por_porcentaje = mascara_por_porcentaje(df)
+
+    if '%_de_pago' in df.columns:
+        porcentaje = _evaluar_por_valor_unico(df['%_de_pago'], _parsear_porcentaje, float)
+    else:
+        porcentaje = np.full(len(df), np.nan)
+    porcentaje = np.where(np.isnan(porcentaje), tasas['porcentaje_defecto'], porcentaje)
+    porcentaje = np.where(np.isnan(tasas['porcentaje']), porcentaje, tasas['porcentaje'])
+
+    # Valores no finitos (p. ej. '%_de_pago' = 'inf') se propagan igual que en el cálculo por fila
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Cargo ARS: porcentaje del pago total cuando hay pago por seguro
+        cargo_ars = np.where(_columna_numerica(df, 'pago_por_seguro') > 0, pago_total * tasas['cargo_ars'], 0.0)
+
+        # Pago a referidor: comisión sobre el pago total del paciente
+        pago_referidor = np.where(es_referido, pago_total * tasas['comision_referidor'], 0.0)
+
+        # Doctores por porcentaje: restar gastos y cargo ARS, luego aplicar porcentaje
+        laboratorio = _columna_numerica(df, 'laboratorio')
+        gastos = _columna_numerica(df, 'gastos')
+        base_para_porcentaje = pago_total - (laboratorio + gastos) - cargo_ars
+        base_para_porcentaje = np.where(base_para_porcentaje > 0, base_para_porcentaje, 0.0)
+        pago_bruto_porcentaje = base_para_porcentaje * porcentaje
+        retencion_porcentaje = pago_bruto_porcentaje * tasas['retencion']
+
+        # Doctores por tarifario: monto del tarifario menos cargo ARS
+        pago_base_tarifario = _columna_numerica(df, 'monto_a_pagar_por_tarifario') - cargo_ars
+        pago_base_tarifario = np.where(pago_base_tarifario > 0, pago_base_tarifario, 0.0)
+        retencion_tarifario = pago_base_tarifario * tasas['retencion']
+
+        retencion = np.where(por_porcentaje, retencion_porcentaje, retencion_tarifario)
+        pago_doctor = np.where(
+            por_porcentaje,
+            pago_bruto_porcentaje - retencion_porcentaje,
+            pago_base_tarifario - retencion_tarifario
+        )
+        descuento_lab = np.where(por_porcentaje, laboratorio, 0.0)
+        descuento_gastos = np.where(por_porcentaje, gastos, 0.0)
+
+        # Cálculos finales
+        costes = retencion + descuento_lab + descuento_gastos + cargo_ars
+        ingreso_clinica = pago_total - (pago_doctor + costes + pago_referidor)
+        rentabilidad = np.where(pago_total > 0, ingreso_clinica / pago_total * 100, 0.0)
+
+    return pd.DataFrame({
+        'pago_total_paciente': pago_total_paciente,
+        'pago_doctor': pago_doctor,
+        'pago_referidor': pago_referidor,
+        'retencion': retencion,
+        'retencion_10': retencion,
+        'descuento_lab': descuento_lab,
+        'descuento_gastos': descuento_gastos,
+        'cargo_por_ars': cargo_ars,
+        'costes': costes,
+        'ingreso_clinica': ingreso_clinica,
+        'monto_final_pago': pago_doctor,
+        'rentabilidad': rentabilidad,
+    }, index=df.index)
+
+
+# Dimensiones y medidas del cubo de agregados compartido por pestañas y tarjetas
+DIMENSIONES_CUBO = ['doctor_a_pagar', 'doctor_referidor', 'procedimiento', 'fecha']
+MEDIDAS_CUBO = [
+    'pago_total_paciente', 'pago_doctor', 'pago_referidor', 'retencion',
+    'laboratorio', 'gastos', 'cargo_por_ars', 'costes', 'ingreso_clinica'
+]
+
+
+def construir_cubo(df):
+    """Rollup doctor × referidor × procedimiento × día con sumas y conteos (una vez por versión de datos)"""
+    medidas = {}
+    for col in MEDIDAS_CUBO:
+        if col in df.columns and pd.api.types.is_numeric_dtype(df[col]):
+            medidas[col] = df[col]
+    medidas['n_filas'] = np.ones(len(df), dtype=np.int64)
+    if 'paciente' in df.columns:
+        medidas['n_pacientes'] = df['paciente'].notna().astype(np.int64)
+    if 'rentabilidad' in df.columns:
+        # Suma y conteo de valores no nulos para reconstruir el promedio en cualquier corte
+        medidas['rentabilidad_suma'] = df['rentabilidad']
+        medidas['rentabilidad_n'] = df['rentabilidad'].notna().astype(np.int64)
+
+    # Pacientes referidos con pago al referidor (mismo criterio que la tabla de referidores)
+    if {'paciente_refido', 'pago_referidor', 'pago_total_paciente'}.issubset(df.columns):
+        referido = (
+            df['paciente_refido'].astype(str).str.lower().str.contains('si|sí|yes|true|1', na=False)
+            & (df['pago_referidor'] > 0)
+        )
+        medidas['referidos_pago'] = df['pago_referidor'].where(referido, 0.0)
+        medidas['referidos_monto'] = df['pago_total_paciente'].where(referido, 0.0)
+        medidas['referidos_n_filas'] = referido.astype(np.int64)
+        if 'paciente' in df.columns:
+            medidas['referidos_n_pacientes'] = (referido & df['paciente'].notna()).astype(np.int64)
+
+    tabla = pd.DataFrame(medidas, index=df.index)
+    dimensiones = [col for col in DIMENSIONES_CUBO if col in df.columns]
+    if not dimensiones:
+        return tabla.sum().to_frame().T
+    for col in dimensiones:
+        tabla[col] = df[col]
+    return tabla.groupby(dimensiones, observed=True, dropna=False, sort=False).sum().reset_index()
+
+
+class IndiceLedger:
+    """Búsqueda binaria por fecha y por doctor + fecha sobre el ledger ordenado por fecha"""
+
+    def __init__(self, df):
+        fechas = df['fecha'].to_numpy(dtype='datetime64[ns]')
+        # normalizar_ledger deja las filas sin fecha al final
+        self.n_validas = int(len(fechas) - np.isnat(fechas).sum())
+        self.fechas = fechas[:self.n_validas]
+        self.posiciones_doctor = {}
+        if 'doctor_a_pagar' in df.columns and isinstance(df['doctor_a_pagar'].dtype, pd.CategoricalDtype):
+            categorias = df['doctor_a_pagar'].cat.categories
+            codigos = df['doctor_a_pagar'].cat.codes.to_numpy()[:self.n_validas]
+            # Orden estable: dentro de cada doctor las posiciones siguen ordenadas por fecha
+            orden = np.argsort(codigos, kind='stable')
+            limites = np.cumsum(np.bincount(codigos[codigos >= 0], minlength=len(categorias)))
+            desde = int((codigos < 0).sum())
+            for doctor, hasta in zip(categorias, limites + desde):
+                if hasta > desde:
+                    self.posiciones_doctor[doctor] = orden[desde:hasta]
+                desde = hasta
+
+    @staticmethod
+    def _limites(fechas, fecha_inicio, fecha_fin):
+        desde = np.searchsorted(fechas, np.datetime64(pd.Timestamp(fecha_inicio), 'ns'), side='left')
+        hasta = np.searchsorted(fechas, np.datetime64(pd.Timestamp(fecha_fin), 'ns'), side='right')
+        return int(desde), int(max(desde, hasta))
+
+    def rango(self, fecha_inicio, fecha_fin):
+        """Slice posicional de las filas con fecha_inicio <= fecha <= fecha_fin"""
+        return slice(*self._limites(self.fechas, fecha_inicio, fecha_fin))
+
+    def posiciones(self, doctor, fecha_inicio, fecha_fin):
+        """Posiciones de las filas del doctor dentro del rango de fechas"""
+        posiciones = self.posiciones_doctor.get(doctor)
+        if posiciones is None:
+            return np.empty(0, dtype=np.intp)
+        desde, hasta = self._limites(self.fechas[posiciones], fecha_inicio, fecha_fin)
+        return posiciones[desde:hasta]
+
+
+class DescargaCondicional:
+    """Descarga HTTP con sesión reutilizable, validadores ETag/Last-Modified y hash del contenido"""
+
+    def __init__(self, timeout_conexion=HTTP_TIMEOUT_CONEXION, timeout_lectura=HTTP_TIMEOUT_LECTURA,
+                 reintentos=HTTP_REINTENTOS, backoff=HTTP_BACKOFF):
+        self.timeout = (timeout_conexion, timeout_lectura)
+        reintento = Retry(
+            total=reintentos,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False
+        )
+        adaptador = HTTPAdapter(max_retries=reintento)
+        self.sesion = requests.Session()
+        self.sesion.mount('https://', adaptador)
+        self.sesion.mount('http://', adaptador)
+        # Validadores y hash de la última respuesta confirmada por URL
+        self.validadores = {}
+        # Validadores de respuestas descargadas que aún no se confirmaron (ver confirmar)
+        self.pendientes = {}
+
+    def descargar(self, url, condicional=True):
+        """Devolver (contenido, hash) o (None, hash) si el contenido no cambió desde la última descarga confirmada"""
+        anterior = self.validadores.get(url, {})
+        headers = {}
+        if condicional:
+            if anterior.get('etag'):
+                headers['If-None-Match'] = anterior['etag']
+            if anterior.get('last_modified'):
+                headers['If-Modified-Since'] = anterior['last_modified']
+
+        response = self.sesion.get(url, headers=headers, timeout=self.timeout)
+        if condicional and response.status_code == 304:
+            return None, anterior.get('hash')
+        response.raise_for_status()
+
+        hash_contenido = hashlib.sha256(response.content).hexdigest()
+        validadores = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'hash': hash_contenido
+        }
+        if condicional and hash_contenido == anterior.get('hash'):
+            # Mismo contenido que el ya cargado: los validadores nuevos se pueden usar enseguida
+            self.validadores[url] = validadores
+            return None, hash_contenido
+        # Contenido nuevo: los validadores se guardan solo cuando el ledger se cargó bien
+        self.pendientes[url] = validadores
+        return response.content, hash_contenido
+
+    def confirmar(self, url, hash_contenido):
+        """Tomar como última descarga la respuesta pendiente con ese hash (ya leída y normalizada)"""
+        pendiente = self.pendientes.get(url)
+        if pendiente is not None and pendiente['hash'] == hash_contenido:
+            self.validadores[url] = self.pendientes.pop(url)
+
+
+_descarga_http = None
+_candado_descarga_http = threading.Lock()
+
+
+def obtener_descarga_http():
+    """Sesión HTTP con pool de conexiones y validadores, compartida por todo el proceso"""
+    global _descarga_http
+    with _candado_descarga_http:
+        if _descarga_http is None:
+            _descarga_http = DescargaCondicional()
+        return _descarga_http
+
+
+class FuenteDatos:
+    """Origen del ledger crudo; las subclases implementan leer()"""
+
+    descripcion = "fuente de datos"
+
+    def leer(self, condicional=True):
+        """Devolver (DataFrame crudo, versión) o (None, versión) si no cambió desde la última lectura"""
+        raise NotImplementedError
+
+    @property
+    def identificador(self):
+        """Identifica el origen concreto (URL o ruta) en el encabezado del snapshot"""
+        raise NotImplementedError
+
+    def restaurar_version(self, version):
+        """Tomar como última lectura la versión guardada en un snapshot"""
+
+    def confirmar_version(self, version):
+        """Tomar como última lectura la versión devuelta por leer(), una vez cargado el ledger sin errores"""
+
+
+class FuenteGoogleSheets(FuenteDatos):
+    """Exportación CSV de un Google Sheet público"""
+
+    descripcion = "Google Sheets"
+
+    def __init__(self, sheet_id=SHEET_ID):
+        self.sheet_id = sheet_id
+        self.url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv"
+
+    @property
+    def identificador(self):
+        return self.url
+
+    def restaurar_version(self, version):
+        obtener_descarga_http().validadores.setdefault(self.url, {'hash': version})
+
+    def confirmar_version(self, version):
+        obtener_descarga_http().confirmar(self.url, version)
+
+    def leer(self, condicional=True):
+        with medir_etapa('descarga_http'):
+            contenido, version = obtener_descarga_http().descargar(self.url, condicional=condicional)
+        if contenido is None:
+            return None, version
+        with medir_etapa('leer_csv') as registro:
+            df = leer_csv(BytesIO(contenido))
+            registro['filas'] = len(df)
+        return df, version
+
+
+class FuenteArchivo(FuenteDatos):
+    """Archivo local; la versión es su fecha de modificación y tamaño"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.version = None
+
+    @property
+    def identificador(self):
+        return os.path.abspath(self.ruta)
+
+    def restaurar_version(self, version):
+        self.version = version
+
+    def confirmar_version(self, version):
+        self.version = version
+
+    def leer(self, condicional=True):
+        estado = os.stat(self.ruta)
+        version = f"{estado.st_mtime_ns}-{estado.st_size}"
+        if condicional and version == self.version:
+            return None, version
+        with medir_etapa('leer_archivo') as registro:
+            df = self.leer_archivo()
+            registro['filas'] = len(df)
+        return df, version
+
+    def leer_archivo(self):
+        raise NotImplementedError
+
+
+class FuenteCSV(FuenteArchivo):
+    """CSV local con el mismo formato que la exportación de la hoja"""
+
+    descripcion = "CSV local"
+
+    def leer_archivo(self):
+        return leer_csv(self.ruta)
+
+
+class FuenteParquet(FuenteArchivo):
+    """Snapshot Parquet local (requiere pyarrow)"""
+
+    descripcion = "Parquet local"
+
+    def leer_archivo(self):
+        return pd.read_parquet(self.ruta)
+
+
+class FuenteSQLite(FuenteArchivo):
+    """Tabla de una base SQLite local"""
+
+    descripcion = "SQLite local"
+
+    def __init__(self, ruta, tabla="ledger"):
+        super().__init__(ruta)
+        self.tabla = tabla
+
+    @property
+    def identificador(self):
+        return f"{os.path.abspath(self.ruta)}#{self.tabla}"
+
+    def leer_archivo(self):
+        tabla = self.tabla.replace('"', '""')
+        with sqlite3.connect(self.ruta) as conexion:
+            return pd.read_sql_query(f'SELECT * FROM "{tabla}"', conexion)
+
+
+FUENTES_DATOS = {
+    'google_sheets': FuenteGoogleSheets,
+    'csv': FuenteCSV,
+    'parquet': FuenteParquet,
+    'sqlite': FuenteSQLite,
+}
+
+
+def crear_fuente_datos(tipo=None, ruta=None):
+    """Crear la fuente configurada (DASHBOARD_FUENTE, DASHBOARD_RUTA_DATOS); Google Sheets por defecto"""
+    tipo = (tipo or os.environ.get('DASHBOARD_FUENTE', 'google_sheets')).strip().lower()
+    if tipo not in FUENTES_DATOS:
+        raise ValueError(f"Fuente de datos desconocida: {tipo}. Opciones: {', '.join(FUENTES_DATOS)}")
+
+    if tipo == 'google_sheets':
+        return FuenteGoogleSheets(os.environ.get('DASHBOARD_SHEET_ID', SHEET_ID))
+
+    ruta = ruta or os.environ.get('DASHBOARD_RUTA_DATOS')
+    if not ruta:
+        raise ValueError(f"La fuente '{tipo}' requiere DASHBOARD_RUTA_DATOS")
+    if tipo == 'sqlite':
+        return FuenteSQLite(ruta, os.environ.get('DASHBOARD_TABLA_SQLITE', 'ledger'))
+    return FUENTES_DATOS[tipo](ruta)
+
+
+# Estilos comunes de los reportes imprimibles (hoja 8 1/2 x 11)
+CSS_REPORTE = """
+    body {
+        font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+        margin: 0;
+        padding: 20px;
+        color: #333;
+        line-height: 1.4;
+    }
+    .print-container {
+        max-width: 800px;
+        margin: 0 auto;
+    }
+    .header {
+        text-align: center;
+        margin-bottom: 30px;
+        border-bottom: 3px solid #007aff;
+        padding-bottom: 20px;
+    }
+    .header h1 {
+        color: #1d1d1f;
+        margin: 0 0 10px 0;
+        font-size: 28px;
+    }
+    .header-info {
+        display: flex;
+        justify-content: space-between;
+        margin-top: 15px;
+        font-size: 14px;
+        color: #666;
+    }
+    .doctor-info {
+        background: #f5f7fa;
+        padding: 20px;
+        border-radius: 12px;
+        margin-bottom: 25px;
+    }
+    .summary-grid {
+        display: grid;
+        grid-template-columns: repeat(4, 1fr);
+        gap: 15px;
+        margin-bottom: 25px;
+    }
+    .summary-card {
+        background: white;
+        padding: 15px;
+        border-radius: 12px;
+        box-shadow: 0 2px 10px rgba(0,0,0,0.1);
+        text-align: center;
+    }
+    .summary-card h3 {
+        margin: 0;
+        font-size: 14px;
+        color: #666;
+        font-weight: 500;
+    }
+    .summary-card .value {
+        font-size: 20px;
+        font-weight: 600;
+        color: #007aff;
+        margin: 8px 0 0 0;
+    }
+    .table {
+        width: 100%;
+        border-collapse: collapse;
+        margin: 20px 0;
+        font-size: 12px;
+    }
+    .table th {
+        background: #007aff;
+        color: white;
+        padding: 12px;
+        text-align: left;
+        font-weight: 500;
+    }
+    .table td {
+        padding: 10px;
+        border-bottom: 1px solid #e5e5e7;
+    }
+    .table tr.total-row {
+        background: #f5f7fa;
+        font-weight: 600;
+    }
+    .table tr.total-row td {
+        border-top: 2px solid #007aff;
+        font-size: 13px;
+    }
+    .footer {
+        text-align: center;
+        margin-top: 40px;
+        color: #666;
+        font-size: 12px;
+        border-top: 1px solid #e5e5e7;
+        padding-top: 20px;
+    }
+    @media print {
+        body { padding: 15px; }
+        .summary-grid { page-break-inside: avoid; }
+        .table { page-break-inside: avoid; }
+    }
+"""
+
+PLANTILLA_INICIO_REPORTE = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>{titulo} - {doctor}</title>
+    <style>{css}</style>
+</head>
+<body>
+    <div class="print-container">
+        <div class="header">
+            <h1>{encabezado}</h1>
+            <div class="header-info">
+                <div>Doctor: <strong>{doctor}</strong></div>
+                <div>Período: <strong>{fecha_inicio} a {fecha_fin}</strong></div>
+                <div>Generado: <strong>{generado}</strong></div>
+            </div>
+        </div>
+
+        <div class="summary-grid">
+            <div class="summary-card">
+                <h3>Total Procedimientos</h3>
+                <div class="value">{procedimientos}</div>
+            </div>
+            <div class="summary-card">
+                <h3>Total a Pagar</h3>
+                <div class="value">{total_pagar}</div>
+            </div>
+            <div class="summary-card">
+                <h3>Total Retenido</h3>
+                <div class="value">{total_retenido}</div>
+            </div>
+            <div class="summary-card">
+                <h3>Total Gastos</h3>
+                <div class="value">{total_gastos}</div>
+            </div>
+        </div>
+
+        <h2>Detalle por Paciente y Procedimiento</h2>
+        <table class="table">
+            <thead>
+                <tr>
+                    <th>Paciente</th>
+                    <th>Procedimiento</th>
+{encabezados}
+                </tr>
+            </thead>
+            <tbody>
+"""
+
+PLANTILLA_FIN_REPORTE = """                <tr class="total-row">
+                    <td colspan="2"><strong>TOTAL GENERAL</strong></td>
+{totales}
+                </tr>
+            </tbody>
+        </table>
+
+        <div class="footer">
+            <p>Reporte generado automáticamente por Sistema de Pagos Clínica Padilla</p>
+            <p>© 2024 Clínica Padilla - Todos los derechos reservados</p>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+# Columnas de monto de cada reporte: (encabezado, columnas del ledger que se suman)
+REPORTES_HTML = {
+    'impresion': {
+        'titulo': 'Reporte de Pagos',
+        'archivo': 'reporte_pagos',
+        'encabezado': '🏥 Reporte de Pagos a Doctores',
+        'columnas': [
+            ('Ingreso Total', ['pago_total_paciente']),
+            ('Gastos', ['laboratorio', 'gastos']),
+            ('Retención', ['retencion_10']),
+            ('Total a Pagar', ['monto_final_pago']),
+        ],
+    },
+    'doctores': {
+        'titulo': 'Reporte para Doctores',
+        'archivo': 'reporte_doctores',
+        'encabezado': '👨‍⚕️ Reporte para Doctores',
+        'columnas': [
+            ('Gastos', ['laboratorio', 'gastos']),
+            ('Retención', ['retencion_10']),
+            ('Total a Pagar', ['monto_final_pago']),
+        ],
+    },
+}
+
+# Pie de los estados en PDF (el HTML lo lleva en PLANTILLA_FIN_REPORTE)
+PIE_REPORTE = [
+    "Reporte generado automáticamente por Sistema de Pagos Clínica Padilla",
+    "© 2024 Clínica Padilla - Todos los derechos reservados",
+]
+
+# Filas por bloque al generar el detalle; acota la memoria de las cadenas intermedias
+FILAS_POR_BLOQUE_REPORTE = 2000
+
+# Hilos para generar los reportes de nómina en lote
+TRABAJADORES_LOTE = int(os.environ.get('DASHBOARD_TRABAJADORES_LOTE', min(8, os.cpu_count() or 1)))
+
+
+def formatear_montos(valores):
+    """Montos como texto $1,234.56 (un arreglo completo por llamada)"""
+    return [f"${valor:,.2f}" for valor in np.asarray(valores, dtype=np.float64).tolist()]
+
+
+def codificar_columna(serie):
+    """Códigos enteros y valores de una columna (-1 = vacío); en categóricas se reutiliza su diccionario"""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.cat.codes.to_numpy(), serie.cat.categories
+    return pd.factorize(serie, sort=True)
+
+
+def formatear_textos(codigos, valores):
+    """Textos escapados para HTML; cada valor distinto se escapa una sola vez"""
+    usados, inversa = np.unique(codigos, return_inverse=True)
+    textos = np.array([html.escape(str(valor)) for valor in valores.take(usados).tolist()], dtype=object)
+    return textos[inversa]
+
+
+def sumar_columnas(df, columnas):
+    """Suma fila a fila de varias columnas de monto, como arreglo float64"""
+    valores = df[columnas[0]].to_numpy(dtype=np.float64)
+    for col in columnas[1:]:
+        valores = valores + df[col].to_numpy(dtype=np.float64)
+    return valores
+
+
+def agrupar_reporte(tipo, df_filtrado):
+    """Detalle de un reporte por paciente y procedimiento: (agrupado por códigos, pacientes, procedimientos, totales)"""
+    montos = REPORTES_HTML[tipo]['columnas']
+    columnas_suma = list(dict.fromkeys(col for _, cols in montos for col in cols))
+
+    # Agrupar por paciente y procedimiento sobre los códigos: no depende del tamaño del diccionario
+    codigos_paciente, valores_paciente = codificar_columna(df_filtrado['paciente'])
+    codigos_procedimiento, valores_procedimiento = codificar_columna(df_filtrado['procedimiento'])
+    validas = (codigos_paciente >= 0) & (codigos_procedimiento >= 0)
+    detalle = pd.DataFrame({col: df_filtrado[col].to_numpy()[validas] for col in columnas_suma})
+    detalle['paciente'] = codigos_paciente[validas]
+    detalle['procedimiento'] = codigos_procedimiento[validas]
+    reporte_agrupado = detalle.groupby(['paciente', 'procedimiento'])[columnas_suma].sum().reset_index()
+    return reporte_agrupado, valores_paciente, valores_procedimiento, df_filtrado[columnas_suma].sum()
+
+
+def renderizar_reporte_html(tipo, df_filtrado, doctor, fecha_inicio, fecha_fin):
+    """Generar el reporte HTML por bloques; las filas se formatean por columna, sin iterrows"""
+    configuracion = REPORTES_HTML[tipo]
+    montos = configuracion['columnas']
+    reporte_agrupado, valores_paciente, valores_procedimiento, total_general = agrupar_reporte(tipo, df_filtrado)
+
+    def total(cols):
+        return sum(total_general[col] for col in cols)
+
+    # Los textos se escapan una vez para todo el reporte; los montos se formatean por bloque
+    pacientes = formatear_textos(reporte_agrupado['paciente'].to_numpy(), valores_paciente)
+    procedimientos = formatear_textos(reporte_agrupado['procedimiento'].to_numpy(), valores_procedimiento)
+
+    yield PLANTILLA_INICIO_REPORTE.format(
+        titulo=configuracion['titulo'],
+        encabezado=configuracion['encabezado'],
+        css=CSS_REPORTE,
+        doctor=html.escape(str(doctor)),
+        fecha_inicio=fecha_inicio,
+        fecha_fin=fecha_fin,
+        generado=datetime.now().strftime('%Y-%m-%d %H:%M'),
+        procedimientos=len(df_filtrado),
+        total_pagar=f"${total(['monto_final_pago']):,.2f}",
+        total_retenido=f"${total(['retencion_10']):,.2f}",
+        total_gastos=f"${total(['laboratorio', 'gastos']):,.2f}",
+        encabezados='\n'.join(f"                    <th>{encabezado}</th>" for encabezado, _ in montos)
+    )
+
+    plantilla_fila = (
+        "                <tr><td>{}</td><td>{}</td>"
+        + "<td>{}</td>" * len(montos)
+        + "</tr>\n"
+    )
+    for inicio in range(0, len(reporte_agrupado), FILAS_POR_BLOQUE_REPORTE):
+        fin = inicio + FILAS_POR_BLOQUE_REPORTE
+        bloque = reporte_agrupado.iloc[inicio:fin]
+        columnas = [pacientes[inicio:fin].tolist(), procedimientos[inicio:fin].tolist()]
+        for _, cols in montos:
+            columnas.append(formatear_montos(sumar_columnas(bloque, cols)))
+        yield ''.join(map(plantilla_fila.format, *columnas))
+
+    yield PLANTILLA_FIN_REPORTE.format(
+        totales='\n'.join(f"                    <td><strong>${total(cols):,.2f}</strong></td>" for _, cols in montos)
+    )
+
+
+def agregar_reporte_pdf(documento, tipo, df_filtrado, doctor, fecha_inicio, fecha_fin):
+    """Agregar al documento el estado en PDF (carta) de un doctor, con los mismos datos del reporte HTML"""
+    configuracion = REPORTES_HTML[tipo]
+    montos = configuracion['columnas']
+    reporte_agrupado, valores_paciente, valores_procedimiento, total_general = agrupar_reporte(tipo, df_filtrado)
+
+    def total(cols):
+        return sum(total_general[col] for col in cols)
+
+    columnas = [
+        np.asarray(valores_paciente, dtype=object).take(reporte_agrupado['paciente'].to_numpy()).tolist(),
+        np.asarray(valores_procedimiento, dtype=object).take(reporte_agrupado['procedimiento'].to_numpy()).tolist(),
+    ]
+    columnas += [formatear_montos(sumar_columnas(reporte_agrupado, cols)) for _, cols in montos]
+    return agregar_estado(
+        documento,
+        encabezado=configuracion['encabezado'],
+        doctor=doctor,
+        periodo=f"{pd.Timestamp(fecha_inicio).date()} a {pd.Timestamp(fecha_fin).date()}",
+        generado=datetime.now().strftime('%Y-%m-%d %H:%M'),
+        resumen=[
+            ('Total Procedimientos', str(len(df_filtrado))),
+            ('Total a Pagar', f"${total(['monto_final_pago']):,.2f}"),
+            ('Total Retenido', f"${total(['retencion_10']):,.2f}"),
+            ('Total Gastos', f"${total(['laboratorio', 'gastos']):,.2f}"),
+        ],
+        encabezados=['Paciente', 'Procedimiento'] + [encabezado for encabezado, _ in montos],
+        filas=zip(*columnas),
+        totales=[f"${total(cols):,.2f}" for _, cols in montos],
+        pie=PIE_REPORTE,
+    )
+
+
+def generar_pdf_reportes(df_filtrado, fecha_inicio, fecha_fin, tipo='doctores'):
+    """Un PDF con el estado de cada doctor del período, cada uno desde una página nueva: (bytes, número de estados)"""
+    documento = DocumentoPDF(f"{REPORTES_HTML[tipo]['titulo']} {pd.Timestamp(fecha_inicio).date()} a {pd.Timestamp(fecha_fin).date()}")
+    particiones = df_filtrado.groupby('doctor_a_pagar', observed=True, sort=True)
+    for doctor, grupo in particiones:
+        agregar_reporte_pdf(documento, tipo, grupo, doctor, fecha_inicio, fecha_fin)
+    return bytes(documento), particiones.ngroups
+
+
+def nombre_archivo_reporte(prefijo, doctor, fecha_inicio, fecha_fin, extension='html'):
+    """Nombre de archivo seguro para el reporte (o la exportación) de un doctor en un período"""
+    nombre = re.sub(r'[^\w.-]+', '_', str(doctor)).strip('_') or 'doctor'
+    return f"{prefijo}_{nombre}_{pd.Timestamp(fecha_inicio).date()}_a_{pd.Timestamp(fecha_fin).date()}.{extension}"
+
+
+def generar_zip_reportes(df_filtrado, fecha_inicio, fecha_fin, tipo='doctores', trabajadores=TRABAJADORES_LOTE):
+    """ZIP con un reporte HTML por doctor; devuelve (bytes del ZIP, número de reportes)"""
+    # Particiones por doctor calculadas una sola vez para todo el lote
+    particiones = list(df_filtrado.groupby('doctor_a_pagar', observed=True, sort=True))
+
+    def renderizar(particion):
+        doctor, grupo = particion
+        return doctor, ''.join(renderizar_reporte_html(tipo, grupo, doctor, fecha_inicio, fecha_fin))
+
+    prefijo = REPORTES_HTML[tipo]['archivo']
+    buffer = BytesIO()
+    nombres = set()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archivo, \
+            ThreadPoolExecutor(max_workers=max(1, trabajadores)) as pool:
+        # map conserva el orden de los doctores; cada reporte se escribe en cuanto está listo
+        for doctor, contenido in pool.map(renderizar, particiones):
+            nombre = nombre_archivo_reporte(prefijo, doctor, fecha_inicio, fecha_fin)
+            if nombre in nombres:
+                nombre = f"{nombre[:-len('.html')]}_{len(nombres)}.html"
+            nombres.add(nombre)
+            archivo.writestr(nombre, contenido)
+    return buffer.getvalue(), len(particiones)
+
+
+# Combinaciones (doctor, rango, versión) de métricas de tarjetas que se recuerdan
+TAMANO_MEMO_METRICAS = 256
+
+# Medidas del cubo que suman las tarjetas de métricas, en un solo bloque
+MEDIDAS_TARJETAS = MEDIDAS_CUBO + ['n_filas']
+
+
+class MemoLRU:
+    """Resultados recordados por clave, con los menos usados descartados primero; seguro entre hilos"""
+
+    def __init__(self, maximo):
+        self.maximo = maximo
+        self._valores = OrderedDict()
+        self._candado = threading.Lock()
+
+    def obtener(self, clave, calcular, recordar=None):
+        """Valor recordado para la clave, o calcular() si no existe (se calcula fuera del candado).
+
+        Con `recordar`, solo se guardan los valores para los que recordar(valor) es verdadero.
+        """
+        with self._candado:
+            if clave in self._valores:
+                self._valores.move_to_end(clave)
+                return self._valores[clave]
+        valor = calcular()
+        if recordar is not None and not recordar(valor):
+            return valor
+        with self._candado:
+            self._valores[clave] = valor
+            self._valores.move_to_end(clave)
+            while len(self._valores) > self.maximo:
+                self._valores.popitem(last=False)
+        return valor
+
+
+_memo_metricas = MemoLRU(TAMANO_MEMO_METRICAS)
+
+
+def sumar_metricas_cubo(cubo, doctor="Todos", fecha_inicio=None, fecha_fin=None):
+    """Métricas de tarjetas de un corte del cubo: todas las sumas en una sola reducción de NumPy"""
+    mascara = np.ones(len(cubo), dtype=bool)
+    if doctor != "Todos" and 'doctor_a_pagar' in cubo.columns:
+        mascara &= (cubo['doctor_a_pagar'] == doctor).to_numpy(dtype=bool, na_value=False)
+    if fecha_inicio is not None and fecha_fin is not None and 'fecha' in cubo.columns:
+        fechas = cubo['fecha'].to_numpy(dtype='datetime64[ns]')
+        mascara &= (fechas >= np.datetime64(pd.Timestamp(fecha_inicio), 'ns')) & (fechas <= np.datetime64(pd.Timestamp(fecha_fin), 'ns'))
+
+    columnas = [col for col in MEDIDAS_TARJETAS if col in cubo.columns]
+    sumas = cubo[columnas].to_numpy(dtype=np.float64)[mascara].sum(axis=0)
+    totales = dict(zip(columnas, sumas.tolist()))
+    doctores = cubo['doctor_a_pagar'][mascara].nunique() if 'doctor_a_pagar' in cubo.columns else 0
+    return totales, int(doctores)
+
+
+def metricas_tarjetas(totales, doctores):
+    """Métricas de las tarjetas a partir de las sumas de MEDIDAS_TARJETAS (rentabilidad total como % ponderado)"""
+    def total(col):
+        return totales.get(col, 0)
+
+    pago_total_paciente = total('pago_total_paciente')
+    ingreso_clinica_total = total('ingreso_clinica')
+
+    # Rentabilidad total (% ponderado)
+    rentabilidad_total_pct = (ingreso_clinica_total / pago_total_paciente * 100) if pago_total_paciente > 0 else 0
+
+    return {
+        'total_ingresos': pago_total_paciente,
+        'total_pagos_doctores': total('pago_doctor'),
+        'total_pagos_referidores': total('pago_referidor'),
+        'total_retenciones': total('retencion'),
+        'total_laboratorio': total('laboratorio'),
+        'total_gastos': total('gastos'),
+        'total_cargo_ars': total('cargo_por_ars'),
+        'total_costes': total('costes'),
+        'total_ingreso_clinica': ingreso_clinica_total,
+        'total_rentabilidad': rentabilidad_total_pct,  # %
+        'total_procedimientos': int(total('n_filas')),
+        'doctores_unicos': doctores
+    }
+
+
+# Simulaciones recordadas por versión de datos, vista filtrada y escenario
+TAMANO_MEMO_SIMULACIONES = 32
+_memo_simulaciones = MemoLRU(TAMANO_MEMO_SIMULACIONES)
+
+# Tipos de pago que el simulador puede imponer a un doctor (None conserva el de la hoja)
+TIPOS_PAGO_SIMULACION = {'porcentaje': True, 'tarifario': False}
+
+
+def totales_tarjetas(df, resultado=None):
+    """Sumas de MEDIDAS_TARJETAS de un corte del ledger; las medidas que trae `resultado` se toman de él"""
+    totales = {}
+    for col in MEDIDAS_CUBO:
+        origen = resultado if resultado is not None and col in resultado.columns else df
+        if col in origen.columns:
+            totales[col] = float(np.nansum(origen[col].to_numpy(dtype=np.float64, na_value=np.nan)))
+    totales['n_filas'] = len(df)
+    doctores = df['doctor_a_pagar'].nunique() if 'doctor_a_pagar' in df.columns else 0
+    return totales, int(doctores)
+
+
+def simular_pagos(df, tasas, ajustes=None, doctor="Todos", tipo_pago=None, porcentaje=None):
+    """Recalcular los pagos de un corte del ledger con tasas hipotéticas, por el motor vectorizado.
+
+    `ajustes` ({tasa: fracción}) reemplaza en todas las filas las tasas de las reglas; `tipo_pago`
+    ('porcentaje' o 'tarifario') y `porcentaje` cambian cómo cobra `doctor` ("Todos" para todos).
+    """
+    tasas = {**tasas, **(ajustes or {})}
+    if doctor == "Todos" or 'doctor_a_pagar' not in df.columns:
+        filas_doctor = np.full(len(df), doctor == "Todos")
+    else:
+        filas_doctor = (df['doctor_a_pagar'] == doctor).to_numpy(dtype=bool, na_value=False)
+
+    if porcentaje is not None:
+        tasas['porcentaje'] = np.where(filas_doctor, porcentaje, tasas['porcentaje'])
+    por_porcentaje = mascara_por_porcentaje(df)
+    if tipo_pago is not None:
+        por_porcentaje = np.where(filas_doctor, TIPOS_PAGO_SIMULACION[tipo_pago], por_porcentaje)
+    return calcular_pagos(df, tasas, por_porcentaje)
+
+
+# Tabla de transacciones: columnas en orden de presentación y columnas de texto donde se busca
+COLUMNAS_TRANSACCIONES = [
+    'fecha', 'paciente', 'procedimiento', 'paciente_asegurado',
+    'pago_por_seguro', 'pago_privado', 'pago_total_paciente',
+    'paciente_refido', 'laboratorio', 'gastos',
+    'doctor_a_pagar', 'cobra_por_porcentaje', '%_de_pago',
+    'monto_a_pagar_por_tarifario', 'cargo_por_ars',
+    'descuento_lab', 'descuento_gastos', 'retencion_10',
+    'costes', 'pago_doctor', 'pago_referidor',
+    'ingreso_clinica', 'retencion', 'monto_final_pago', 'rentabilidad'
+]
+COLUMNAS_BUSQUEDA = ['paciente', 'procedimiento', 'doctor_a_pagar', 'doctor_referidor']
+FILAS_POR_PAGINA = [25, 50, 100, 250]
+
+# Órdenes de filas recordados (uno por filtro/búsqueda/orden): cambiar de página no vuelve a ordenar
+TAMANO_MEMO_TRANSACCIONES = 16
+_memo_transacciones = MemoLRU(TAMANO_MEMO_TRANSACCIONES)
+
+
+def buscar_transacciones(df, texto):
+    """Máscara de filas con el texto en alguna columna de búsqueda; sin distinguir mayúsculas"""
+    mascara = np.zeros(len(df), dtype=bool)
+    for col in COLUMNAS_BUSQUEDA:
+        if col not in df.columns:
+            continue
+        # Se busca en los valores distintos y se propaga a las filas por código
+        codigos, valores = codificar_columna(df[col])
+        coincide = pd.Index(valores).astype(str).str.contains(texto, case=False, regex=False)
+        coincide = np.append(np.asarray(coincide, dtype=bool), False)
+        mascara |= coincide[codigos]
+    return mascara
+
+
+def ordenar_transacciones(df, busqueda="", columna_orden=None, ascendente=True):
+    """Posiciones de las filas que cumplen la búsqueda, ordenadas por una columna (estable, vacíos al final)"""
+    posiciones = np.arange(len(df))
+    if busqueda:
+        posiciones = posiciones[buscar_transacciones(df, busqueda)]
+    if columna_orden is None or columna_orden not in df.columns:
+        return posiciones
+
+    serie = df[columna_orden]
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        # Orden alfabético del diccionario, sin convertir las filas a texto
+        rangos = np.argsort(np.argsort(np.asarray(serie.cat.categories.astype(str), dtype=object), kind='stable'))
+        codigos = serie.cat.codes.to_numpy()
+        # Centinela al final para el código -1 (vacío), que funciona aunque el diccionario esté vacío
+        claves = np.where(codigos >= 0, np.append(rangos, 0)[codigos], np.nan)
+    else:
+        claves = serie.to_numpy()
+    claves = pd.Series(claves[posiciones])
+    orden = claves.sort_values(ascending=ascendente, kind='stable', na_position='last').index.to_numpy()
+    return posiciones[orden]
+
+
+# Exportación de transacciones: se escribe por bloques de filas, nunca como un único texto en memoria
+FILAS_POR_BLOQUE_EXPORTACION = 50_000
+FORMATOS_EXPORTACION = {
+    'csv': {'descripcion': 'CSV', 'extension': 'csv', 'mime': 'text/csv'},
+    'csv.gz': {'descripcion': 'CSV comprimido (gzip)', 'extension': 'csv.gz', 'mime': 'application/gzip'},
+    'xlsx': {
+        'descripcion': 'Excel (XLSX)',
+        'extension': 'xlsx',
+        'mime': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    },
+}
+# Límite de filas de una hoja de Excel (incluye el encabezado)
+FILAS_MAXIMAS_XLSX = 1_048_576
+
+
+def bloques_csv(df, filas_por_bloque=FILAS_POR_BLOQUE_EXPORTACION):
+    """CSV en bloques de bytes UTF-8; el encabezado va solo en el primero"""
+    for inicio in range(0, max(len(df), 1), filas_por_bloque):
+        yield df.iloc[inicio:inicio + filas_por_bloque].to_csv(index=False, header=inicio == 0).encode('utf-8')
+
+
+def exportar_transacciones(df, formato, destino, filas_por_bloque=FILAS_POR_BLOQUE_EXPORTACION):
+    """Escribir las transacciones en un archivo binario abierto, bloque a bloque, en el formato pedido"""
+    if formato == 'csv':
+        for bloque in bloques_csv(df, filas_por_bloque):
+            destino.write(bloque)
+    elif formato == 'csv.gz':
+        # mtime fijo: el mismo contenido produce el mismo archivo
+        with gzip.GzipFile(fileobj=destino, mode='wb', mtime=0) as comprimido:
+            for bloque in bloques_csv(df, filas_por_bloque):
+                comprimido.write(bloque)
+    elif formato == 'xlsx':
+        if len(df) >= FILAS_MAXIMAS_XLSX:
+            raise ValueError(f"{len(df):,} filas no caben en una hoja de Excel; use CSV")
+        # Modo de solo escritura: openpyxl no guarda las celdas en memoria, las serializa al agregarlas
+        libro = Workbook(write_only=True)
+        hoja = libro.create_sheet('Transacciones')
+        hoja.append([str(col) for col in df.columns])
+        for inicio in range(0, len(df), filas_por_bloque):
+            bloque = df.iloc[inicio:inicio + filas_por_bloque].astype(object)
+            bloque = bloque.where(bloque.notna(), None)
+            for fila in bloque.itertuples(index=False, name=None):
+                hoja.append(fila)
+        libro.save(destino)
+    else:
+        raise ValueError(f"Formato de exportación desconocido: {formato}")
+
+
+# Reportes HTML recordados (como bytes UTF-8) por tipo, doctor, período y versión de datos
+TAMANO_MEMO_REPORTES = 16
+_memo_reportes = MemoLRU(TAMANO_MEMO_REPORTES)
+
+
+# Dataset procesado e inmutable que se publica a las sesiones; se reemplaza entero, nunca se modifica
+DatosProcesados = namedtuple(
+    'DatosProcesados', ['df', 'doctores', 'cubo', 'indice', 'version', 'publicado', 'reglas']
+)
+
+
+class LedgerPagos:
+    """Ledger de pagos: carga, procesamiento, agregados y reportes (sin interfaz)"""
+
+    def __init__(self, fuente=None, reglas=None):
+        self.df = None
+        self.doctores = []
+        self.datos_cargados = False
+        self.datos_modificados = False
+        self.version_datos = None
+        # Versión de los pagos calculados: la de la fuente más la huella de las reglas (clave de los memos)
+        self.version_resultados = None
+        # Reglas de pago (ver ReglasPago); se leen de REGLAS_PAGO_RUTA al procesar si no se pasan
+        self.reglas = reglas
+        self.google_sheet_url = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/edit?usp=sharing"
+        self.fuente = fuente if fuente is not None else crear_fuente_datos()
+        self.columna_referidor = None
+        # Entradas y resultados del último procesamiento (para recalcular solo lo que cambió)
+        self.entradas_previas = None
+        self.resultados_previos = None
+        # Agregados del ledger procesado (ver construir_cubo)
+        self.cubo = None
+        # Índice de búsqueda por fecha y doctor (ver IndiceLedger)
+        self.indice = None
+        # Serializa las actualizaciones del ledger compartido (sesiones y refresco en segundo plano)
+        self.candado = threading.Lock()
+        # Tiempo, filas y memoria de las etapas ejecutadas por este ledger
+        self.medidor = MedidorEtapas()
+        # Último dataset completo publicado (ver publicar)
+        self.vigente = None
+
+    def notificar_error(self, mensaje):
+        """Informar un error recuperable del procesamiento (el dashboard lo muestra en pantalla)"""
+        logger.error(mensaje)
+
+    @etapa_medida()
+    def cargar_datos(self):
+        """Cargar el ledger desde la fuente configurada y normalizarlo"""
+        try:
+            # Lectura condicional si ya hay datos cargados
+            df, version = self.fuente.leer(condicional=self.df is not None)
+            if df is None:
+                # Sin cambios en la fuente: se conservan los datos ya procesados
+                self.version_datos = version
+                self.datos_modificados = False
+                self.datos_cargados = True
+                return True
+
+            with medir_etapa('normalizar_ledger', filas=len(df)):
+                df = normalizar_ledger(df, self.notificar_error)
+            # Lista de doctores
+            doctores = categorias_presentes(df['doctor_a_pagar']) if 'doctor_a_pagar' in df.columns else self.doctores
+
+            self.df, self.doctores, self.version_datos = df, doctores, version
+            self.cubo = None
+            self.indice = None
+            self.datos_modificados = True
+            self.datos_cargados = True
+            # Solo ahora la versión cuenta como leída: si algo falló antes, el próximo refresco vuelve a descargar
+            self.fuente.confirmar_version(version)
+            return True
+
+        except Exception as e:
+            self.notificar_error(f"Error al cargar desde {self.fuente.descripcion}: {str(e)}")
+            if isinstance(self.fuente, FuenteGoogleSheets):
+                self.notificar_error("Asegúrate de que el Google Sheet esté configurado para acceso público")
+            self.datos_cargados = False
+            return False
+
+    def actualizar_reglas(self):
+        """Leer las reglas de pago si faltan o si su archivo cambió; True si hay reglas nuevas (ValueError si son inválidas)"""
+        if self.reglas is None:
+            self.reglas = ReglasPago.desde_archivo(REGLAS_PAGO_RUTA)
+            return True
+        if not self.reglas.archivo_modificado():
+            return False
+        reglas = ReglasPago.desde_archivo(self.reglas.ruta)
+        cambiaron = reglas.huella != self.reglas.huella
+        self.reglas = reglas
+        return cambiaron
+
+    def refrescar_datos(self):
+        """Cargar, procesar solo si la fuente o las reglas de pago cambiaron y actualizar el snapshot en disco"""
+        if not self.cargar_datos():
+            return False
+        try:
+            reglas_nuevas = self.actualizar_reglas()
+        except ValueError as e:
+            # Con reglas inválidas se siguen usando las anteriores; sin ninguna no se calculan pagos
+            self.notificar_error(str(e))
+            if self.reglas is None:
+                return False
+            reglas_nuevas = False
+        if self.datos_modificados or reglas_nuevas:
+            self.procesar_pagos()
+            self.guardar_snapshot()
+        if self.datos_modificados or reglas_nuevas or self.vigente is None:
+            self.publicar()
+        return True
+
+    def publicar(self):
+        """Publicar el ledger procesado como un dataset nuevo; una sola asignación lo hace visible a todos"""
+        self.vigente = DatosProcesados(
+            self.df, list(self.doctores), self.obtener_cubo(), self.obtener_indice(),
+            self.version_resultados, datetime.now(), self.reglas
+        )
+        return self.vigente
+
+    @etapa_medida()
+    def guardar_snapshot(self, ruta=SNAPSHOT_RUTA):
+        """Escribir el ledger procesado como Feather con encabezado de esquema y versión de la fuente"""
+        if not ruta or pa is None or self.df is None:
+            return False
+        try:
+            tabla = pa.Table.from_pandas(self.df, preserve_index=False)
+            encabezado = {
+                'formato': SNAPSHOT_FORMATO,
+                'fuente': self.fuente.identificador,
+                'version_fuente': self.version_datos,
+                'reglas': None if self.reglas is None else self.reglas.huella,
+                'columnas': list(self.df.columns),
+                'doctores': [str(doctor) for doctor in self.doctores],
+                'creado': datetime.now().isoformat(timespec='seconds'),
+            }
+            metadatos = dict(tabla.schema.metadata or {})
+            metadatos[b'dashboard_pagos'] = json.dumps(encabezado).encode('utf-8')
+            tabla = tabla.replace_schema_metadata(metadatos)
+
+            # Escritura atómica: un lector nunca ve un archivo a medio escribir
+            os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+            temporal = f"{ruta}.tmp"
+            # Un solo lote: al leer, cada columna es un único bloque contiguo dentro del archivo
+            feather.write_feather(tabla, temporal, compression='uncompressed', chunksize=max(len(tabla), 1))
+            os.replace(temporal, ruta)
+            return True
+        except Exception:
+            logger.exception("No se pudo guardar el snapshot %s", ruta)
+            return False
+
+    @etapa_medida()
+    def restaurar_snapshot(self, ruta=SNAPSHOT_RUTA):
+        """Cargar el ledger procesado desde el snapshot si corresponde a la fuente actual.
+
+        El archivo se abre con memory-map y las columnas numéricas sin nulos quedan sobre sus páginas, sin copia;
+        texto, categorías y columnas con nulos se convierten a memoria propia.
+        """
+        if not ruta or pa is None or not os.path.exists(ruta):
+            return False
+        try:
+            if self.reglas is None:
+                self.actualizar_reglas()
+            tabla = feather.read_table(ruta, memory_map=True)
+            encabezado = json.loads((tabla.schema.metadata or {}).get(b'dashboard_pagos', b'{}'))
+            if (encabezado.get('formato') != SNAPSHOT_FORMATO
+                    or encabezado.get('fuente') != self.fuente.identificador
+                    or encabezado.get('reglas') != self.reglas.huella
+                    or not set(COLUMNAS_RESULTADO).issubset(tabla.column_names)):
+                return False
+
+            # split_blocks evita consolidar las columnas en un bloque 2D (lo que copiaría el archivo entero)
+            self.df = tabla.to_pandas(split_blocks=True)
+            self.doctores = encabezado.get('doctores', [])
+            self.version_datos = encabezado.get('version_fuente')
+
+            # Semilla para el recálculo incremental y la lectura condicional del próximo refresco
+            self.entradas_previas = self.entradas_pagos(self.reglas.compilar(self.df))
+            self.resultados_previos = self.df[COLUMNAS_RESULTADO]
+            self.version_resultados = self.clave_resultados()
+            self.fuente.restaurar_version(self.version_datos)
+            self.cubo = construir_cubo(self.df)
+            self.indice = None
+
+            self.datos_modificados = False
+            self.datos_cargados = True
+            self.publicar()
+            return True
+        except Exception:
+            logger.exception("No se pudo leer el snapshot %s", ruta)
+            return False
+
+    def detectar_columna_referidor(self):
+        """Detectar automáticamente la columna que contiene el nombre del doctor referidor"""
+        if self.df is None:
+            return None
+            
+        posibles_nombres = ['doctor_referidor', 'referidor', 'doctor_referido', 
+                           'medico_referidor', 'dr_referidor', 'referido_por', 'referidor_doctor']
+        
+        for col in self.df.columns:
+            col_lower = col.lower()
+            for posible in posibles_nombres:
+                if posible in col_lower:
+                    return col
+        return None
+
+    def entradas_pagos(self, tasas):
+        """Entradas del motor por fila: columnas del ledger y tasas compiladas de las reglas de pago"""
+        columnas_entrada = [col for col in COLUMNAS_ENTRADA_PAGOS if col in self.df.columns]
+        return self.df[columnas_entrada].assign(**{f"tasa_{tasa}": valores for tasa, valores in tasas.items()})
+
+    def clave_resultados(self):
+        """Versión de la fuente y huella de las reglas con que se calcularon los pagos (None sin versión)"""
+        if self.version_datos is None:
+            return None
+        return f"{self.version_datos}:{self.reglas.huella}"
+
+    @etapa_medida()
+    def procesar_pagos(self):
+        """Procesar pagos según las reglas de pago (solo recalcula filas nuevas, modificadas o con otras tasas)"""
+        if self.df is None:
+            return
+        if self.reglas is None:
+            self.actualizar_reglas()
+
+        with medir_etapa('compilar_reglas', filas=len(self.df)):
+            tasas = self.reglas.compilar(self.df)
+        entradas = self.entradas_pagos(tasas)
+
+        if (self.resultados_previos is None
+                or esquema_entrada_pagos(entradas) != esquema_entrada_pagos(self.entradas_previas)):
+            # Primera carga o cambio de columnas/tipos: motor vectorizado sobre todo el ledger
+            with medir_etapa('calcular_pagos', filas=len(self.df)):
+                resultado = calcular_pagos(self.df, tasas)
+        else:
+            # Reutilizar filas ya calculadas y procesar solo las nuevas, editadas o con tasas distintas
+            modificadas = np.flatnonzero(detectar_filas_modificadas(self.entradas_previas, entradas))
+            with medir_etapa('calcular_pagos', filas=len(modificadas)):
+                nuevas = calcular_pagos(
+                    self.df.iloc[modificadas], {tasa: valores[modificadas] for tasa, valores in tasas.items()}
+                )
+            n_comun = min(len(self.resultados_previos), len(self.df))
+            resultado = {}
+            for col in nuevas.columns:
+                valores = np.empty(len(self.df), dtype=self.resultados_previos[col].dtype)
+                valores[:n_comun] = self.resultados_previos[col].to_numpy()[:n_comun]
+                valores[modificadas] = nuevas[col].to_numpy()
+                resultado[col] = valores
+            resultado = pd.DataFrame(resultado, index=self.df.index)
+
+        # DataFrame nuevo: el publicado en self.vigente nunca se modifica en el lugar
+        self.df = self.df.assign(**{col: resultado[col] for col in resultado.columns})
+
+        self.entradas_previas = entradas
+        self.resultados_previos = resultado
+        self.version_resultados = self.clave_resultados()
+        with medir_etapa('construir_cubo', filas=len(self.df)):
+            self.cubo = construir_cubo(self.df)
+        self.indice = None
+
+    def obtener_cubo(self):
+        """Cubo de agregados del ledger actual (se construye si aún no existe)"""
+        if self.cubo is None and self.df is not None:
+            self.cubo = construir_cubo(self.df)
+        return self.cubo
+
+    def obtener_indice(self):
+        """Índice por fecha del ledger actual; None si la columna fecha no es de tipo fecha"""
+        if self.indice is None and self.df is not None and 'fecha' in self.df.columns \
+                and pd.api.types.is_datetime64_any_dtype(self.df['fecha']):
+            self.indice = IndiceLedger(self.df)
+        return self.indice
+
+    @etapa_medida()
+    def calcular_metricas_totales(self, doctor="Todos", fecha_inicio=None, fecha_fin=None):
+        """Calcular métricas para tarjetas de la vista filtrada (rentabilidad total como % ponderado)"""
+        if self.df is None:
+            return {}
+
+        try:
+            cubo = self.obtener_cubo()
+            if self.version_resultados is None:
+                totales, doctores = sumar_metricas_cubo(cubo, doctor, fecha_inicio, fecha_fin)
+            else:
+                # Misma selección sobre la misma versión de datos: no se vuelve a sumar
+                clave = (self.fuente.identificador, self.version_resultados, doctor,
+                         None if fecha_inicio is None else pd.Timestamp(fecha_inicio),
+                         None if fecha_fin is None else pd.Timestamp(fecha_fin))
+                totales, doctores = _memo_metricas.obtener(
+                    clave, lambda: sumar_metricas_cubo(cubo, doctor, fecha_inicio, fecha_fin)
+                )
+
+            return metricas_tarjetas(totales, doctores)
+        except Exception as e:
+            self.notificar_error(f"Error calculando métricas: {str(e)}")
+            return {}
+
+    @etapa_medida()
+    def simular_escenario(self, doctor_seleccionado="Todos", fecha_inicio=None, fecha_fin=None,
+                          ajustes=None, doctor="Todos", tipo_pago=None, porcentaje=None):
+        """Métricas de tarjetas de la vista filtrada con las tasas vigentes y con las del escenario: (base, simuladas)"""
+        if fecha_inicio is None or fecha_fin is None:
+            df_filtrado = self.df
+        else:
+            df_filtrado = self.filtrar_por_fecha(fecha_inicio, fecha_fin, doctor_seleccionado)
+        if df_filtrado is None or df_filtrado.empty:
+            return {}, {}
+        registrar_filas(len(df_filtrado))
+        if self.reglas is None:
+            self.actualizar_reglas()
+
+        def simular():
+            with medir_etapa('compilar_reglas', filas=len(df_filtrado)):
+                tasas = self.reglas.compilar(df_filtrado)
+            with medir_etapa('calcular_pagos', filas=len(df_filtrado)):
+                resultado = simular_pagos(df_filtrado, tasas, ajustes, doctor, tipo_pago, porcentaje)
+            return (metricas_tarjetas(*totales_tarjetas(df_filtrado)),
+                    metricas_tarjetas(*totales_tarjetas(df_filtrado, resultado)))
+
+        if self.version_resultados is None:
+            return simular()
+        clave = (self.fuente.identificador, self.version_resultados, doctor_seleccionado,
+                 None if fecha_inicio is None else pd.Timestamp(fecha_inicio),
+                 None if fecha_fin is None else pd.Timestamp(fecha_fin),
+                 tuple(sorted((ajustes or {}).items())), doctor, tipo_pago, porcentaje)
+        return _memo_simulaciones.obtener(clave, simular)
+
+    @etapa_medida()
+    def obtener_pagos_por_doctor(self):
+        """Resumen de pagos por doctor"""
+        if self.df is None or 'doctor_a_pagar' not in self.df.columns:
+            return pd.DataFrame()
+
+        try:
+            agregado = self.obtener_cubo().groupby('doctor_a_pagar', observed=True).agg({
+                'pago_doctor': 'sum',
+                'retencion': 'sum',
+                'rentabilidad_suma': 'sum',
+                'rentabilidad_n': 'sum',
+                'ingreso_clinica': 'sum',
+                'n_pacientes': 'sum'
+            }).reset_index()
+
+            # Promedio % rentabilidad por doctor a partir de suma y conteo
+            rentabilidad_promedio = agregado['rentabilidad_suma'] / agregado['rentabilidad_n'].where(agregado['rentabilidad_n'] > 0)
+            pagos_doctor = pd.DataFrame({
+                'Doctor': agregado['doctor_a_pagar'],
+                'Total a Pagar': agregado['pago_doctor'],
+                'Total Retenido': agregado['retencion'],
+                'Rentabilidad % Promedio': rentabilidad_promedio,
+                'Ingreso Clínica': agregado['ingreso_clinica'],
+                'N° Procedimientos': agregado['n_pacientes']
+            })
+            pagos_doctor['Promedio por Procedimiento'] = pagos_doctor['Total a Pagar'] / pagos_doctor['N° Procedimientos'].replace(0, 1)
+
+            return pagos_doctor.sort_values('Total a Pagar', ascending=False)
+        except Exception as e:
+            self.notificar_error(f"Error obteniendo pagos por doctor: {str(e)}")
+            return pd.DataFrame()
+
+    @etapa_medida()
+    def obtener_pagos_por_referidor(self):
+        """Resumen de pagos por doctor referidor"""
+        if self.df is None or 'doctor_referidor' not in self.df.columns or 'paciente_refido' not in self.df.columns:
+            return pd.DataFrame()
+
+        try:
+            # Solo pacientes referidos con pago al referidor (medidas referidos_* del cubo)
+            agregado = self.obtener_cubo().groupby('doctor_referidor', observed=True).agg({
+                'referidos_pago': 'sum',
+                'referidos_monto': 'sum',
+                'referidos_n_pacientes': 'sum',
+                'referidos_n_filas': 'sum'
+            }).reset_index()
+            agregado = agregado[agregado['referidos_n_filas'] > 0]
+
+            if len(agregado) == 0:
+                return pd.DataFrame()
+
+            pagos_referidor = agregado[['doctor_referidor', 'referidos_pago', 'referidos_monto', 'referidos_n_pacientes']].copy()
+            pagos_referidor.columns = ['Doctor Referidor', 'Total a Pagar', 'Monto Total Referidos', 'N° Pacientes Referidos']
+            pagos_referidor['Porcentaje Pagado'] = (pagos_referidor['Total a Pagar'] / pagos_referidor['Monto Total Referidos'] * 100).round(2)
+
+            return pagos_referidor.sort_values('Total a Pagar', ascending=False)
+        except Exception as e:
+            self.notificar_error(f"Error obteniendo pagos por referidor: {str(e)}")
+            return pd.DataFrame()
+
+    @etapa_medida()
+    def obtener_evolucion_diaria(self):
+        """Ingresos y pagos por día"""
+        return self.obtener_cubo().groupby('fecha').agg({
+            'pago_total_paciente': 'sum',
+            'pago_doctor': 'sum',
+            'pago_referidor': 'sum'
+        }).reset_index()
+
+    @etapa_medida()
+    def obtener_rentabilidad_por_procedimiento(self):
+        """Rentabilidad % promedio y número de procedimientos por tipo de procedimiento"""
+        agregado = self.obtener_cubo().groupby('procedimiento', observed=True).agg({
+            'rentabilidad_suma': 'sum',
+            'rentabilidad_n': 'sum',
+            'n_pacientes': 'sum'
+        }).reset_index()
+        return pd.DataFrame({
+            'procedimiento': agregado['procedimiento'],
+            'rentabilidad': agregado['rentabilidad_suma'] / agregado['rentabilidad_n'].where(agregado['rentabilidad_n'] > 0),
+            'paciente': agregado['n_pacientes']
+        })
+
+    @etapa_medida()
+    def filtrar_por_fecha(self, fecha_inicio, fecha_fin, doctor="Todos"):
+        """Filtrar por rango de fechas y, opcionalmente, por doctor a pagar"""
+        if self.df is None or 'fecha' not in self.df.columns:
+            return self.df
+        try:
+            indice = self.obtener_indice()
+            if indice is not None and doctor != "Todos" and indice.posiciones_doctor:
+                df_filtrado = self.df.take(indice.posiciones(doctor, fecha_inicio, fecha_fin))
+            else:
+                if indice is not None:
+                    df_filtrado = self.df.iloc[indice.rango(fecha_inicio, fecha_fin)]
+                else:
+                    mask = (self.df['fecha'] >= fecha_inicio) & (self.df['fecha'] <= fecha_fin)
+                    df_filtrado = self.df.loc[mask]
+                if doctor != "Todos" and 'doctor_a_pagar' in df_filtrado.columns:
+                    df_filtrado = df_filtrado[df_filtrado['doctor_a_pagar'] == doctor]
+            registrar_filas(len(df_filtrado))
+            return df_filtrado
+        except Exception as e:
+            self.notificar_error(f"Error filtrando por fecha: {str(e)}")
+            return self.df
+
+    @etapa_medida()
+    def paginar_transacciones(self, fecha_inicio, fecha_fin, doctor="Todos", pagina=1,
+                              filas_por_pagina=FILAS_POR_PAGINA[1], busqueda="", columna_orden=None, ascendente=True):
+        """Una página de la vista filtrada, buscada y ordenada en el servidor: (filas de la página, filas totales)"""
+        df_filtrado = self.filtrar_por_fecha(fecha_inicio, fecha_fin, doctor)
+        if df_filtrado is None:
+            return pd.DataFrame(), 0
+        registrar_filas(len(df_filtrado))
+
+        busqueda = busqueda.strip()
+        if self.version_resultados is None:
+            posiciones = ordenar_transacciones(df_filtrado, busqueda, columna_orden, ascendente)
+        else:
+            clave = (self.fuente.identificador, self.version_resultados, doctor,
+                     pd.Timestamp(fecha_inicio), pd.Timestamp(fecha_fin), busqueda.casefold(), columna_orden, ascendente)
+            posiciones = _memo_transacciones.obtener(
+                clave, lambda: ordenar_transacciones(df_filtrado, busqueda, columna_orden, ascendente)
+            )
+
+        columnas = [col for col in COLUMNAS_TRANSACCIONES if col in df_filtrado.columns]
+        inicio = (max(pagina, 1) - 1) * filas_por_pagina
+        return df_filtrado[columnas].take(posiciones[inicio:inicio + filas_por_pagina]), len(posiciones)
+
+    @etapa_medida()
+    def exportar_vista(self, fecha_inicio, fecha_fin, doctor="Todos", formato='csv'):
+        """Exportación de las transacciones de la vista filtrada como bytes; se genera solo al pedirla"""
+        df_filtrado = self.filtrar_por_fecha(fecha_inicio, fecha_fin, doctor)
+        if df_filtrado is None:
+            return b""
+        registrar_filas(len(df_filtrado))
+        columnas = [col for col in COLUMNAS_TRANSACCIONES if col in df_filtrado.columns]
+        destino = BytesIO()
+        exportar_transacciones(df_filtrado[columnas], formato, destino)
+        return destino.getvalue()
+
+    @etapa_medida()
+    def generar_reporte_impresion(self, doctor_seleccionado, fecha_inicio, fecha_fin):
+        """Generar reporte optimizado para impresión en hoja 8 1/2 x 11"""
+        if self.df is None or 'doctor_a_pagar' not in self.df.columns:
+            return ""
+        
+        try:
+            # Filtrar datos
+            df_filtrado = self.filtrar_por_fecha(fecha_inicio, fecha_fin, doctor_seleccionado)
+            registrar_filas(len(df_filtrado))
+            
+            if df_filtrado.empty:
+                return ""
+            
+            return ''.join(renderizar_reporte_html('impresion', df_filtrado, doctor_seleccionado, fecha_inicio, fecha_fin))
+            
+        except Exception as e:
+            self.notificar_error(f"Error generando reporte de impresión: {str(e)}")
+            return ""
+
+    @etapa_medida()
+    def generar_reporte_para_doctores(self, doctor_seleccionado, fecha_inicio, fecha_fin):
+        """Generar reporte para doctores optimizado para impresión"""
+        if self.df is None or 'doctor_a_pagar' not in self.df.columns:
+            return ""
+        
+        try:
+            # Filtrar datos
+            df_filtrado = self.filtrar_por_fecha(fecha_inicio, fecha_fin, doctor_seleccionado)
+            registrar_filas(len(df_filtrado))
+            
+            if df_filtrado.empty:
+                return ""
+            
+            return ''.join(renderizar_reporte_html('doctores', df_filtrado, doctor_seleccionado, fecha_inicio, fecha_fin))
+            
+        except Exception as e:
+            self.notificar_error(f"Error generando reporte para doctores: {str(e)}")
+            return ""
+
+    @etapa_medida()
+    def generar_reporte_pdf(self, doctor_seleccionado, fecha_inicio, fecha_fin, tipo='doctores'):
+        """Estado en PDF tamaño carta; con "Todos", un estado por doctor en el mismo documento"""
+        if self.df is None or 'doctor_a_pagar' not in self.df.columns:
+            return b""
+
+        # Sin captura de errores: un fallo no debe llegar a la descarga como un PDF vacío
+        df_filtrado = self.filtrar_por_fecha(fecha_inicio, fecha_fin, doctor_seleccionado)
+        registrar_filas(len(df_filtrado))
+        if df_filtrado.empty:
+            return b""
+        if doctor_seleccionado == "Todos":
+            return generar_pdf_reportes(df_filtrado, fecha_inicio, fecha_fin, tipo)[0]
+
+        documento = DocumentoPDF(f"{REPORTES_HTML[tipo]['titulo']} - {doctor_seleccionado}")
+        agregar_reporte_pdf(documento, tipo, df_filtrado, doctor_seleccionado, fecha_inicio, fecha_fin)
+        return bytes(documento)
+
+    def obtener_reporte(self, tipo, doctor_seleccionado, fecha_inicio, fecha_fin, formato='html'):
+        """Reporte HTML (bytes UTF-8) o PDF; se genera una sola vez por doctor, período y versión de datos"""
+        generar = self.generar_reporte_para_doctores if tipo == 'doctores' else self.generar_reporte_impresion
+
+        def construir():
+            if formato == 'pdf':
+                return self.generar_reporte_pdf(doctor_seleccionado, fecha_inicio, fecha_fin, tipo)
+            return generar(doctor_seleccionado, fecha_inicio, fecha_fin).encode('utf-8')
+
+        if self.version_resultados is None:
+            return construir()
+        clave = (self.fuente.identificador, self.version_resultados, tipo, formato, doctor_seleccionado,
+                 pd.Timestamp(fecha_inicio), pd.Timestamp(fecha_fin))
+        # Un reporte vacío (período sin filas o error ya notificado) se vuelve a intentar en la próxima llamada
+        return _memo_reportes.obtener(clave, construir, recordar=bool)
+
+    @etapa_medida()
+    def generar_lote_reportes_doctores(self, fecha_inicio, fecha_fin):
+        """Reporte para doctores de cada doctor del período en un ZIP: (bytes, número de reportes)"""
+        if self.df is None or 'doctor_a_pagar' not in self.df.columns:
+            return None, 0
+
+        try:
+            df_filtrado = self.filtrar_por_fecha(fecha_inicio, fecha_fin)
+            registrar_filas(len(df_filtrado))
+            if df_filtrado.empty:
+                return None, 0
+            return generar_zip_reportes(df_filtrado, fecha_inicio, fecha_fin)
+        except Exception as e:
+            self.notificar_error(f"Error generando reportes en lote: {str(e)}")
+            return None, 0
+
+
+class ActualizadorPeriodico:
+    """Hilo que consulta la fuente cada `intervalo` segundos y publica el ledger procesado si cambió.
+
+    El siguiente dataset se construye fuera de las sesiones; estas solo leen `ledger.vigente`.
+    """
+
+    def __init__(self, ledger, intervalo=INTERVALO_ACTUALIZACION):
+        self.ledger = ledger
+        self.intervalo = intervalo
+        self.ultimo_intento = None
+        self.ultimo_error = None
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    @property
+    def activo(self):
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def iniciar(self):
+        """Arrancar el hilo (idempotente); con intervalo 0 solo refresca cuando se pide"""
+        if not self.activo:
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._ejecutar, name='actualizador-ledger', daemon=True)
+            self._hilo.start()
+        return self
+
+    def detener(self, espera=None):
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(espera)
+
+    def actualizar_ahora(self):
+        """Pedir un refresco inmediato sin esperar a que termine"""
+        self._despertar.set()
+
+    def actualizar(self):
+        """Un ciclo de refresco: cargar, procesar si cambió y publicar. Devuelve True si no hubo error"""
+        self.ultimo_intento = datetime.now()
+        try:
+            with self.ledger.candado:
+                correcto = self.ledger.refrescar_datos()
+            self.ultimo_error = None if correcto else f"No se pudieron cargar los datos desde {self.ledger.fuente.descripcion}"
+        except Exception as e:
+            logger.exception("Error refrescando el ledger en segundo plano")
+            self.ultimo_error = str(e)
+        return self.ultimo_error is None
+
+    def _ejecutar(self):
+        while not self._detener.is_set():
+            # Sin intervalo solo se despierta con actualizar_ahora()
+            self._despertar.wait(self.intervalo if self.intervalo > 0 else None)
+            self._despertar.clear()
+            if not self._detener.is_set():
+                self.actualizar()
+
+
+def _agregar_periodo(parser):
+    parser.add_argument('--desde', required=True, help='Fecha inicio (AAAA-MM-DD)')
+    parser.add_argument('--hasta', required=True, help='Fecha fin (AAAA-MM-DD)')
+
+
+def main(argumentos=None):
+    """Línea de comandos: python motor_pagos.py {resumen,reporte,lote,exportar} ..."""
+    parser = argparse.ArgumentParser(
+        prog='motor_pagos.py',
+        description='Pagos a doctores sin el dashboard: resumen, reportes, nómina en lote y exportaciones'
+    )
+    parser.add_argument('--fuente', choices=sorted(FUENTES_DATOS), help='Tipo de fuente (por defecto DASHBOARD_FUENTE)')
+    parser.add_argument('--ruta', help='Archivo de datos para las fuentes csv, parquet y sqlite')
+    parser.add_argument('--reglas', help='Tabla de reglas de pago, CSV o JSON (por defecto DASHBOARD_REGLAS_PAGO)')
+    parser.add_argument('--rendimiento', action='store_true',
+                        help='Registrar en stderr tiempo, filas y memoria de cada etapa (JSON)')
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+
+    subcomandos.add_parser('resumen', help='Métricas totales y pagos por doctor y por referidor')
+
+    reporte = subcomandos.add_parser('reporte', help='Reporte HTML de un doctor (o de todos) en un período')
+    _agregar_periodo(reporte)
+    reporte.add_argument('--doctor', default='Todos', help='Doctor a pagar (por defecto todos)')
+    reporte.add_argument('--tipo', choices=sorted(REPORTES_HTML), default='doctores', help='Formato del reporte')
+    reporte.add_argument('--formato', choices=['html', 'pdf'], default='html', help='HTML, o PDF tamaño carta')
+    reporte.add_argument('--salida', help='Archivo de salida')
+
+    lote = subcomandos.add_parser('lote', help='Reporte para doctores de cada doctor del período, en un ZIP o un PDF')
+    _agregar_periodo(lote)
+    lote.add_argument('--formato', choices=['zip', 'pdf'], default='zip', help='ZIP de HTML, o un solo PDF carta')
+    lote.add_argument('--salida', help='Archivo de salida')
+    lote.add_argument('--trabajadores', type=int, default=TRABAJADORES_LOTE, help='Hilos de generación')
+
+    exportar = subcomandos.add_parser('exportar', help='Transacciones del período en CSV, CSV comprimido o XLSX')
+    _agregar_periodo(exportar)
+    exportar.add_argument('--doctor', default='Todos', help='Doctor a pagar (por defecto todos)')
+    exportar.add_argument('--formato', choices=list(FORMATOS_EXPORTACION), default='csv', help='Formato del archivo')
+    exportar.add_argument('--salida', help='Archivo de salida')
+
+    args = parser.parse_args(argumentos)
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+    if args.rendimiento:
+        logger_rendimiento.setLevel(logging.DEBUG)
+
+    try:
+        ledger = LedgerPagos(
+            crear_fuente_datos(args.fuente, args.ruta),
+            ReglasPago.desde_archivo(args.reglas) if args.reglas else None
+        )
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    if not ledger.refrescar_datos():
+        print(f"No se pudieron cargar los datos desde {ledger.fuente.descripcion}", file=sys.stderr)
+        return 1
+
+    if args.comando == 'resumen':
+        for clave, valor in ledger.calcular_metricas_totales().items():
+            print(f"{clave}: {valor:,.2f}" if isinstance(valor, float) else f"{clave}: {valor}")
+        for titulo, tabla in (('Pagos por doctor', ledger.obtener_pagos_por_doctor()),
+                              ('Pagos por referidor', ledger.obtener_pagos_por_referidor())):
+            if not tabla.empty:
+                print(f"\n{titulo}\n{tabla.to_string(index=False)}")
+        return 0
+
+    fecha_inicio, fecha_fin = pd.to_datetime(args.desde), pd.to_datetime(args.hasta)
+
+    if args.comando == 'reporte':
+        contenido = ledger.obtener_reporte(args.tipo, args.doctor, fecha_inicio, fecha_fin, args.formato)
+        if not contenido:
+            print("No hay datos para el reporte con los filtros seleccionados", file=sys.stderr)
+            return 1
+        salida = args.salida or nombre_archivo_reporte(
+            REPORTES_HTML[args.tipo]['archivo'], args.doctor, fecha_inicio, fecha_fin, args.formato
+        )
+        with open(salida, 'wb') as archivo:
+            archivo.write(contenido)
+        print(f"Reporte guardado en {salida}")
+        return 0
+
+    if args.comando == 'exportar':
+        df_filtrado = ledger.filtrar_por_fecha(fecha_inicio, fecha_fin, args.doctor)
+        salida = args.salida or nombre_archivo_reporte(
+            'transacciones', args.doctor, fecha_inicio, fecha_fin, FORMATOS_EXPORTACION[args.formato]['extension']
+        )
+        columnas = [col for col in COLUMNAS_TRANSACCIONES if col in df_filtrado.columns]
+        # Directo al archivo: ni el CSV ni el XLSX completos pasan por memoria
+        try:
+            with open(salida, 'wb') as archivo:
+                exportar_transacciones(df_filtrado[columnas], args.formato, archivo)
+        except ValueError as e:
+            os.remove(salida)
+            print(str(e), file=sys.stderr)
+            return 1
+        print(f"{len(df_filtrado):,} transacciones guardadas en {salida}")
+        return 0
+
+    df_filtrado = ledger.filtrar_por_fecha(fecha_inicio, fecha_fin)
+    if df_filtrado.empty:
+        print("No hay datos en el período seleccionado", file=sys.stderr)
+        return 1
+    salida = args.salida or f"reportes_doctores_{fecha_inicio.date()}_a_{fecha_fin.date()}.{args.formato}"
+    if args.formato == 'pdf':
+        contenido, cantidad = generar_pdf_reportes(df_filtrado, fecha_inicio, fecha_fin)
+    else:
+        contenido, cantidad = generar_zip_reportes(df_filtrado, fecha_inicio, fecha_fin, trabajadores=args.trabajadores)
+    with open(salida, 'wb') as archivo:
+        archivo.write(contenido)
+    print(f"{cantidad} reportes guardados en {salida}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+"""Estados de pago en PDF tamaño carta (8 1/2 x 11) sin dependencias: texto, rectángulos y tablas con las fuentes base del PDF"""
+import itertools
+import re
+import unicodedata
+import zlib
+
+# Hoja carta en puntos (1/72 de pulgada) y área útil
+ANCHO_PAGINA = 612
+ALTO_PAGINA = 792
+MARGEN = 36
+ANCHO_UTIL = ANCHO_PAGINA - 2 * MARGEN
+# Límite inferior del contenido; debajo va el número de página
+LIMITE_CONTENIDO = ALTO_PAGINA - 54
+
+# Colores del reporte HTML (RGB 0-1)
+AZUL = (0.0, 0.478, 1.0)
+GRIS_TEXTO = (0.4, 0.4, 0.4)
+GRIS_FONDO = (0.961, 0.969, 0.980)
+GRIS_LINEA = (0.898, 0.898, 0.906)
+NEGRO = (0.114, 0.114, 0.122)
+BLANCO = (1.0, 1.0, 1.0)
+
+# Tipografía y alturas de la tabla
+TAMANO_TABLA = 8.5
+ALTO_ENCABEZADO_TABLA = 18
+ALTO_FILA = 15
+ANCHO_COLUMNA_MONTO = 86
+
+# Anchos de Helvetica y Helvetica-Bold (AFM estándar, milésimas de em) para los caracteres 32-126
+_ANCHOS_ASCII = (
+    "278 278 355 556 556 889 667 191 333 333 389 584 278 333 278 278 556 556 556 556 556 556 556 556 556 556 "
+    "278 278 584 584 584 556 1015 667 667 722 722 667 611 778 722 278 500 667 556 833 722 778 667 778 722 667 "
+    "611 722 667 944 667 667 611 278 278 278 469 556 333 556 556 500 556 556 278 556 556 222 222 500 222 833 "
+    "556 556 556 556 333 500 278 556 500 722 500 500 500 334 260 334 584"
+)
+_ANCHOS_ASCII_NEGRITA = (
+    "278 333 474 556 556 889 722 238 333 333 389 584 278 333 278 278 556 556 556 556 556 556 556 556 556 556 "
+    "333 333 584 584 584 611 975 722 722 722 722 667 611 778 722 278 556 722 611 833 722 778 667 778 722 667 "
+    "611 722 667 944 667 667 611 333 278 333 584 556 333 556 611 556 611 556 333 611 611 278 278 556 278 889 "
+    "611 611 611 611 389 556 333 611 556 778 556 556 500 389 280 389 584"
+)
+
+
+# Ancho de los caracteres sin medida conocida (el de una cifra)
+ANCHO_POR_DEFECTO = 556
+
+# Saltos de línea (Alt+Enter en la hoja), tabuladores y demás espacios o caracteres de control
+_ESPACIOS_Y_CONTROL = re.compile(r'[\s\x00-\x1f\x7f-\x9f]+')
+
+
+def _tabla_anchos(anchos_ascii):
+    """Ancho de cada carácter de WinAnsi; las letras acentuadas toman el de su letra base y el resto 556"""
+    anchos = {chr(32 + i): int(ancho) for i, ancho in enumerate(anchos_ascii.split())}
+    for caracter in bytes(range(128, 256)).decode('cp1252', 'ignore'):
+        base = unicodedata.normalize('NFD', caracter)[0]
+        anchos.setdefault(caracter, anchos.get(base, ANCHO_POR_DEFECTO))
+    anchos.update({'…': 1000, '–': 556, '·': 278, '©': 737})
+    return anchos
+
+
+_ANCHOS = _tabla_anchos(_ANCHOS_ASCII)
+_ANCHOS_NEGRITA = _tabla_anchos(_ANCHOS_ASCII_NEGRITA)
+
+
+def texto_pdf(texto):
+    """Texto representable en WinAnsi en una sola línea: forma compuesta, espacios y controles como un espacio,
+    sin emojis ni caracteres fuera de la codificación"""
+    texto = _ESPACIOS_Y_CONTROL.sub(' ', unicodedata.normalize('NFC', str(texto)))
+    return texto.encode('cp1252', 'ignore').decode('cp1252').strip()
+
+
+def ancho_texto(texto, tamano, negrita=False):
+    """Ancho en puntos de un texto ya pasado por texto_pdf"""
+    anchos = _ANCHOS_NEGRITA if negrita else _ANCHOS
+    return sum(map(anchos.get, texto, itertools.repeat(ANCHO_POR_DEFECTO))) * tamano / 1000
+
+
+def ajustar_texto(texto, ancho_maximo, tamano, negrita=False):
+    """Recortar con puntos suspensivos lo que no cabe en el ancho dado"""
+    if ancho_texto(texto, tamano, negrita) <= ancho_maximo:
+        return texto
+    anchos = _ANCHOS_NEGRITA if negrita else _ANCHOS
+    disponible = ancho_maximo * 1000 / tamano - anchos['…']
+    acumulado = 0
+    for posicion, caracter in enumerate(texto):
+        acumulado += anchos.get(caracter, ANCHO_POR_DEFECTO)
+        if acumulado > disponible:
+            return texto[:posicion].rstrip() + '…'
+    return texto
+
+
+def _escapar(texto):
+    return texto.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _color(color):
+    return '%.3f %.3f %.3f' % color
+
+
+class PaginaPDF:
+    """Operaciones de dibujo de una página; las coordenadas se dan desde el borde superior"""
+
+    def __init__(self):
+        self.operaciones = []
+
+    def texto(self, x, y, texto, tamano=10, negrita=False, color=NEGRO, alineacion='izquierda', ancho=None):
+        """Texto con la línea base en y; alineado a la izquierda, al centro o a la derecha de [x, x + ancho]"""
+        if alineacion != 'izquierda':
+            sobrante = ancho - ancho_texto(texto, tamano, negrita)
+            x += sobrante if alineacion == 'derecha' else sobrante / 2
+        self.operaciones.append(
+            f"BT /{'F2' if negrita else 'F1'} {tamano:g} Tf {_color(color)} rg "
+            f"{x:.2f} {ALTO_PAGINA - y:.2f} Td ({_escapar(texto)}) Tj ET"
+        )
+
+    def fila(self, y, celdas, tamano):
+        """Celdas de una fila de tabla en un solo objeto de texto: [(x, texto ya escapado)] con la línea base en y"""
+        base = ALTO_PAGINA - y
+        self.operaciones.append(
+            f"BT /F1 {tamano:g} Tf {_color(NEGRO)} rg "
+            + ' '.join(f"1 0 0 1 {x:.2f} {base:.2f} Tm ({texto}) Tj" for x, texto in celdas)
+            + " ET"
+        )
+
+    def rectangulo(self, x, y, ancho, alto, relleno):
+        """Rectángulo relleno con su esquina superior izquierda en (x, y)"""
+        self.operaciones.append(f"{_color(relleno)} rg {x:.2f} {ALTO_PAGINA - y - alto:.2f} {ancho:.2f} {alto:.2f} re f")
+
+    def linea(self, x1, y1, x2, y2, color=GRIS_LINEA, grosor=0.5):
+        self.operaciones.append(
+            f"{_color(color)} RG {grosor:g} w {x1:.2f} {ALTO_PAGINA - y1:.2f} m {x2:.2f} {ALTO_PAGINA - y2:.2f} l S"
+        )
+
+    def contenido(self):
+        """Flujo de contenido de la página en WinAnsi"""
+        return '\n'.join(self.operaciones).encode('cp1252')
+
+
+class DocumentoPDF:
+    """Documento de varias páginas con Helvetica y Helvetica-Bold (WinAnsi); se serializa con bytes()"""
+
+    def __init__(self, titulo=""):
+        self.titulo = texto_pdf(titulo)
+        self.paginas = []
+
+    def nueva_pagina(self):
+        pagina = PaginaPDF()
+        self.paginas.append(pagina)
+        return pagina
+
+    def __bytes__(self):
+        objetos = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            None,  # Árbol de páginas: necesita los números de objeto de cada página
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+            f"<< /Title ({_escapar(self.titulo)}) /Producer (Sistema de Pagos Clinica Padilla) >>".encode('cp1252'),
+        ]
+        referencias = []
+        for pagina in self.paginas:
+            contenido = zlib.compress(pagina.contenido(), 6)
+            objetos.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(contenido) + contenido + b"\nendstream")
+            objetos.append((
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {ANCHO_PAGINA} {ALTO_PAGINA}] "
+                f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {len(objetos)} 0 R >>"
+            ).encode('ascii'))
+            referencias.append(f"{len(objetos)} 0 R")
+        objetos[1] = f"<< /Type /Pages /Kids [{' '.join(referencias)}] /Count {len(referencias)} >>".encode('ascii')
+
+        salida = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        posiciones = []
+        for numero, objeto in enumerate(objetos, start=1):
+            posiciones.append(len(salida))
+            salida += b"%d 0 obj\n" % numero + objeto + b"\nendobj\n"
+        inicio_xref = len(salida)
+        salida += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1)
+        salida += b''.join(b"%010d 00000 n \n" % posicion for posicion in posiciones)
+        salida += b"trailer\n<< /Size %d /Root 1 0 R /Info 5 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objetos) + 1, inicio_xref)
+        return bytes(salida)
+
+
+def _anchos_columnas(encabezados):
+    """Paciente y procedimiento se reparten lo que dejan las columnas de monto"""
+    montos = len(encabezados) - 2
+    restante = ANCHO_UTIL - montos * ANCHO_COLUMNA_MONTO
+    return [restante * 0.55, restante * 0.45] + [ANCHO_COLUMNA_MONTO] * montos
+
+
+def agregar_estado(documento, encabezado, doctor, periodo, generado, resumen, encabezados, filas, totales, pie):
+    """Agregar el estado de un doctor desde una página nueva.
+
+    Cada página lleva el encabezado del estado y repite el de la tabla; el resumen, cada fila,
+    la fila de totales y el pie nunca se parten entre páginas.
+    """
+    encabezado = texto_pdf(encabezado)
+    datos = [f"Doctor: {texto_pdf(doctor)}", f"Período: {periodo}", f"Generado: {generado}"]
+    anchos = _anchos_columnas(encabezados)
+    posiciones_x = [MARGEN + sum(anchos[:i]) for i in range(len(anchos))]
+    paginas = []
+
+    def nueva_pagina():
+        pagina = documento.nueva_pagina()
+        paginas.append(pagina)
+        pagina.texto(MARGEN, MARGEN + 16, encabezado, 16, True, NEGRO, 'centro', ANCHO_UTIL)
+        for indice, dato in enumerate(datos):
+            alineacion = ('izquierda', 'centro', 'derecha')[indice]
+            pagina.texto(MARGEN, MARGEN + 38, texto_pdf(dato), 9, False, GRIS_TEXTO, alineacion, ANCHO_UTIL)
+        pagina.linea(MARGEN, MARGEN + 48, MARGEN + ANCHO_UTIL, MARGEN + 48, AZUL, 2)
+        return pagina, MARGEN + 64
+
+    def encabezado_tabla(pagina, y):
+        pagina.rectangulo(MARGEN, y, ANCHO_UTIL, ALTO_ENCABEZADO_TABLA, AZUL)
+        base = y + ALTO_ENCABEZADO_TABLA - 5.5
+        for indice, titulo in enumerate(encabezados):
+            alineacion = 'izquierda' if indice < 2 else 'derecha'
+            pagina.texto(posiciones_x[indice] + 4, base, texto_pdf(titulo), TAMANO_TABLA, True, BLANCO, alineacion, anchos[indice] - 8)
+        return y + ALTO_ENCABEZADO_TABLA
+
+    pagina, y = nueva_pagina()
+
+    # Resumen en tarjetas, como la grilla del reporte HTML
+    ancho_tarjeta = (ANCHO_UTIL - 3 * 10) / 4
+    for indice, (etiqueta, valor) in enumerate(resumen):
+        x = MARGEN + indice * (ancho_tarjeta + 10)
+        pagina.rectangulo(x, y, ancho_tarjeta, 48, GRIS_FONDO)
+        pagina.texto(x, y + 16, texto_pdf(etiqueta), 8, False, GRIS_TEXTO, 'centro', ancho_tarjeta)
+        pagina.texto(x, y + 37, texto_pdf(valor), 13, True, AZUL, 'centro', ancho_tarjeta)
+    y += 68
+    pagina.texto(MARGEN, y, "Detalle por Paciente y Procedimiento", 12, True)
+    y = encabezado_tabla(pagina, y + 8)
+
+    # Textos recortados y escapados una vez por valor distinto; los montos van alineados a la derecha
+    recortes = ({}, {})
+    bordes = [x + ancho - 4 for x, ancho in zip(posiciones_x, anchos)]
+    for fila in filas:
+        if y + ALTO_FILA > LIMITE_CONTENIDO:
+            pagina, y = nueva_pagina()
+            y = encabezado_tabla(pagina, y)
+        celdas = []
+        for indice in (0, 1):
+            recorte = recortes[indice].get(fila[indice])
+            if recorte is None:
+                recorte = _escapar(ajustar_texto(texto_pdf(fila[indice]), anchos[indice] - 8, TAMANO_TABLA))
+                recortes[indice][fila[indice]] = recorte
+            celdas.append((posiciones_x[indice] + 4, recorte))
+        for indice in range(2, len(fila)):
+            celdas.append((bordes[indice] - ancho_texto(fila[indice], TAMANO_TABLA), fila[indice]))
+        pagina.fila(y + ALTO_FILA - 4.5, celdas, TAMANO_TABLA)
+        y += ALTO_FILA
+        pagina.linea(MARGEN, y, MARGEN + ANCHO_UTIL, y)
+
+    # Fila de totales
+    if y + ALTO_FILA + 4 > LIMITE_CONTENIDO:
+        pagina, y = nueva_pagina()
+        y = encabezado_tabla(pagina, y)
+    pagina.rectangulo(MARGEN, y, ANCHO_UTIL, ALTO_FILA + 4, GRIS_FONDO)
+    pagina.linea(MARGEN, y, MARGEN + ANCHO_UTIL, y, AZUL, 1.5)
+    base = y + ALTO_FILA
+    pagina.texto(posiciones_x[0] + 4, base, "TOTAL GENERAL", TAMANO_TABLA + 0.5, True)
+    for indice, valor in enumerate(totales, start=2):
+        pagina.texto(posiciones_x[indice] + 4, base, valor, TAMANO_TABLA + 0.5, True, NEGRO, 'derecha', anchos[indice] - 8)
+    y += ALTO_FILA + 4
+
+    # Pie del estado
+    alto_pie = 24 + 12 * len(pie)
+    if y + alto_pie > LIMITE_CONTENIDO:
+        pagina, y = nueva_pagina()
+    y += 16
+    pagina.linea(MARGEN, y, MARGEN + ANCHO_UTIL, y)
+    for linea in pie:
+        y += 12
+        pagina.texto(MARGEN, y, texto_pdf(linea), 8, False, GRIS_TEXTO, 'centro', ANCHO_UTIL)
+
+    # Numeración del estado, al pie de cada página
+    for numero, pagina in enumerate(paginas, start=1):
+        pagina.texto(MARGEN, ALTO_PAGINA - 24, f"Página {numero} de {len(paginas)}", 8, False, GRIS_TEXTO, 'centro', ANCHO_UTIL)
+    return len(paginas)
@@ -0,0 +1,379 @@
+"""Equivalencia del motor de pagos vectorizado con el cálculo fila por fila original"""
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import motor_pagos  # noqa: E402
+from benchmark_pagos import generar_ledger_sintetico  # noqa: E402
+from motor_pagos import (  # noqa: E402
+    COLUMNAS_RESULTADO, DescargaCondicional, FuenteCSV, FuenteGoogleSheets, LedgerPagos, ReglasPago, calcular_pagos,
+    leer_csv, normalizar_ledger, ordenar_transacciones
+)
+
+
+def calcular_pagos_por_fila(df):
+    """Copia del bucle iterrows de procesar_pagos anterior al motor vectorizado (sin Streamlit)"""
+    df = df.copy()
+    df['pago_total_paciente'] = df['pago_por_seguro'].fillna(0) + df['pago_privado'].fillna(0)
+    for col in COLUMNAS_RESULTADO[1:]:
+        df[col] = 0.0
+
+    for idx, row in df.iterrows():
+        pago_total = float(row.get('pago_total_paciente', 0) or 0)
+        pago_doctor = 0.0
+        pago_referidor = 0.0
+        retencion = 0.0
+        cargo_ars = 0.0
+
+        pago_seguro_val = float(row.get('pago_por_seguro', 0) or 0)
+        if pago_seguro_val > 0:
+            cargo_ars = pago_total * 0.10
+
+        p_ref = str(row.get('paciente_refido', '')).strip().lower()
+        p_ref = p_ref.replace('si\u0301', 's\xed')
+        es_referido = bool(re.match(r'^(si|sí|s[ií]|yes|true|1)$', p_ref))
+        if es_referido:
+            pago_referidor = pago_total * 0.10
+
+        cobra_por_porcentaje = False
+        if 'cobra_por_porcentaje' in df.columns and pd.notna(row.get('cobra_por_porcentaje')):
+            cobra_por_porcentaje = str(row.get('cobra_por_porcentaje')).strip().lower() in ['si', 'sí', 'yes', 'true', '1']
+
+        if cobra_por_porcentaje:
+            porcentaje = 0.5
+            if '%_de_pago' in df.columns and pd.notna(row.get('%_de_pago')):
+                try:
+                    porcentaje = float(str(row['%_de_pago']).replace('%', '').strip()) / 100
+                except ValueError:
+                    porcentaje = 0.5
+
+            laboratorio = float(row.get('laboratorio', 0) or 0)
+            gastos = float(row.get('gastos', 0) or 0)
+            descuentos = laboratorio + gastos
+            base_para_porcentaje = max(0, pago_total - descuentos - cargo_ars)
+            pago_doctor = base_para_porcentaje * porcentaje
+            retencion = pago_doctor * 0.10
+            pago_doctor = pago_doctor - retencion
+            descuento_lab = laboratorio
+            descuento_gastos = gastos
+        else:
+            pago_tarifario = float(row.get('monto_a_pagar_por_tarifario', 0) or 0)
+            pago_base = max(0, pago_tarifario - cargo_ars)
+            retencion = pago_base * 0.10
+            pago_doctor = pago_base - retencion
+            descuento_lab = 0.0
+            descuento_gastos = 0.0
+
+        costes = retencion + descuento_lab + descuento_gastos + cargo_ars
+        ingreso_clinica = pago_total - (pago_doctor + costes + pago_referidor)
+        rentabilidad_pct = (ingreso_clinica / pago_total * 100) if pago_total > 0 else 0
+
+        df.at[idx, 'pago_doctor'] = pago_doctor
+        df.at[idx, 'pago_referidor'] = pago_referidor
+        df.at[idx, 'retencion'] = retencion
+        df.at[idx, 'retencion_10'] = retencion
+        df.at[idx, 'descuento_lab'] = descuento_lab
+        df.at[idx, 'descuento_gastos'] = descuento_gastos
+        df.at[idx, 'cargo_por_ars'] = cargo_ars
+        df.at[idx, 'costes'] = costes
+        df.at[idx, 'ingreso_clinica'] = ingreso_clinica
+        df.at[idx, 'monto_final_pago'] = pago_doctor
+        df.at[idx, 'rentabilidad'] = rentabilidad_pct
+
+    return df[COLUMNAS_RESULTADO]
+
+
+class LedgerPrueba(LedgerPagos):
+    """Ledger sobre un CSV temporal; el snapshot se escribe junto al CSV y no en .cache"""
+
+    def guardar_snapshot(self, ruta=None):
+        return super().guardar_snapshot(os.path.join(os.path.dirname(self.fuente.ruta), 'ledger.arrow'))
+
+
+def ledger_desde(tmp_path, crudo, reglas=None):
+    """Ledger procesado a partir de un DataFrame con las columnas de la hoja"""
+    ruta = tmp_path / 'ledger.csv'
+    crudo.to_csv(ruta, index=False)
+    ledger = LedgerPrueba(FuenteCSV(str(ruta)), reglas)
+    assert ledger.refrescar_datos()
+    return ledger
+
+
+def filas_borde():
+    """Casos límite de la hoja: % vacío o no numérico, variantes de 'sí', montos negativos, sin referidor"""
+    return pd.DataFrame({
+        'Fecha': ['01/15/2024'] * 10,
+        'Paciente': [f"Paciente borde {i}" for i in range(10)],
+        'Procedimiento': ['Consulta'] * 10,
+        'Pago por Seguro': ['$1,000.00', '$0.00', '-$500.00', '', '$2,500.00',
+                            '$300.00', '$0.00', '$1,200.00', '$800.00', '$0.00'],
+        'Pago Privado': ['$500.00', '$2,000.00', '$1,000.00', '$1,500.00', '-$3,000.00',
+                         '$0.00', '$0.00', '$400.00', '$100.00', '$750.00'],
+        'Paciente Refido': ['Si', 'SI', 'sí', 'si\u0301', ' Sí ', 'No', None, 'yes', '', 'TRUE'],
+        'Doctor Referidor': ['Dr. Ana Padilla', None, '', 'Dr. Luis Pérez', None, None, None, '', None, 'Dr. Rosa Díaz'],
+        'Laboratorio': ['$100.00', '', '-$50.00', '$0.00', '$200.00', '$0.00', '$0.00', '$5,000.00', '$0.00', '$10.00'],
+        'Gastos': ['$0.00', '$300.00', '$0.00', '', '-$100.00', '$0.00', '$0.00', '$0.00', '$50.00', '$0.00'],
+        'Doctor a Pagar': ['Dr. María Gómez'] * 10,
+        'Cobra por Porcentaje': ['Sí', 'Sí', 'si', 'Sí', 'No', None, 'Sí', 'Sí', 'SI', 'No'],
+        '% de Pago': ['', None, '45 %', 'abc', '50%', '40%', '60', '35.5%', '%', ''],
+        'Monto a Pagar por Tarifario': ['$400.00', '$0.00', '', '$100.00', '-$200.00',
+                                        '$150.00', '$0.00', '$0.00', '$90.00', '$1,000.00'],
+    })
+
+
+@pytest.mark.parametrize('crudo', [
+    pytest.param(generar_ledger_sintetico(3_000, semilla=7), id='sintetico'),
+    pytest.param(filas_borde(), id='bordes'),
+])
+def test_calcular_pagos_igual_al_calculo_por_fila(crudo):
+    df = normalizar_ledger(crudo.copy())
+    esperado = calcular_pagos_por_fila(df)
+    obtenido = calcular_pagos(df)[COLUMNAS_RESULTADO]
+    pd.testing.assert_frame_equal(obtenido, esperado, check_exact=True)
+
+
+def _agregar_filas(crudo):
+    return pd.concat([crudo, generar_ledger_sintetico(250, semilla=11)], ignore_index=True)
+
+
+def _editar_filas(crudo):
+    crudo = crudo.copy()
+    crudo.loc[[3, 500, 1999], 'Pago Privado'] = '$12,345.67'
+    crudo.loc[[10, 20], 'Cobra por Porcentaje'] = 'Sí'
+    crudo.loc[[10, 20], '% de Pago'] = '35%'
+    crudo.loc[42, 'Paciente Refido'] = 'si\u0301'
+    return crudo
+
+
+@pytest.mark.parametrize('modificar, incremental', [
+    pytest.param(_agregar_filas, True, id='filas_agregadas'),
+    pytest.param(_editar_filas, True, id='filas_editadas'),
+    pytest.param(lambda crudo: crudo.iloc[:-300], True, id='filas_eliminadas'),
+    pytest.param(lambda crudo: crudo.iloc[np.r_[100:200, 0:100, 200:len(crudo)]], True, id='filas_reordenadas'),
+    pytest.param(lambda crudo: crudo.drop(columns=['% de Pago']), False, id='cambio_de_esquema'),
+])
+def test_procesar_pagos_incremental_igual_al_calculo_completo(tmp_path, modificar, incremental):
+    crudo = generar_ledger_sintetico(2_000, semilla=5)
+    ledger = ledger_desde(tmp_path, crudo)
+
+    ruta = tmp_path / 'ledger.csv'
+    modificar(crudo).to_csv(ruta, index=False)
+    # La versión de un archivo es su fecha de modificación y tamaño: se fuerza una fecha distinta
+    os.utime(ruta, ns=(os.stat(ruta).st_atime_ns, os.stat(ruta).st_mtime_ns + 10**9))
+    assert ledger.refrescar_datos()
+
+    calculo = ledger.medidor.tabla().query("etapa == 'calcular_pagos'").iloc[-1]
+    assert (calculo['filas'] < len(ledger.df)) == incremental
+
+    df = normalizar_ledger(leer_csv(str(ruta)))
+    esperado = calcular_pagos(df, ledger.reglas.compilar(df))[COLUMNAS_RESULTADO]
+    pd.testing.assert_frame_equal(ledger.df[COLUMNAS_RESULTADO], esperado, check_exact=True)
+
+
+def test_snapshot_restaurado_igual_al_ledger_procesado(tmp_path):
+    ledger = ledger_desde(tmp_path, generar_ledger_sintetico(2_000, semilla=9))
+    restaurado = LedgerPrueba(FuenteCSV(ledger.fuente.ruta))
+    assert restaurado.restaurar_snapshot(str(tmp_path / 'ledger.arrow'))
+
+    pd.testing.assert_frame_equal(restaurado.df, ledger.df, check_exact=True)
+    assert restaurado.version_resultados == ledger.version_resultados
+
+
+def test_filas_borde_cubren_los_casos():
+    df = normalizar_ledger(filas_borde())
+    resultado = calcular_pagos(df)
+    # Si, SI, sí (compuesta y con tilde combinada), yes y TRUE pagan referidor; 'No', vacío y nulo no
+    referidos = [True, True, True, True, True, False, False, True, False, True]
+    esperado = np.where(referidos, resultado['pago_total_paciente'] * 0.10, 0.0)
+    np.testing.assert_array_equal(resultado['pago_referidor'].to_numpy(), esperado)
+    assert np.isfinite(resultado.to_numpy(dtype=float)).all()
+
+
+def test_ordenar_transacciones_columna_categorica_vacia():
+    df = pd.DataFrame({'paciente': pd.Categorical([None, None])})
+    np.testing.assert_array_equal(ordenar_transacciones(df, '', 'paciente'), [0, 1])
+
+    df = pd.DataFrame({'paciente': pd.Categorical(['b', None, 'a'])})
+    np.testing.assert_array_equal(ordenar_transacciones(df, '', 'paciente'), [2, 0, 1])
+    np.testing.assert_array_equal(ordenar_transacciones(df, '', 'paciente', ascendente=False), [0, 2, 1])
+
+
+def test_obtener_reporte_no_recuerda_reportes_fallidos(tmp_path, monkeypatch):
+    ledger = ledger_desde(tmp_path, filas_borde())
+    fecha = pd.Timestamp('2024-01-15')
+
+    def fallar(*args, **kwargs):
+        raise RuntimeError("fallo de plantilla")
+
+    with monkeypatch.context() as parche:
+        parche.setattr(motor_pagos, 'renderizar_reporte_html', fallar)
+        assert ledger.obtener_reporte('doctores', "Todos", fecha, fecha) == b""
+    assert ledger.obtener_reporte('doctores', "Todos", fecha, fecha).startswith(b"<!DOCTYPE html>")
+
+
+@pytest.fixture
+def servidor_hoja():
+    """Servidor HTTP local que publica un CSV con ETag y responde 304 a If-None-Match"""
+    estado = {'cuerpo': b"", 'etag': None, 'peticiones': []}
+
+    class Manejador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            estado['peticiones'].append(dict(self.headers))
+            if estado['etag'] and self.headers.get('If-None-Match') == estado['etag']:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            if estado['etag']:
+                self.send_header('ETag', estado['etag'])
+            self.send_header('Content-Length', str(len(estado['cuerpo'])))
+            self.end_headers()
+            self.wfile.write(estado['cuerpo'])
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), Manejador)
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    estado['url'] = f"http://127.0.0.1:{servidor.server_address[1]}/export?format=csv"
+    yield estado
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def test_descarga_condicional_304_tras_etag(servidor_hoja):
+    servidor_hoja.update(cuerpo=filas_borde().to_csv(index=False).encode(), etag='"v1"')
+    descarga = DescargaCondicional(reintentos=0)
+
+    contenido, version = descarga.descargar(servidor_hoja['url'])
+    assert contenido == servidor_hoja['cuerpo']
+    descarga.confirmar(servidor_hoja['url'], version)
+
+    assert descarga.descargar(servidor_hoja['url']) == (None, version)
+    assert servidor_hoja['peticiones'][-1].get('If-None-Match') == '"v1"'
+
+
+def test_descarga_condicional_mismo_hash_sin_etag(servidor_hoja):
+    servidor_hoja.update(cuerpo=filas_borde().to_csv(index=False).encode())
+    descarga = DescargaCondicional(reintentos=0)
+
+    contenido, version = descarga.descargar(servidor_hoja['url'])
+    assert contenido is not None
+    descarga.confirmar(servidor_hoja['url'], version)
+
+    # Sin ETag el servidor responde 200 con el mismo cuerpo: se detecta por el hash
+    assert descarga.descargar(servidor_hoja['url']) == (None, version)
+    # Una descarga no condicional siempre devuelve el contenido
+    assert descarga.descargar(servidor_hoja['url'], condicional=False) == (servidor_hoja['cuerpo'], version)
+
+
+def test_normalizacion_fallida_no_confirma_validadores(servidor_hoja, monkeypatch):
+    descarga = DescargaCondicional(reintentos=0)
+    monkeypatch.setattr(motor_pagos, '_descarga_http', descarga)
+    fuente = FuenteGoogleSheets()
+    fuente.url = servidor_hoja['url']
+    ledger = LedgerPrueba(fuente)
+
+    servidor_hoja.update(cuerpo=filas_borde().to_csv(index=False).encode(), etag='"v1"')
+    assert ledger.cargar_datos()
+    assert descarga.validadores[fuente.url]['etag'] == '"v1"'
+
+    servidor_hoja.update(cuerpo=filas_borde().iloc[:5].to_csv(index=False).encode(), etag='"v2"')
+
+    def fallar(*args, **kwargs):
+        raise ValueError("hoja ilegible")
+
+    with monkeypatch.context() as parche:
+        parche.setattr(motor_pagos, 'normalizar_ledger', fallar)
+        assert not ledger.cargar_datos()
+    # Siguen los validadores y los datos de la versión anterior
+    assert descarga.validadores[fuente.url]['etag'] == '"v1"'
+    assert len(ledger.df) == 10
+
+    # El próximo refresco vuelve a descargar la versión nueva en lugar de recibir un 304
+    assert ledger.cargar_datos()
+    assert servidor_hoja['peticiones'][-1].get('If-None-Match') == '"v1"'
+    assert descarga.validadores[fuente.url]['etag'] == '"v2"'
+    assert len(ledger.df) == 5
+
+
+def ledger_reglas(*filas):
+    """Ledger mínimo para compilar reglas: (doctor, procedimiento, fecha) por fila"""
+    doctores, procedimientos, fechas = zip(*filas)
+    return pd.DataFrame({
+        'doctor_a_pagar': list(doctores),
+        'procedimiento': list(procedimientos),
+        'fecha': pd.to_datetime(list(fechas), format='ISO8601').astype('datetime64[ns]'),
+    })
+
+
+def test_reglas_la_mas_especifica_gana():
+    reglas = ReglasPago([
+        {'doctor': ' DR. A ', 'procedimiento': 'Implante', 'retencion': '5'},
+        {'doctor': 'Dr. A', 'retencion': '20%'},
+        {'retencion': '15'},
+    ])
+    df = ledger_reglas(('Dr. A', 'Implante', '2024-01-10'), ('Dr. A', 'Limpieza', '2024-01-10'),
+                       ('Dr. B', 'Implante', '2024-01-10'))
+    np.testing.assert_array_equal(reglas.compilar(df)['retencion'], [0.05, 0.20, 0.15])
+
+
+def test_reglas_la_vigencia_mas_reciente_gana():
+    # La regla de marzo va primero en el archivo: el orden lo decide vigente_desde
+    reglas = ReglasPago([
+        {'doctor': 'Dr. A', 'vigente_desde': '2024-03-01', 'porcentaje_defecto': '60'},
+        {'doctor': 'Dr. A', 'vigente_desde': '2024-01-01', 'porcentaje_defecto': '40'},
+    ])
+    df = ledger_reglas(*[('Dr. A', 'Consulta', fecha) for fecha in ('2023-12-31', '2024-02-15', '2024-03-01', '2024-06-01')])
+    np.testing.assert_array_equal(reglas.compilar(df)['porcentaje_defecto'], [0.50, 0.40, 0.60, 0.60])
+
+
+def test_reglas_vigente_hasta_incluye_todo_el_dia():
+    reglas = ReglasPago([{'vigente_hasta': '2024-01-31', 'cargo_ars': '5'}])
+    df = ledger_reglas(*[('Dr. A', 'Consulta', fecha) for fecha in ('2024-01-31', '2024-01-31 23:59', '2024-02-01')])
+    np.testing.assert_array_equal(reglas.compilar(df)['cargo_ars'], [0.05, 0.05, 0.10])
+
+
+def test_reglas_filas_sin_fecha_toman_el_ultimo_periodo():
+    reglas = ReglasPago([
+        {'vigente_hasta': '2024-01-31', 'cargo_ars': '5'},
+        {'vigente_desde': '2024-06-01', 'comision_referidor': '8'},
+    ])
+    df = ledger_reglas(('Dr. A', 'Consulta', None), ('Dr. A', 'Consulta', '2024-01-15'))
+    tasas = reglas.compilar(df)
+    np.testing.assert_array_equal(tasas['cargo_ars'], [0.10, 0.05])
+    np.testing.assert_array_equal(tasas['comision_referidor'], [0.08, 0.10])
+
+
+def test_regla_parcial_conserva_las_demas_tasas():
+    reglas = ReglasPago([{'doctor': 'Dr. A', 'comision_referidor': '12'}, {'retencion': '15'}])
+    tasas = reglas.compilar(ledger_reglas(('Dr. A', 'Consulta', '2024-01-10')))
+    assert tasas['comision_referidor'][0] == 0.12
+    assert tasas['retencion'][0] == 0.15
+    assert tasas['cargo_ars'][0] == 0.10
+    assert tasas['porcentaje_defecto'][0] == 0.50
+    assert np.isnan(tasas['porcentaje'][0])
+
+
+def test_reglas_invalidas_conservan_las_anteriores(tmp_path, caplog):
+    ruta_reglas = tmp_path / 'reglas.csv'
+    ruta_reglas.write_text("doctor,retencion\nDr. María Gómez,15\n", encoding='utf-8')
+    ledger = ledger_desde(tmp_path, filas_borde(), ReglasPago.desde_archivo(str(ruta_reglas)))
+    huella, version = ledger.reglas.huella, ledger.version_resultados
+
+    ruta_reglas.write_text("doctor,retencion,bono\nDr. María Gómez,abc,1\n", encoding='utf-8')
+    os.utime(ruta_reglas, ns=(os.stat(ruta_reglas).st_atime_ns, os.stat(ruta_reglas).st_mtime_ns + 10**9))
+    assert ledger.refrescar_datos()
+    assert "Reglas de pago inválidas" in caplog.text
+    assert ledger.reglas.huella == huella
+    assert ledger.version_resultados == version
+    np.testing.assert_array_equal(ledger.reglas.compilar(ledger.df)['retencion'], 0.15)